@@ -4,6 +4,9 @@ from discord.ext import commands
 import os
 import asyncio
 import google.generativeai as genai
+from cogs import _memory_store as memory_store
+from cogs import _persona_manager as persona_manager
+from cogs._http import http_client
 
 # Botの基本的な設定
 intents = discord.Intents.default()
@@ -16,6 +19,9 @@ async def setup_hook():
     # GoogleのAIモデルを設定
     genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
     print("Google Generative AI configured.")
+    # 長期記憶は起動時に一度だけメモリへ読み込む
+    memory_store.load()
+    persona_manager.refresh()
     # cogsフォルダ内の全Cogを読み込む
     print('------------------------------------------------------')
     for filename in os.listdir('./cogs'):
@@ -56,8 +62,13 @@ async def main():
         print("Error: DISCORD_BOT_TOKEN is not set in environment variables.")
         return
     
-    async with bot:
-        await bot.start(token)
+    try:
+        async with bot:
+            await bot.start(token)
+    finally:
+        # 書き出し待ちの記憶を必ずディスクに残す
+        memory_store.close()
+        await http_client.close()
 
 if __name__ == "__main__":
     try:
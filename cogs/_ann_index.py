@@ -0,0 +1,182 @@
+# cogs/_ann_index.py (メモの近似最近傍検索 - IVF方式)
+import os
+import math
+import tempfile
+import numpy as np
+
+class IVFIndex:
+    """
+    転置ファイル(IVF)方式の近似最近傍インデックス。
+    ベクトル本体は NoteIndex の行列を参照し、ここではクラスタ中心とメモの所属だけを持つ。
+    n_probe を増やすほど再現率が上がり、そのぶん遅くなる。
+    """
+
+    def __init__(self, path: str = None, n_probe: int = 8, min_size: int = 20000, max_train_samples: int = 50000, kmeans_iters: int = 10):
+        self.path = path
+        self.n_probe = n_probe
+        self.min_size = min_size
+        self.max_train_samples = max_train_samples
+        self.kmeans_iters = kmeans_iters
+        self.centroids = None
+        self.lists = []        # [set(note_id), ...]
+        self.assignment = {}   # {note_id: リスト番号}
+        self.trained_size = 0
+        self.dirty = False  # ディスクの内容と違うか（学習し直したときだけ立てる）
+        self.generation = 0
+
+    def reset(self):
+        self.centroids = None
+        self.lists = []
+        self.assignment = {}
+        self.trained_size = 0
+        self.dirty = False
+        self.generation += 1  # 裏で学習中の結果を、捨てたあとのインデックスに差し込まないため
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def should_use(self, size: int):
+        """件数が少ないうちは全件検索のほうが速くて正確なので使わない"""
+        return self.trained and size >= self.min_size
+
+    def needs_training(self, size: int):
+        return size >= self.min_size and (not self.trained or size > self.trained_size * 4)
+
+    # -------------------- 学習 --------------------
+    def fit(self, vectors, note_ids):
+        """
+        球面k-meansでクラスタ中心を作り、(centroids, {note_id: リスト番号}) を返す。
+        自分の状態は変えないので、行列のコピーを渡せば別スレッドで動かしてよい。
+        """
+        size = len(note_ids)
+        n_lists = max(1, int(math.sqrt(size)))
+        rng = np.random.default_rng(0)
+        sample_rows = rng.choice(size, size=min(size, self.max_train_samples), replace=False)
+        sample = vectors[sample_rows]
+        centroids = sample[rng.choice(len(sample), size=min(n_lists, len(sample)), replace=False)].copy()
+        for _ in range(self.kmeans_iters):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(len(centroids)):
+                members = sample[labels == c]
+                if len(members) == 0:
+                    # 空になったクラスタはランダムなサンプルで埋め直す
+                    centroids[c] = sample[rng.integers(len(sample))]
+                    continue
+                mean = members.sum(axis=0)
+                norm = np.linalg.norm(mean)
+                if norm > 0: centroids[c] = mean / norm
+        centroids = centroids.astype(np.float32)
+        assignment = {}
+        for start in range(0, size, 65536):
+            labels = np.argmax(vectors[start:min(size, start + 65536)] @ centroids.T, axis=1)
+            for offset, label in enumerate(labels.tolist()):
+                assignment[note_ids[start + offset]] = label
+        return centroids, assignment
+
+    def install(self, centroids, assignment, trained_size, matrix):
+        """fit の結果に差し替える。学習中に消えたメモは外し、増えたメモは割り当てる"""
+        self.centroids = centroids
+        self.lists = [set() for _ in range(len(centroids))]
+        self.assignment = {}
+        for note_id, label in assignment.items():
+            if note_id in matrix.row_of:
+                self.lists[label].add(note_id)
+                self.assignment[note_id] = label
+        for row in range(matrix.size):
+            self.add(matrix.note_ids[row], matrix.vectors[row])
+        self.trained_size = trained_size
+        self.dirty = True
+
+    def train(self, matrix):
+        """行列の中身でその場で学習し直す（イベントループ外やベンチマーク用）"""
+        size = matrix.size
+        if size == 0: return
+        centroids, assignment = self.fit(matrix.vectors[:size], list(matrix.note_ids))
+        self.install(centroids, assignment, size, matrix)
+        print(f"IVF note index trained: {size} notes, {len(centroids)} lists.")
+
+    # -------------------- 追加・削除 --------------------
+    def add(self, note_id, unit_vec):
+        if not self.trained or note_id in self.assignment: return
+        label = int(np.argmax(self.centroids @ unit_vec))
+        self.lists[label].add(note_id)
+        self.assignment[note_id] = label
+
+    def remove(self, note_id):
+        label = self.assignment.pop(note_id, None)
+        if label is None: return
+        self.lists[label].discard(note_id)
+
+    # -------------------- 検索 --------------------
+    def candidate_rows(self, matrix, unit_query, n_probe: int = None):
+        """クエリに近いクラスタを n_probe 個選び、そこに属するメモの行番号を返す"""
+        n_probe = min(n_probe or self.n_probe, len(self.lists))
+        centroid_scores = self.centroids @ unit_query
+        if n_probe < len(self.lists):
+            probe = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        else:
+            probe = range(len(self.lists))
+        rows = matrix.row_of
+        return np.fromiter((rows[note_id] for label in probe for note_id in self.lists[label]), dtype=np.int64)
+
+    # -------------------- 永続化 --------------------
+    # 保存するのはクラスタ中心と所属だけ。学習後に増減したメモは読み込み時に突き合わせるので、
+    # ファイルを書き直すのは学習し直したときだけでよい
+    def snapshot(self):
+        """保存する内容を配列にして返す。変更がなければNone"""
+        if not self.path or not self.trained or not self.dirty: return None
+        return {
+            "centroids": self.centroids,
+            "note_ids": np.fromiter(self.assignment.keys(), dtype=np.int64, count=len(self.assignment)),
+            "labels": np.fromiter(self.assignment.values(), dtype=np.int32, count=len(self.assignment)),
+            "trained_size": np.int64(self.trained_size),
+        }
+
+    def write(self, snapshot) -> bool:
+        """snapshot をアトミックに書き出す。ファイル操作だけなので別スレッドで呼んでよい"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.npz', dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **snapshot)
+            os.replace(tmp_path, self.path)
+            return True
+        except OSError as e:
+            print(f"Failed to save IVF note index: {e}")
+            return False
+
+    def save(self):
+        snapshot = self.snapshot()
+        if snapshot is not None and self.write(snapshot): self.dirty = False
+
+    def read(self):
+        """保存済みのファイルを読んで (centroids, note_ids, labels, trained_size) を返す。なければNone"""
+        if not self.path or not os.path.exists(self.path): return None
+        try:
+            with np.load(self.path) as data:
+                return data['centroids'], data['note_ids'], data['labels'], int(data['trained_size'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: IVF note index file is unreadable, rebuilding: {e}")
+            return None
+
+    def restore(self, saved, matrix):
+        """read の結果を取り込み、行列との差分（追加・削除されたメモ）を反映する"""
+        if saved is None: return False
+        centroids, note_ids, labels, trained_size = saved
+        if centroids.ndim != 2 or centroids.shape[1] != matrix.vectors.shape[1]: return False
+        self.centroids = centroids.astype(np.float32)
+        self.lists = [set() for _ in range(len(centroids))]
+        self.assignment = {}
+        for note_id, label in zip(note_ids.tolist(), labels.tolist()):
+            if note_id in matrix.row_of and 0 <= label < len(self.lists):
+                self.lists[label].add(note_id)
+                self.assignment[note_id] = label
+        for row in range(matrix.size):
+            self.add(matrix.note_ids[row], matrix.vectors[row])
+        self.trained_size = trained_size
+        self.dirty = False
+        return True
+
+    def load(self, matrix):
+        return self.restore(self.read(), matrix)
@@ -0,0 +1,101 @@
+# cogs/_answer_cache.py (検索して作った回答の意味的キャッシュ - 似た質問にはそのまま同じ回答を返す)
+import os
+import time
+import numpy as np
+from collections import OrderedDict
+
+# -------------------- 設定項目 --------------------
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.93))  # これ以上似ていれば同じ質問とみなす
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', 1800))              # 回答を使い回してよい秒数
+ANSWER_CACHE_MAX_ENTRIES = 500
+# ------------------------------------------------
+
+class SemanticAnswerCache:
+    """
+    (質問の埋め込み, スコープ) をキーに回答を覚えておく。スコープにはペルソナIDを含めること。
+    埋め込み同士のコサイン類似度が閾値以上の既存エントリがあれば、その回答を返す。
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {entry_id: {"scope", "vector", "answer", "stored_at", "cost"}}
+        self._matrices = {}            # {scope: (entry_ids, 正規化済みベクトルの行列)}  検索時に作り直す
+        self._next_id = 0
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0, "invalidations": 0, "saved_seconds": 0.0}
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        expired = [entry_id for entry_id, entry in self._entries.items() if entry["stored_at"] < cutoff]
+        for entry_id in expired:
+            self._matrices.pop(self._entries.pop(entry_id)["scope"], None)
+
+    def _matrix(self, scope):
+        cached = self._matrices.get(scope)
+        if cached is None:
+            ids = [entry_id for entry_id, entry in self._entries.items() if entry["scope"] == scope]
+            vectors = np.stack([self._entries[entry_id]["vector"] for entry_id in ids]) if ids else None
+            cached = self._matrices[scope] = (ids, vectors)
+        return cached
+
+    def lookup(self, embedding, scope: str):
+        """似た質問の回答があれば (回答, 類似度) を、なければNoneを返す"""
+        self.stats["lookups"] += 1
+        if embedding is None:
+            self.stats["misses"] += 1
+            return None
+        self._expire()
+        ids, vectors = self._matrix(scope)
+        if vectors is None:
+            self.stats["misses"] += 1
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        similarities = vectors @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            self.stats["misses"] += 1
+            return None
+        entry_id = ids[best]
+        entry = self._entries[entry_id]
+        self._entries.move_to_end(entry_id)
+        self.stats["hits"] += 1
+        self.stats["saved_seconds"] += entry["cost"]
+        return entry["answer"], float(similarities[best])
+
+    def store(self, embedding, scope: str, answer: str, cost: float = 0.0):
+        """cost には回答を作るのにかかった秒数を渡す（ヒット時の短縮時間として集計する）"""
+        if embedding is None or not answer: return
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        self._entries[self._next_id] = {"scope": scope, "vector": vector, "answer": answer, "stored_at": time.monotonic(), "cost": cost}
+        self._next_id += 1
+        self._matrices.pop(scope, None)
+        self.stats["stores"] += 1
+        while len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._matrices.pop(evicted["scope"], None)
+            self.stats["evictions"] += 1
+
+    def bypass(self):
+        """このリクエストではキャッシュを使わなかったことを記録する"""
+        self.stats["bypassed"] += 1
+
+    def invalidate(self):
+        """ペルソナが変わったときなどに全部捨てる"""
+        self._entries.clear()
+        self._matrices.clear()
+        self.stats["invalidations"] += 1
+
+    def get_stats(self):
+        lookups = self.stats["lookups"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "avg_saved_ms": round(self.stats["saved_seconds"] / self.stats["hits"] * 1000, 1) if self.stats["hits"] else 0.0,
+        }
+
+
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,154 @@
+# cogs/_backfill.py (過去ログ学習パイプライン - 並列読み込み＆まとめ書き込み＆再開対応)
+import os
+import time
+import asyncio
+import discord
+from ._json_state import JsonStateFile
+
+# -------------------- 設定項目 --------------------
+DATA_DIR = os.getenv('RAILWAY_VOLUME_MOUNT_PATH', '.')
+CHECKPOINT_FILE = os.path.join(DATA_DIR, 'backfill_checkpoints.json')
+READER_CONCURRENCY = 4  # 同時に履歴を読むチャンネル数
+WRITE_BATCH_SIZE = 100  # 1回のDB書き込みでまとめる件数
+QUEUE_SIZE = 1000       # 読み込みと書き込みの間のバッファ
+PROGRESS_INTERVAL = 3.0 # 進捗メッセージを更新する間隔(秒)
+# ------------------------------------------------
+
+_DONE = object()
+
+class _ChannelComplete:
+    """チャンネルの最初のメッセージまで読み切ったことを書き込み側に知らせる目印"""
+    def __init__(self, channel_id):
+        self.channel_id = channel_id
+
+class BackfillPipeline:
+    """
+    チャンネル履歴の読み込み → 有界キュー → まとめて重複チェック・ベクトル化・DB追加、の流れで過去ログを取り込む。
+    チャンネルごとに「どこまで遡ったか」「どこまで新しい発言を取り込んだか」を保存しておき、
+    次回は前回より後の発言と、前回の続きの古い発言の両方を読む。
+    """
+
+    def __init__(self, db_manager, channels, limit: int, resume: bool = True, progress_callback=None):
+        self.db_manager = db_manager
+        self.channels = channels
+        self.limit = limit
+        self.resume = resume
+        self.progress_callback = progress_callback
+        self.checkpoints = JsonStateFile(CHECKPOINT_FILE)
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.processed = 0
+        self.added = 0
+        self.channels_done = 0
+        self.started_at = None
+        self._stalled = set()  # 保存に失敗して、この回はチェックポイントを進めない (channel_id, 遡る向きか)
+
+    @property
+    def throughput(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    async def run(self):
+        self.started_at = time.monotonic()
+        if not self.resume:
+            self.checkpoints.replace({})
+        semaphore = asyncio.Semaphore(READER_CONCURRENCY)
+        readers = [asyncio.create_task(self._read_channel(channel, semaphore)) for channel in self.channels]
+        writer = asyncio.create_task(self._write_loop())
+        reporter = asyncio.create_task(self._report_loop())
+        reading = asyncio.ensure_future(asyncio.gather(*readers))
+        try:
+            # 書き込み側が先に落ちたら、キュー待ちの読み込み側を道連れにして止める
+            await asyncio.wait({reading, writer}, return_when=asyncio.FIRST_COMPLETED)
+            if writer.done(): writer.result()
+            await reading
+            await self.queue.put(_DONE)
+            await writer
+        finally:
+            for task in readers + [reading, writer]:
+                if not task.done(): task.cancel()
+            reporter.cancel()
+            self.checkpoints.flush()
+        return self
+
+    async def _read_channel(self, channel, semaphore):
+        async with semaphore:
+            checkpoint = self.checkpoints.data.get(str(channel.id), {}) if self.resume else {}
+            try:
+                # 前回より後に投稿された分（Botが止まっていた間の発言など）を古い順に読む
+                if checkpoint.get("newest_id"):
+                    async for message in channel.history(limit=self.limit, after=discord.Object(id=int(checkpoint["newest_id"])), oldest_first=True):
+                        await self.queue.put((message, False))
+                # 前回の続きから、さらに古い分を新しい順に読む
+                if checkpoint.get("complete"):
+                    self.channels_done += 1
+                    return
+                before = discord.Object(id=int(checkpoint["oldest_id"])) if checkpoint.get("oldest_id") else None
+                count = 0
+                async for message in channel.history(limit=self.limit, before=before):
+                    await self.queue.put((message, True))
+                    count += 1
+            except Exception as e:
+                print(f"Error backfilling channel {channel.name}: {e}")
+                return
+            # limitに届かなかった＝チャンネルの最初まで読み切った
+            if count < self.limit:
+                await self.queue.put(_ChannelComplete(channel.id))
+            self.channels_done += 1
+
+    async def _write_loop(self):
+        batch = []
+        while True:
+            item = await self.queue.get()
+            while True:
+                if item is _DONE:
+                    await self._commit(batch)
+                    return
+                if isinstance(item, _ChannelComplete):
+                    await self._commit(batch); batch = []
+                    if (item.channel_id, True) not in self._stalled:
+                        self._update_checkpoint(item.channel_id, complete=True)
+                else:
+                    batch.append(item)
+                    if len(batch) >= WRITE_BATCH_SIZE:
+                        await self._commit(batch); batch = []
+                if self.queue.empty(): break
+                item = self.queue.get_nowait()
+            # キューが空になったら、溜まっている分を待たずに書き込む
+            await self._commit(batch); batch = []
+
+    async def _commit(self, batch):
+        if not batch: return
+        added, failed = await self.db_manager.add_messages_to_db([message for message, _ in batch])
+        self.added += added
+        self.processed += len(batch)
+        # チェックポイントは、読んだ順に途切れなく保存できたところまでしか進めない。
+        # 保存に失敗したメッセージがあれば、そのチャンネル・その向きはこの回ではもう進めず、次回そこから読み直す
+        for message, backward in batch:
+            stream = (message.channel.id, backward)
+            if stream in self._stalled: continue
+            if message.id in failed:
+                self._stalled.add(stream); continue
+            if backward:
+                self._update_checkpoint(message.channel.id, oldest_id=message.id, newest_id=message.id)
+            else:
+                self._update_checkpoint(message.channel.id, newest_id=message.id)
+
+    def _update_checkpoint(self, channel_id, oldest_id=None, newest_id=None, complete=False):
+        data = self.checkpoints.data
+        entry = data.setdefault(str(channel_id), {})
+        if oldest_id is not None:
+            entry["oldest_id"] = str(min(int(entry.get("oldest_id", oldest_id)), oldest_id))
+        if newest_id is not None:
+            entry["newest_id"] = str(max(int(entry.get("newest_id", newest_id)), newest_id))
+        if complete: entry["complete"] = True
+        entry["updated_at"] = int(time.time())
+        self.checkpoints.mark_dirty()
+
+    async def _report_loop(self):
+        if not self.progress_callback: return
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            try:
+                await self.progress_callback(self)
+            except Exception as e:
+                print(f"Backfill progress update failed: {e}")
@@ -0,0 +1,74 @@
+# cogs/_cache.py (共通キャッシュ部品)
+import time
+import asyncio
+from collections import OrderedDict
+
+class LRUCache:
+    """件数・サイズ上限つきのLRUキャッシュ。ttlを指定すると期限切れのエントリは返さない"""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = None, ttl: float = None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda value: 0)
+        self._data = OrderedDict()  # {key: (value, 保存時刻, サイズ)}
+        self.total_bytes = 0
+
+    def get(self, key, default=None, allow_stale: bool = False):
+        entry = self._data.get(key)
+        if entry is None: return default
+        value, stored_at, _ = entry
+        if self.ttl is not None and time.monotonic() - stored_at > self.ttl and not allow_stale:
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def age(self, key):
+        """保存してからの経過秒数。なければNone"""
+        entry = self._data.get(key)
+        return None if entry is None else time.monotonic() - entry[1]
+
+    def set(self, key, value, age: float = 0.0):
+        """ageを渡すと「その秒数だけ前に保存した」扱いにする（ディスクから戻すとき用）"""
+        self.pop(key)
+        size = self.sizeof(value)
+        self._data[key] = (value, time.monotonic() - age, size)
+        self.total_bytes += size
+        while self._data and (len(self._data) > self.max_entries or (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        if entry is None: return default
+        self.total_bytes -= entry[2]
+        return entry[0]
+
+    def clear(self):
+        self._data.clear()
+        self.total_bytes = 0
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SingleFlight:
+    """同じキーの処理が実行中なら、新しく始めずにその結果を一緒に待つ"""
+
+    def __init__(self):
+        self._inflight = {}
+
+    def is_running(self, key):
+        return key in self._inflight
+
+    async def run(self, key, coro_factory):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # 待っている側がキャンセルされても、他の待ち手のために処理自体は止めない
+        return await asyncio.shield(task)
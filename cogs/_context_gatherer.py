@@ -0,0 +1,49 @@
+# cogs/_context_gatherer.py (応答用コンテキストの並列取得 - ソースごとの締め切り＆所要時間の記録)
+import time
+import asyncio
+
+# -------------------- 設定項目 --------------------
+DEFAULT_SOURCE_TIMEOUT = 4.0
+# ------------------------------------------------
+
+class ContextGatherer:
+    """
+    独立したコンテキスト取得処理を同時に走らせ、締め切りに間に合わなかったものや
+    失敗したものはプレースホルダーに置き換える。応答全体は一番遅いソース（の締め切り）で決まる。
+    """
+
+    def __init__(self, fallback: str = "（特になし）"):
+        self.fallback = fallback
+        self.stats = {}  # {source: {"calls", "timeouts", "errors", "total_ms", "max_ms"}}
+
+    async def fetch(self, name, awaitable, timeout: float = DEFAULT_SOURCE_TIMEOUT, fallback=None):
+        """1つのソースを締め切りつきで待つ。間に合わなければ fallback を返す"""
+        entry = self.stats.setdefault(name, {"calls": 0, "timeouts": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        entry["calls"] += 1
+        started_at = time.monotonic()
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            entry["timeouts"] += 1
+            print(f"Context source '{name}' timed out after {timeout}s.")
+            return fallback
+        except Exception as e:
+            entry["errors"] += 1
+            print(f"Context source '{name}' failed: {e}")
+            return fallback
+        finally:
+            elapsed = (time.monotonic() - started_at) * 1000
+            entry["total_ms"] += elapsed
+            entry["max_ms"] = max(entry["max_ms"], elapsed)
+
+    async def gather(self, sources):
+        """sources: {名前: (awaitable, 締め切り秒数)} → {名前: 結果 or fallback}"""
+        names = list(sources)
+        results = await asyncio.gather(*[self.fetch(name, *sources[name], fallback=self.fallback) for name in names])
+        return dict(zip(names, results))
+
+    def get_stats(self):
+        return {
+            name: {**entry, "avg_ms": round(entry["total_ms"] / entry["calls"], 1), "max_ms": round(entry["max_ms"], 1)}
+            for name, entry in self.stats.items() if entry["calls"]
+        }
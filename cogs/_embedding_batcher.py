@@ -0,0 +1,73 @@
+# cogs/_embedding_batcher.py (埋め込みリクエストのまとめ送り)
+import asyncio
+
+class EmbeddingBatcher:
+    """
+    短い時間窓に集まった埋め込みリクエストを task_type ごとに1回のAPI呼び出しへまとめる。
+    backend は async (texts: list[str], task_type: str) -> list[embedding] な関数。
+    """
+
+    def __init__(self, backend, window: float = 0.02, max_batch: int = 100):
+        self.backend = backend
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}  # {task_type: [(text, future), ...]}
+        self._timers = {}   # {task_type: TimerHandle}
+        self._tasks = set()  # 実行中のまとめ送り（ループは弱参照しか持たないので、ここで握っておく）
+        self.stats = {"requests": 0, "batches": 0, "fallback_items": 0, "errors": 0}
+
+    async def embed(self, text: str, task_type: str):
+        """1件分の埋め込みを返す。失敗したらその1件だけ例外になる"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self._pending.setdefault(task_type, [])
+        queue.append((text, future))
+        self.stats["requests"] += 1
+        if len(queue) >= self.max_batch:
+            self._dispatch(task_type)
+        elif task_type not in self._timers:
+            self._timers[task_type] = loop.call_later(self.window, self._dispatch, task_type)
+        return await future
+
+    def _dispatch(self, task_type):
+        timer = self._timers.pop(task_type, None)
+        if timer is not None: timer.cancel()
+        batch = self._pending.pop(task_type, [])
+        if not batch: return
+        task = asyncio.ensure_future(self._run_batch(task_type, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, task_type, batch):
+        self.stats["batches"] += 1
+        texts = [text for text, _ in batch]
+        try:
+            embeddings = await self.backend(texts, task_type)
+            if embeddings is None or len(embeddings) != len(batch):
+                raise ValueError(f"backend returned {0 if embeddings is None else len(embeddings)} embeddings for {len(batch)} texts")
+        except Exception as e:
+            if len(batch) == 1:
+                self._fail(batch[0][1], e)
+                return
+            # まとめて失敗したら1件ずつ送り直して、悪い1件が他を巻き込まないようにする
+            print(f"Embedding batch of {len(batch)} failed, retrying one by one: {e}")
+            self.stats["fallback_items"] += len(batch)
+            await asyncio.gather(*[self._run_single(task_type, text, future) for text, future in batch])
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done(): future.set_result(embedding)
+
+    async def _run_single(self, task_type, text, future):
+        try:
+            embeddings = await self.backend([text], task_type)
+            if not future.done(): future.set_result(embeddings[0])
+        except Exception as e:
+            self._fail(future, e)
+
+    def _fail(self, future, error):
+        self.stats["errors"] += 1
+        if not future.done(): future.set_exception(error)
+
+    def get_stats(self):
+        batches = self.stats["batches"]
+        return {**self.stats, "avg_batch_size": round(self.stats["requests"] / batches, 2) if batches else 0.0}
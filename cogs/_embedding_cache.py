@@ -0,0 +1,174 @@
+# cogs/_embedding_cache.py (埋め込みベクトルのキャッシュ - メモリLRU＋ディスク)
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from ._cache import LRUCache, SingleFlight
+
+# -------------------- 設定項目 --------------------
+DATA_DIR = os.getenv('RAILWAY_VOLUME_MOUNT_PATH', '.')
+CACHE_DB_FILE = os.path.join(DATA_DIR, 'embedding_cache.sqlite3')
+MEMORY_MAX_BYTES = 32 * 1024 * 1024  # メモリ側のベクトル合計サイズ上限
+MEMORY_MAX_ENTRIES = 20000
+DISK_MAX_ENTRIES = 200000  # ディスク側の件数上限（超えたら最後に使ったのが古いものから消す）
+DISK_PRUNE_EVERY = 1000    # 何件書き込むごとに件数上限を確かめるか
+# ------------------------------------------------
+
+def make_key(text: str, model: str, task_type: str):
+    return f"{hashlib.sha256(text.encode('utf-8')).hexdigest()}:{model}:{task_type}"
+
+class EmbeddingCache:
+    """
+    (テキストのハッシュ, モデル, task_type) をキーに、埋め込みをメモリとディスクの二段で覚えておく。
+    ディスク側は最後に使った時刻(accessed_at)で古いものから消すLRU。SQLiteの読み書きは専用スレッドで行う。
+    """
+
+    def __init__(self, path: str = CACHE_DB_FILE):
+        self.path = path
+        # ベクトルはfloat32のバイト列で持つ（Pythonのfloatリストより8倍ほど小さい）
+        self.memory = LRUCache(max_entries=MEMORY_MAX_ENTRIES, max_bytes=MEMORY_MAX_BYTES, sizeof=len)
+        self.inflight = SingleFlight()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0}
+        self._conn = None
+        self._lock = threading.Lock()
+        self._inserts_since_prune = 0
+        self._touched = set()  # メモリで当たったキー。次のディスク操作のついでに accessed_at を更新する
+        self._disk_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embedding-cache')
+
+    def _get_conn(self):
+        if self._conn is None:
+            try:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB NOT NULL, created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')), accessed_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')))")
+                # accessed_at がなかった頃のファイルは作成時刻で埋めておく
+                if "accessed_at" not in {row[1] for row in conn.execute("PRAGMA table_info(embeddings)")}:
+                    with conn:
+                        conn.execute("ALTER TABLE embeddings ADD COLUMN accessed_at INTEGER NOT NULL DEFAULT 0")
+                        conn.execute("UPDATE embeddings SET accessed_at = created_at")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_accessed_at ON embeddings (accessed_at)")
+                self._conn = conn
+            except sqlite3.Error as e:
+                print(f"Embedding cache disabled its disk tier: {e}")
+                self._conn = False
+        return self._conn
+
+    def _touch(self, key):
+        if len(self._touched) < MEMORY_MAX_ENTRIES: self._touched.add(key)
+
+    def _take_touched(self):
+        touched, self._touched = self._touched, set()
+        return touched
+
+    def _apply_touched(self, conn, touched, now):
+        if touched: conn.executemany("UPDATE embeddings SET accessed_at = ? WHERE key = ?", [(now, key) for key in touched])
+
+    def _disk_get(self, key, touched=()):
+        with self._lock:
+            conn = self._get_conn()
+            if not conn: return None
+            now = int(time.time())
+            try:
+                with conn:
+                    self._apply_touched(conn, touched, now)
+                    row = conn.execute("SELECT embedding FROM embeddings WHERE key = ?", (key,)).fetchone()
+                    if row: conn.execute("UPDATE embeddings SET accessed_at = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                print(f"Embedding cache read error: {e}")
+                return None
+        return row[0] if row else None
+
+    def _disk_put(self, key, blob, touched=()):
+        with self._lock:
+            conn = self._get_conn()
+            if not conn: return
+            now = int(time.time())
+            try:
+                with conn:
+                    self._apply_touched(conn, touched, now)
+                    conn.execute("INSERT OR REPLACE INTO embeddings (key, embedding, accessed_at) VALUES (?, ?, ?)", (key, blob, now))
+                    self._inserts_since_prune += 1
+                    if self._inserts_since_prune >= DISK_PRUNE_EVERY:
+                        self._inserts_since_prune = 0
+                        excess = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - DISK_MAX_ENTRIES
+                        if excess > 0:
+                            # accessed_at の索引を頭から読むだけなので、消す件数ぶんの手間で済む
+                            conn.execute("DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY accessed_at LIMIT ?)", (excess,))
+            except sqlite3.Error as e:
+                print(f"Embedding cache write error: {e}")
+
+    def _decode(self, blob):
+        vec = array('f')
+        vec.frombytes(blob)
+        return vec.tolist()
+
+    def get(self, key):
+        """キャッシュにあればベクトル(list)を返す。なければNone（ディスクをその場で読む同期版）"""
+        blob = self.memory.get(key)
+        if blob is not None:
+            self.stats["memory_hits"] += 1
+            self._touch(key)
+        else:
+            blob = self._disk_get(key, self._take_touched())
+            if blob is None: return None
+            self.stats["disk_hits"] += 1
+            self.memory.set(key, blob)
+        return self._decode(blob)
+
+    async def get_async(self, key):
+        """get と同じだが、ディスクの読み込みは専用スレッドで待つ"""
+        blob = self.memory.get(key)
+        if blob is not None:
+            self.stats["memory_hits"] += 1
+            self._touch(key)
+        else:
+            loop = asyncio.get_running_loop()
+            blob = await loop.run_in_executor(self._disk_pool, self._disk_get, key, self._take_touched())
+            if blob is None: return None
+            self.stats["disk_hits"] += 1
+            self.memory.set(key, blob)
+        return self._decode(blob)
+
+    def put(self, key, embedding):
+        """メモリにはすぐ入れ、ディスクへの書き込みは専用スレッドに任せる（イベントループ外ならその場で書く）"""
+        blob = array('f', embedding).tobytes()
+        self.memory.set(key, blob)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._disk_put(key, blob, self._take_touched()); return
+        loop.run_in_executor(self._disk_pool, self._disk_put, key, blob, self._take_touched())
+
+    async def get_or_compute(self, text: str, model: str, task_type: str, compute):
+        """キャッシュになければ compute(text, task_type) で計算する。同じキーの同時リクエストは1回にまとめる"""
+        key = make_key(text, model, task_type)
+        cached = await self.get_async(key)
+        if cached is not None: return cached
+        if self.inflight.is_running(key):
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+
+        async def _compute():
+            embedding = await compute(text, task_type)
+            if embedding is not None: self.put(key, embedding)
+            return embedding
+
+        return await self.inflight.run(key, _compute)
+
+    def get_stats(self):
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"] + self.stats["coalesced"]
+        hits = lookups - self.stats["misses"]
+        return {**self.stats, "memory_entries": len(self.memory), "memory_bytes": self.memory.total_bytes, "hit_rate": round(hits / lookups, 4) if lookups else 0.0}
+
+    def close(self):
+        self._disk_pool.shutdown(wait=True)
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+            self._conn = None
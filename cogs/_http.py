@@ -0,0 +1,91 @@
+# cogs/_http.py (共有の非同期HTTPクライアント - コネクションプール＆リトライ付き)
+import os
+import random
+import asyncio
+import aiohttp
+
+# -------------------- 設定項目 --------------------
+HTTP_TOTAL_TIMEOUT = float(os.getenv('HTTP_TOTAL_TIMEOUT', 10))   # 1リクエストの制限時間(秒)
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_PER_HOST = int(os.getenv('HTTP_MAX_PER_HOST', 8))        # 同じホストへの同時接続数
+HTTP_RETRIES = 2               # 失敗時の再試行回数
+HTTP_BACKOFF_BASE = 0.5        # 再試行までの待ち時間の基準(秒)
+HTTP_BACKOFF_MAX = 5.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+# ------------------------------------------------
+
+class HttpError(Exception):
+    """2xx以外のレスポンスが返ってきたとき（再試行し尽くした後）に投げる"""
+
+    def __init__(self, status: int, url: str, body: str = ""):
+        super().__init__(f"HTTP {status} for {url}" + (f": {body}" if body else ""))
+        self.status = status
+        self.url = url
+
+
+class HttpClient:
+    """Bot全体で使い回すaiohttpセッション。接続はkeep-aliveで再利用される"""
+
+    def __init__(self, retries: int = HTTP_RETRIES):
+        self.retries = retries
+        self._session = None
+        self.stats = {"requests": 0, "retries": 0, "errors": 0}
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=HTTP_MAX_CONNECTIONS, limit_per_host=HTTP_MAX_PER_HOST, ttl_dns_cache=300)
+            timeout = aiohttp.ClientTimeout(total=HTTP_TOTAL_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers={'User-Agent': USER_AGENT})
+        return self._session
+
+    def _backoff(self, attempt: int, retry_after: str = None):
+        if retry_after:
+            try: return min(float(retry_after), HTTP_BACKOFF_MAX)
+            except ValueError: pass
+        # フルジッター: 同時に失敗したリクエストが一斉に再送しないようにばらつかせる
+        return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+    async def request(self, method: str, url: str, reader, *, params=None, headers=None, timeout: float = None):
+        """reader(response) の結果を返す。接続エラー・タイムアウト・429/5xxは再試行する"""
+        session = await self._get_session()
+        request_timeout = aiohttp.ClientTimeout(total=timeout, connect=HTTP_CONNECT_TIMEOUT) if timeout else None
+        for attempt in range(self.retries + 1):
+            self.stats["requests"] += 1
+            try:
+                async with session.request(method, url, params=params, headers=headers, timeout=request_timeout) as response:
+                    if response.status in RETRY_STATUSES and attempt < self.retries:
+                        self.stats["retries"] += 1
+                        delay = self._backoff(attempt, response.headers.get('Retry-After'))
+                        # 待っている間に接続を握り続けないよう、本文を捨てて接続をプールに返してから待つ
+                        response.release()
+                    else:
+                        if response.status >= 400:
+                            body = (await response.text(errors='replace'))[:200]
+                            raise HttpError(response.status, str(response.url), body)
+                        return await reader(response)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.retries:
+                    self.stats["errors"] += 1
+                    raise
+                self.stats["retries"] += 1
+                delay = self._backoff(attempt)
+            except HttpError:
+                self.stats["errors"] += 1
+                raise
+            await asyncio.sleep(delay)
+
+    async def get_json(self, url: str, **kwargs):
+        return await self.request('GET', url, lambda response: response.json(content_type=None), **kwargs)
+
+    async def get_bytes(self, url: str, **kwargs):
+        return await self.request('GET', url, lambda response: response.read(), **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+http_client = HttpClient()
@@ -0,0 +1,70 @@
+# cogs/_intervention_gate.py (自発的な割り込みの段階的な足切り - 文字n-gram → チャンネルごとの予算 → 埋め込み類似度)
+import time
+
+# -------------------- 設定項目 --------------------
+LEXICAL_MIN_SHARED = 2          # どれかのメモとこれ以上の文字n-gramを共有していなければ、埋め込みを作らずに諦める
+CHECKS_PER_MINUTE = 2.0         # 1チャンネルあたり、1分間に埋め込みで確かめてよい回数（トークンバケット）
+CHECK_BURST = 3                 # 瞬間的に許す回数
+# ------------------------------------------------
+
+# 段階の並び（統計の表示順）。"passed" 以外はそこで落とされた数
+STAGES = ("cooldown", "too_short", "lexical", "budget", "no_embedding", "similarity", "passed")
+
+
+class InterventionGate:
+    """
+    割り込むかどうかの判定を安い順に並べる。文字n-gramの重なりがなければ即却下、
+    チャンネルの予算を使い切っていれば却下、そこまで通ったものだけ埋め込みを作ってメモと比べる。
+    """
+
+    def __init__(self, overlap, embed, search, threshold: float, min_shared: int = LEXICAL_MIN_SHARED,
+                 checks_per_minute: float = CHECKS_PER_MINUTE, burst: int = CHECK_BURST):
+        self.overlap = overlap  # (text) -> int
+        self.embed = embed      # async (text) -> embedding or None
+        self.search = search    # (embedding) -> [{'text', 'similarity'}]
+        self.threshold = threshold
+        self.min_shared = min_shared
+        self.rate = checks_per_minute / 60.0
+        self.burst = burst
+        self._buckets = {}  # {channel_id: (残りトークン, 最後に補充した時刻)}
+        self.stats = {stage: 0 for stage in STAGES}
+        self.embedding_calls = 0
+
+    def reject(self, stage: str):
+        """呼び出し側で済ませた判定（クールダウン・文字数）の却下も同じ統計に数える"""
+        self.stats[stage] += 1
+
+    def _take_budget(self, channel_id) -> bool:
+        now = time.monotonic()
+        tokens, refilled_at = self._buckets.get(channel_id, (float(self.burst), now))
+        tokens = min(self.burst, tokens + (now - refilled_at) * self.rate)
+        if tokens < 1:
+            self._buckets[channel_id] = (tokens, now)
+            return False
+        self._buckets[channel_id] = (tokens - 1, now)
+        return True
+
+    async def find_fact(self, channel_id, text: str):
+        """割り込みに使うメモの本文を返す。どこかの段階で落ちたらNone"""
+        if self.overlap(text) < self.min_shared:
+            self.reject("lexical"); return None
+        if not self._take_budget(channel_id):
+            self.reject("budget"); return None
+        self.embedding_calls += 1
+        embedding = await self.embed(text)
+        if embedding is None:
+            self.reject("no_embedding"); return None
+        notes = self.search(embedding)
+        if not notes or notes[0]['similarity'] <= self.threshold:
+            self.reject("similarity"); return None
+        self.stats["passed"] += 1
+        return notes[0]['text']
+
+    def get_stats(self):
+        considered = sum(self.stats.values()) - self.stats["cooldown"] - self.stats["too_short"]
+        return {
+            **self.stats,
+            "considered": considered,
+            "embedding_calls": self.embedding_calls,
+            "embedding_skip_rate": round(1 - self.embedding_calls / considered, 4) if considered else 0.0,
+        }
@@ -0,0 +1,61 @@
+# cogs/_json_state.py (JSON状態ファイルのメモリキャッシュ＆遅延書き込み)
+import os
+import json
+import asyncio
+import tempfile
+import threading
+
+class JsonStateFile:
+    """JSONファイルを一度だけ読み込んでメモリに保持し、変更はまとめてアトミックに書き出す"""
+
+    def __init__(self, path: str, flush_delay: float = 2.0):
+        self.path = path
+        self.flush_delay = flush_delay
+        self._data = None
+        self._dirty = False
+        self._flush_handle = None
+        self._lock = threading.RLock()
+
+    @property
+    def data(self):
+        with self._lock:
+            if self._data is None:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        self._data = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    self._data = {}
+            return self._data
+
+    def replace(self, data):
+        """中身を差し替えて、書き出しを予約する"""
+        with self._lock:
+            self._data = data
+            self.mark_dirty()
+
+    def mark_dirty(self):
+        with self._lock:
+            self._dirty = True
+            if self._flush_handle is not None: return
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush(); return
+            self._flush_handle = loop.call_later(self.flush_delay, self.flush)
+
+    def flush(self):
+        """一時ファイルに書いてからrenameするので、途中で落ちても壊れたJSONは残らない"""
+        with self._lock:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            if not self._dirty: return
+            directory = os.path.dirname(os.path.abspath(self.path))
+            try:
+                fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.json', dir=directory)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self._data, f, indent=4, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                print(f"Failed to write {self.path}: {e}")
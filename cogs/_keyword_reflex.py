@@ -0,0 +1,144 @@
+# cogs/_keyword_reflex.py (ペルソナごとのキーワード反射 - Aho–Corasickで全キーワードを1回の走査で照合＆チャンネルごとのクールダウン)
+import time
+from collections import deque
+
+# -------------------- 設定項目 --------------------
+REFLEX_DEFAULT_COOLDOWN = 30.0  # 同じ反射を同じチャンネルで再び使えるまでの秒数（反射ごとに "cooldown" で上書きできる）
+# ------------------------------------------------
+
+class AhoCorasick:
+    """
+    複数のキーワードを1つのオートマトンにまとめ、本文を1回なぞるだけで含まれているキーワードを全部見つける。
+    キーワードの数が増えても、照合にかかる時間は本文の長さにしか比例しない。
+    """
+
+    def __init__(self):
+        self._goto = [{}]     # 状態ごとの遷移 {文字: 次の状態}
+        self._fail = [0]      # 失敗時に戻る状態
+        self._output = [()]   # その状態で見つかったことになる値（失敗リンク先の分も含む）
+        self._built = False
+
+    def add(self, keyword: str, value):
+        if not keyword: return
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state] += (value,)
+        self._built = False
+
+    def build(self):
+        """幅優先で失敗リンクを張り、リンク先の出力を取り込んでおく"""
+        queue = deque(self._goto[0].values())
+        for state in queue: self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]: fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] += self._output[self._fail[next_state]]
+                queue.append(next_state)
+        self._built = True
+        return self
+
+    def find_all(self, text: str):
+        """本文に含まれるキーワードの値を重複なしで返す"""
+        if not self._built: self.build()
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]: state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]: found.update(output[state])
+        return found
+
+    def __len__(self):
+        return len(self._goto)
+
+
+class ReflexEngine:
+    """
+    ペルソナJSONの "reflexes" をコンパイルしたもの。各反射は
+    {"keywords": [...], "response": "...", "priority": 0, "cooldown": 秒数} の形。
+    複数ヒットしたら priority の大きいもの、同じなら先に書かれたものを使う。クールダウン中のものは飛ばす。
+    """
+
+    def __init__(self, reflexes, default_cooldown: float = REFLEX_DEFAULT_COOLDOWN):
+        self.reflexes = []
+        self._automaton = AhoCorasick()
+        for reflex in reflexes or []:
+            if not isinstance(reflex, dict) or not reflex.get("response"): continue
+            keywords = [k for k in reflex.get("keywords", []) if isinstance(k, str) and k]
+            if not keywords: continue
+            index = len(self.reflexes)
+            self.reflexes.append({
+                "keywords": keywords,
+                "response": reflex["response"],
+                "priority": reflex.get("priority", 0),
+                "cooldown": float(reflex.get("cooldown", default_cooldown)),
+            })
+            for keyword in keywords: self._automaton.add(keyword, index)
+        self._automaton.build()
+        self._last_fired = {}  # {(channel_id, 反射の番号): 最後に使った時刻}
+        self.stats = {"messages": 0, "matched": 0, "fired": 0, "cooled_down": 0}
+
+    def match(self, channel_id, text: str):
+        """使うべき返事を返す。なければNone。返した反射はこのチャンネルでクールダウンに入る"""
+        self.stats["messages"] += 1
+        found = self._automaton.find_all(text)
+        if not found: return None
+        self.stats["matched"] += 1
+        now = time.monotonic()
+        for index in sorted(found, key=lambda i: (-self.reflexes[i]["priority"], i)):
+            reflex = self.reflexes[index]
+            key = (channel_id, index)
+            if now - self._last_fired.get(key, float('-inf')) < reflex["cooldown"]:
+                self.stats["cooled_down"] += 1
+                continue
+            self._last_fired[key] = now
+            self.stats["fired"] += 1
+            return reflex["response"]
+        return None
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "reflexes": len(self.reflexes),
+            "keywords": sum(len(r["keywords"]) for r in self.reflexes),
+            "states": len(self._automaton),
+        }
+
+
+if __name__ == "__main__":
+    # ベンチマーク: python -m cogs._keyword_reflex
+    import random
+    import timeit
+
+    random.seed(0)
+    alphabet = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをんアイウエオカキクケコｗ笑！？"
+    messages = ["".join(random.choices(alphabet, k=random.randint(10, 120))) for _ in range(1000)]
+    for n_triggers in (20, 1000, 5000):
+        reflexes = [{"keywords": ["".join(random.choices(alphabet, k=random.randint(3, 6)))], "response": f"r{i}", "cooldown": 0} for i in range(n_triggers)]
+        engine = ReflexEngine(reflexes)
+        pairs = [(k, r["response"]) for r in reflexes for k in r["keywords"]]
+
+        def naive():
+            for message in messages:
+                for keyword, response in pairs:
+                    if keyword in message: break
+
+        def compiled():
+            for message in messages: engine.match(0, message)
+
+        naive_ms = min(timeit.repeat(naive, number=1, repeat=3)) * 1000
+        compiled_ms = min(timeit.repeat(compiled, number=1, repeat=3)) * 1000
+        print(f"{n_triggers:>5} triggers / {len(messages)} messages: naive {naive_ms:8.1f}ms  aho-corasick {compiled_ms:6.1f}ms  ({engine.get_stats()['states']} states)")
@@ -0,0 +1,67 @@
+# cogs/_lexical_index.py (メモ本文の文字n-gram転置インデックス - 埋め込みを呼ぶ前の安い足切り用)
+import unicodedata
+
+# -------------------- 設定項目 --------------------
+NGRAM_SIZE = 2
+COMMON_GRAM_RATIO = 0.25    # これより多くのメモに出てくるn-gramは「ありふれている」として数えない
+COMMON_GRAM_MIN_NOTES = 20  # メモがこれ未満のうちは、ありふれたn-gramの除外をしない
+# ------------------------------------------------
+
+def _is_hiragana(char):
+    return '\u3041' <= char <= '\u309f'
+
+def _is_kanji(char):
+    return '\u4e00' <= char <= '\u9fff' or '\u3400' <= char <= '\u4dbf'
+
+def char_ngrams(text: str, n: int = NGRAM_SIZE):
+    """
+    NFKC正規化・小文字化して、文字と数字だけを残した文字n-gramの集合を返す。
+    ひらがなだけのn-gramは助詞や語尾ばかりなので捨て、代わりに漢字は1文字でも数える。
+    """
+    chars = [c for c in unicodedata.normalize('NFKC', text or "").lower() if c.isalnum()]
+    grams = {c for c in chars if _is_kanji(c)}
+    for i in range(len(chars) - n + 1):
+        gram = chars[i:i + n]
+        if not all(_is_hiragana(c) for c in gram): grams.add("".join(gram))
+    return grams
+
+
+class NgramIndex:
+    """{n-gram: そのn-gramを含むメモIDの集合} を持ち、発言と一番多く重なるメモの重なり数を返す"""
+
+    def __init__(self, n: int = NGRAM_SIZE):
+        self.n = n
+        self._postings = {}  # {gram: {note_id}}
+        self._grams = {}     # {note_id: frozenset(gram)}
+
+    def add(self, note_id, text):
+        if note_id in self._grams: return
+        grams = frozenset(char_ngrams(text, self.n))
+        self._grams[note_id] = grams
+        for gram in grams: self._postings.setdefault(gram, set()).add(note_id)
+
+    def remove(self, note_id):
+        for gram in self._grams.pop(note_id, ()):
+            postings = self._postings.get(gram)
+            if postings is None: continue
+            postings.discard(note_id)
+            if not postings: del self._postings[gram]
+
+    def clear(self):
+        self._postings = {}
+        self._grams = {}
+
+    def best_overlap(self, text) -> int:
+        """発言のn-gramのうち、1つのメモと共有している（ありふれていない）ものの最大数"""
+        total = len(self._grams)
+        if not total: return 0
+        common_cutoff = total * COMMON_GRAM_RATIO if total >= COMMON_GRAM_MIN_NOTES else total
+        shared = {}
+        for gram in char_ngrams(text, self.n):
+            postings = self._postings.get(gram)
+            if not postings or len(postings) > common_cutoff: continue
+            for note_id in postings: shared[note_id] = shared.get(note_id, 0) + 1
+        return max(shared.values(), default=0)
+
+    def __len__(self):
+        return len(self._grams)
@@ -0,0 +1,179 @@
+# cogs/_llm_dispatcher.py (LLM呼び出しの優先度付きディスパッチャ - 同時実行数・レート制限・429/5xxの自動待機)
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from google.api_core import exceptions as google_exceptions
+
+# -------------------- 設定項目 --------------------
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))     # 同時に投げるLLMリクエスト数
+LLM_RATE_PER_MINUTE = float(os.getenv('LLM_RATE_PER_MINUTE', 60))  # 1分あたりのリクエスト数の上限（トークンバケット）
+LLM_BURST = int(os.getenv('LLM_BURST', 10))                        # 瞬間的に許すリクエスト数
+LLM_RETRIES = 3
+LLM_BACKOFF_BASE = 2.0
+LLM_BACKOFF_MAX = 60.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# ------------------------------------------------
+
+# 優先度クラス（数字が小さいほど先に処理する）
+INTERACTIVE = 0   # ユーザーが返事を待っているもの（メンション応答、スラッシュコマンド）
+INTERVENTION = 1  # Botから自発的に話しかけるもの
+BACKGROUND = 2    # ムード分析・トピック抽出・記憶の整理など、遅れても困らないもの
+CLASS_NAMES = {INTERACTIVE: "interactive", INTERVENTION: "intervention", BACKGROUND: "background"}
+
+# クラスごとの待ち行列の上限。超えたら新しいリクエストは即座に諦める（Noneなら無制限）
+MAX_QUEUE_DEPTH = {INTERACTIVE: None, INTERVENTION: 5, BACKGROUND: 20}
+
+
+class LLMShedError(Exception):
+    """混雑のためリクエストを受け付けなかったときに投げる"""
+
+
+def _retryable_status(error):
+    if isinstance(error, google_exceptions.GoogleAPICallError) and error.code in RETRY_STATUSES:
+        return int(error.code)
+    return None
+
+
+class LLMDispatcher:
+    """
+    全CogのLLM呼び出しをここに集め、優先度の高いものから順に流す。
+    429を受けたら全体を一時停止し（連続するほど長く）、5xxはそのリクエストだけ間をおいて再試行する。
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, rate_per_minute: float = LLM_RATE_PER_MINUTE, burst: int = LLM_BURST):
+        self.max_concurrency = max_concurrency
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._consecutive_429 = 0
+        self._running = 0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._timer = None
+        self.queued = {priority: 0 for priority in CLASS_NAMES}
+        self.stats = {priority: {"submitted": 0, "completed": 0, "failed": 0, "shed": 0, "retries": 0, "max_queued": 0, "total_wait": 0.0, "total_run": 0.0} for priority in CLASS_NAMES}
+        self.rate_limited = 0
+
+    # ---------- スロット管理 ----------
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _schedule_pump(self, delay):
+        if self._timer is not None: return
+        self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._pump()
+
+    def _pump(self):
+        now = time.monotonic()
+        while self._waiters and self._running < self.max_concurrency:
+            future = self._waiters[0][2]
+            if future.done():
+                heapq.heappop(self._waiters); continue
+            if now < self._paused_until:
+                self._schedule_pump(self._paused_until - now); return
+            self._refill(now)
+            if self._tokens < 1:
+                self._schedule_pump((1 - self._tokens) / self.rate); return
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            self._running += 1
+            future.set_result(None)
+
+    async def _acquire(self, priority):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self.queued[priority] += 1
+        self.stats[priority]["max_queued"] = max(self.stats[priority]["max_queued"], self.queued[priority])
+        self._pump()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 枠をもらった直後にキャンセルされたら、枠を返しておく
+            if future.done() and not future.cancelled(): self._release()
+            raise
+        finally:
+            self.queued[priority] -= 1
+
+    def _release(self):
+        self._running -= 1
+        self._pump()
+
+    def _on_rate_limited(self):
+        self.rate_limited += 1
+        self._consecutive_429 += 1
+        pause = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** (self._consecutive_429 - 1))) * random.uniform(0.5, 1.0)
+        self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        print(f"LLM rate limited (429). Pausing all requests for {pause:.1f}s.")
+
+    # ---------- 公開API ----------
+    async def submit(self, priority: int, fn, *args, sheddable: bool = True, **kwargs):
+        """
+        await fn(*args, **kwargs) を優先度順に実行して結果を返す。
+        待ち行列が上限を超えていたら LLMShedError（sheddable=False なら必ず並ぶ）。
+        """
+        stats = self.stats[priority]
+        limit = MAX_QUEUE_DEPTH.get(priority)
+        if sheddable and limit is not None and self.queued[priority] >= limit:
+            stats["shed"] += 1
+            raise LLMShedError(f"{CLASS_NAMES[priority]} queue is full ({limit})")
+        stats["submitted"] += 1
+        for attempt in range(LLM_RETRIES + 1):
+            enqueued_at = time.monotonic()
+            await self._acquire(priority)
+            started_at = time.monotonic()
+            stats["total_wait"] += started_at - enqueued_at
+            try:
+                result = await fn(*args, **kwargs)
+                self._consecutive_429 = 0
+                stats["completed"] += 1
+                return result
+            except Exception as e:
+                status = _retryable_status(e)
+                if status is None or attempt >= LLM_RETRIES:
+                    stats["failed"] += 1
+                    raise
+                stats["retries"] += 1
+                if status == 429:
+                    self._on_rate_limited()
+                    delay = 0.0  # 全体の一時停止が明けるまで _pump が待たせる
+                else:
+                    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+            finally:
+                stats["total_run"] += time.monotonic() - started_at
+                self._release()
+            if delay: await asyncio.sleep(delay)
+
+    async def generate(self, model, contents, priority: int = INTERACTIVE, sheddable: bool = True, **kwargs):
+        """model.generate_content_async の優先度付き版。stream=True なら最初の塊が届いた時点で枠を返す"""
+        return await self.submit(priority, model.generate_content_async, contents, sheddable=sheddable, **kwargs)
+
+    def get_stats(self):
+        classes = {}
+        for priority, name in CLASS_NAMES.items():
+            entry = self.stats[priority]
+            attempts = entry["completed"] + entry["failed"] + entry["retries"]
+            classes[name] = {
+                **{k: v for k, v in entry.items() if k not in ("total_wait", "total_run")},
+                "queued": self.queued[priority],
+                "avg_wait_ms": round(entry["total_wait"] / attempts * 1000, 1) if attempts else 0.0,
+                "avg_run_ms": round(entry["total_run"] / attempts * 1000, 1) if attempts else 0.0,
+            }
+        return {
+            "classes": classes,
+            "running": self._running,
+            "max_concurrency": self.max_concurrency,
+            "rate_limited": self.rate_limited,
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 1),
+        }
+
+
+llm = LLMDispatcher()
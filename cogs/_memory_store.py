@@ -0,0 +1,344 @@
+# cogs/_memory_store.py (SQLite版 長期記憶ストア - メモリキャッシュ＆遅延書き込み付き)
+import os
+import json
+import sqlite3
+import asyncio
+import threading
+from array import array
+from ._note_index import NoteIndex
+from ._ann_index import IVFIndex
+
+# -------------------- 設定項目 --------------------
+DATA_DIR = os.getenv('RAILWAY_VOLUME_MOUNT_PATH', '.')
+DB_FILE = os.path.join(DATA_DIR, 'bot_memory.sqlite3')
+LEGACY_MEMORY_FILE = os.path.join(DATA_DIR, 'bot_memory.json')
+SERVER_SCOPE = '__server__'  # サーバー共有メモのowner_id
+FLUSH_DELAY = 2.0  # 変更をまとめてディスクに書き出すまでの待ち時間(秒)
+FLUSH_RETRY_MAX_DELAY = 60.0  # 書き出しに失敗したときの再挑戦の間隔の上限(秒)
+ENABLE_NOTE_ANN = True  # メモが多いとき、全メモ検索を近似検索(IVF)にする
+NOTE_ANN_FILE = os.path.join(DATA_DIR, 'note_ann_index.npz')
+NOTE_ANN_MIN_SIZE = 20000  # これ未満のメモ数なら全件検索のまま
+NOTE_ANN_N_PROBE = 8  # 大きいほど再現率が上がり、遅くなる
+# ------------------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    fixed_nickname TEXT
+);
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    embedding BLOB,
+    UNIQUE (owner_id, text)
+);
+CREATE INDEX IF NOT EXISTS idx_notes_owner ON notes (owner_id, id);
+CREATE TABLE IF NOT EXISTS relationships (
+    user_id TEXT NOT NULL,
+    partner_id TEXT NOT NULL,
+    interaction_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, partner_id)
+);
+CREATE TABLE IF NOT EXISTS relationship_topics (
+    user_id TEXT NOT NULL,
+    partner_id TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, partner_id, topic)
+);
+CREATE TABLE IF NOT EXISTS server_settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_conn = None
+_lock = threading.RLock()
+
+# 起動時に一度だけ読み込むメモリ上の状態。読み取りは全部ここから返す
+_notes = {}          # {owner_id: [{'id', 'text', 'embedding'}, ...]}
+_nicknames = {}      # {user_id: fixed_nickname}
+_settings = {}       # {key: value}
+_relationships = {}  # {user_id: {partner_id: {'topics': {topic: count}, 'interaction_count': n}}}
+_next_note_id = 1
+# メモの類似検索用（_notesと常に同じ内容を持つ）
+_note_index = NoteIndex(ann=IVFIndex(NOTE_ANN_FILE, n_probe=NOTE_ANN_N_PROBE, min_size=NOTE_ANN_MIN_SIZE) if ENABLE_NOTE_ANN else None)
+
+# まだディスクに書き出していない変更
+_new_notes = {}               # {note_id: (owner_id, text, embedding)}
+_deleted_note_ids = set()
+_dirty_users = set()
+_dirty_settings = set()
+_dirty_relationships = set()  # {(user_id, partner_id)}
+_flush_handle = None
+_flush_failures = 0  # 連続して書き出しに失敗した回数
+_ann_job = None  # 近似インデックスの読み込み・学習・保存を裏で実行中の Future
+_ann_rerun = False  # 実行中に次の手入れを頼まれたか
+
+def _encode_embedding(embedding):
+    if embedding is None: return None
+    return array('f', embedding).tobytes()
+
+def _decode_embedding(blob):
+    if blob is None: return None
+    vec = array('f')
+    vec.frombytes(blob)
+    return vec.tolist()
+
+def _get_conn():
+    """接続を遅延初期化して返す。初回だけJSONからの移行も行う"""
+    global _conn
+    with _lock:
+        if _conn is None:
+            conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            _migrate_legacy_json(conn)
+            _conn = conn
+            _load_cache(conn)
+        return _conn
+
+def load():
+    """起動時に呼んで、DBの内容をメモリに読み込んでおく"""
+    _get_conn()
+
+def _load_cache(conn):
+    global _next_note_id
+    _notes.clear(); _nicknames.clear(); _settings.clear(); _relationships.clear(); _note_index.clear()
+    for note_id, owner_id, text, blob in conn.execute("SELECT id, owner_id, text, embedding FROM notes ORDER BY id"):
+        embedding = _decode_embedding(blob)
+        _notes.setdefault(owner_id, []).append({'id': note_id, 'text': text, 'embedding': embedding})
+        _note_index.add(owner_id, note_id, text, embedding)
+    _nicknames.update({user_id: name for user_id, name in conn.execute("SELECT user_id, fixed_nickname FROM users") if name is not None})
+    _settings.update(dict(conn.execute("SELECT key, value FROM server_settings")))
+    for u1, u2, count in conn.execute("SELECT user_id, partner_id, interaction_count FROM relationships"):
+        _relationships.setdefault(u1, {})[u2] = {'topics': {}, 'interaction_count': count}
+    for u1, u2, topic, count in conn.execute("SELECT user_id, partner_id, topic, count FROM relationship_topics"):
+        _relationships.setdefault(u1, {}).setdefault(u2, {'topics': {}, 'interaction_count': 0})['topics'][topic] = count
+    row = conn.execute("SELECT MAX(id) FROM notes").fetchone()
+    _next_note_id = (row[0] or 0) + 1
+    _maintain_ann()
+
+def _migrate_legacy_json(conn):
+    """旧bot_memory.jsonがあれば、一度だけSQLiteへ取り込む"""
+    if conn.execute("SELECT 1 FROM server_settings WHERE key = 'migrated_from_json'").fetchone(): return
+    try:
+        with open(LEGACY_MEMORY_FILE, 'r', encoding='utf-8') as f:
+            legacy = json.load(f)
+    except FileNotFoundError:
+        legacy = None
+    except (OSError, json.JSONDecodeError) as e:
+        # 読めなかったファイルは消さずに残し、移行済みにもしない（直してから再起動すればやり直す）
+        print(f"ERROR: {LEGACY_MEMORY_FILE} could not be read, migration postponed until it is fixed: {e}")
+        return
+
+    with conn:
+        if legacy:
+            for user_id, user in legacy.get('users', {}).items():
+                conn.execute("INSERT OR IGNORE INTO users (user_id, fixed_nickname) VALUES (?, ?)", (user_id, user.get('fixed_nickname')))
+                for note in user.get('notes', []):
+                    conn.execute("INSERT OR IGNORE INTO notes (owner_id, text, embedding) VALUES (?, ?, ?)", (user_id, note['text'], _encode_embedding(note.get('embedding'))))
+            server = legacy.get('server', {})
+            for note in server.get('notes', []):
+                conn.execute("INSERT OR IGNORE INTO notes (owner_id, text, embedding) VALUES (?, ?, ?)", (SERVER_SCOPE, note['text'], _encode_embedding(note.get('embedding'))))
+            if server.get('current_persona'):
+                conn.execute("INSERT OR REPLACE INTO server_settings (key, value) VALUES ('current_persona', ?)", (server['current_persona'],))
+            # 古いバージョンは server の中に relationships を持っていたこともある
+            relationships = {**server.get('relationships', {}), **legacy.get('relationships', {})}
+            for u1, partners in relationships.items():
+                for u2, rel in partners.items():
+                    conn.execute("INSERT OR REPLACE INTO relationships (user_id, partner_id, interaction_count) VALUES (?, ?, ?)", (u1, u2, rel.get('interaction_count', 0)))
+                    for topic, count in rel.get('topics', {}).items():
+                        conn.execute("INSERT OR REPLACE INTO relationship_topics (user_id, partner_id, topic, count) VALUES (?, ?, ?, ?)", (u1, u2, topic, count))
+        conn.execute("INSERT OR REPLACE INTO server_settings (key, value) VALUES ('migrated_from_json', '1')")
+
+    if legacy is not None:
+        os.replace(LEGACY_MEMORY_FILE, LEGACY_MEMORY_FILE + '.migrated')
+        print(f"Migrated {LEGACY_MEMORY_FILE} into {DB_FILE}.")
+
+# -------------------- 遅延書き込み --------------------
+def _schedule_flush():
+    """変更を一定時間まとめてから1トランザクションで書き出す。イベントループ外なら即時書き出し"""
+    global _flush_handle
+    if _flush_handle is not None: return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        flush(); return
+    _flush_handle = loop.call_later(FLUSH_DELAY, flush)
+
+def _schedule_flush_retry():
+    """書き出しに失敗したら、失敗が続くほど間隔をあけて再挑戦する。ループ外（終了処理など）では何もしない"""
+    global _flush_handle
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    delay = min(FLUSH_RETRY_MAX_DELAY, FLUSH_DELAY * (2 ** _flush_failures))
+    _flush_handle = loop.call_later(delay, flush)
+
+def flush():
+    """溜まっている変更をすべてDBに書き出す。シャットダウン時にも呼ぶこと"""
+    global _flush_handle, _flush_failures
+    with _lock:
+        if _flush_handle is not None:
+            _flush_handle.cancel()
+            _flush_handle = None
+        if not (_new_notes or _deleted_note_ids or _dirty_users or _dirty_settings or _dirty_relationships): return
+        conn = _get_conn()
+        try:
+            with conn:
+                if _deleted_note_ids:
+                    conn.executemany("DELETE FROM notes WHERE id = ?", [(note_id,) for note_id in _deleted_note_ids])
+                if _new_notes:
+                    conn.executemany("INSERT OR IGNORE INTO notes (id, owner_id, text, embedding) VALUES (?, ?, ?, ?)",
+                                     [(note_id, owner_id, text, _encode_embedding(emb)) for note_id, (owner_id, text, emb) in _new_notes.items()])
+                if _dirty_users:
+                    conn.executemany("INSERT INTO users (user_id, fixed_nickname) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET fixed_nickname = excluded.fixed_nickname",
+                                     [(user_id, _nicknames.get(user_id)) for user_id in _dirty_users])
+                if _dirty_settings:
+                    conn.executemany("INSERT OR REPLACE INTO server_settings (key, value) VALUES (?, ?)", [(key, _settings[key]) for key in _dirty_settings])
+                for u1, u2 in _dirty_relationships:
+                    rel = _relationships[u1][u2]
+                    conn.execute("INSERT OR REPLACE INTO relationships (user_id, partner_id, interaction_count) VALUES (?, ?, ?)", (u1, u2, rel['interaction_count']))
+                    conn.executemany("INSERT OR REPLACE INTO relationship_topics (user_id, partner_id, topic, count) VALUES (?, ?, ?, ?)",
+                                     [(u1, u2, topic, count) for topic, count in rel['topics'].items()])
+        except sqlite3.Error as e:
+            # 変更はメモリに残しておき、しばらくしてから再挑戦する
+            _flush_failures += 1
+            print(f"Memory store flush error (attempt {_flush_failures}): {e}")
+            _schedule_flush_retry()
+            return
+        _flush_failures = 0
+        _new_notes.clear(); _deleted_note_ids.clear(); _dirty_users.clear(); _dirty_settings.clear(); _dirty_relationships.clear()
+        _maintain_ann()
+
+def _maintain_ann():
+    """近似インデックスの手入れ。イベントループ上では学習とファイル入出力をスレッドに回す"""
+    global _ann_job, _ann_rerun
+    if _note_index.ann is None: return
+    if _ann_job is not None:
+        _ann_rerun = True; return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _note_index.maintain_ann(); return
+    _ann_job = loop.run_in_executor(None, _note_index.maintain_ann_unlocked, _lock)
+    _ann_job.add_done_callback(_on_ann_job_done)
+
+def _on_ann_job_done(future):
+    global _ann_job, _ann_rerun
+    _ann_job = None
+    if not future.cancelled() and future.exception() is not None:
+        print(f"IVF note index maintenance failed: {future.exception()}")
+    if _ann_rerun:
+        _ann_rerun = False
+        _maintain_ann()
+
+# -------------------- メモ --------------------
+def get_notes(owner_id: str):
+    """指定ユーザー（またはSERVER_SCOPE）のメモを登録順で返す"""
+    with _lock:
+        _get_conn()
+        return list(_notes.get(owner_id, []))
+
+def get_all_notes():
+    """全ユーザーのメモとサーバー共有メモをまとめて返す"""
+    with _lock:
+        _get_conn()
+        return [{**note, 'owner_id': owner_id} for owner_id, notes in _notes.items() for note in notes]
+
+def add_note(owner_id: str, text: str, embedding) -> bool:
+    """メモを追加する。同じ内容が既にあればFalseを返す"""
+    global _next_note_id
+    with _lock:
+        _get_conn()
+        notes = _notes.setdefault(owner_id, [])
+        if any(n['text'] == text for n in notes): return False
+        note_id = _next_note_id
+        _next_note_id += 1
+        notes.append({'id': note_id, 'text': text, 'embedding': list(embedding) if embedding is not None else None})
+        _new_notes[note_id] = (owner_id, text, embedding)
+        _note_index.add(owner_id, note_id, text, embedding)
+        _schedule_flush()
+        return True
+
+def remove_note(owner_id: str, index: int):
+    """登録順で index 番目（0始まり）のメモを削除して返す。なければNone"""
+    with _lock:
+        _get_conn()
+        notes = _notes.get(owner_id, [])
+        if not (0 <= index < len(notes)): return None
+        removed = notes.pop(index)
+        _note_index.remove(owner_id, removed['id'])
+        if _new_notes.pop(removed['id'], None) is None:
+            _deleted_note_ids.add(removed['id'])
+        _schedule_flush()
+        return {'id': removed['id'], 'text': removed['text']}
+
+def search_notes(query_embedding, owner_id: str = None, top_k: int = 3):
+    """クエリに近いメモを [{'text', 'similarity'}] で返す。owner_idを省略すると全メモが対象"""
+    with _lock:
+        _get_conn()
+        return _note_index.search(query_embedding, owner_id=owner_id, top_k=top_k)
+
+def lexical_overlap(text: str) -> int:
+    """発言と文字n-gramが一番多く重なるメモの重なり数。0なら埋め込み検索をしても当たらない見込みが高い"""
+    with _lock:
+        _get_conn()
+        return _note_index.lexical.best_overlap(text)
+
+# -------------------- ユーザー設定 --------------------
+def get_nickname(user_id: str):
+    with _lock:
+        _get_conn()
+        return _nicknames.get(user_id)
+
+def set_nickname(user_id: str, name: str):
+    with _lock:
+        _get_conn()
+        _nicknames[user_id] = name
+        _dirty_users.add(user_id)
+        _schedule_flush()
+
+# -------------------- サーバー設定 --------------------
+def get_setting(key: str, default=None):
+    with _lock:
+        _get_conn()
+        return _settings.get(key, default)
+
+def set_setting(key: str, value: str):
+    with _lock:
+        _get_conn()
+        _settings[key] = value
+        _dirty_settings.add(key)
+        _schedule_flush()
+
+# -------------------- 人間関係 --------------------
+def get_relationships(user_id: str):
+    """{partner_id: {'topics': {topic: count}, 'interaction_count': n}} の形で返す"""
+    with _lock:
+        _get_conn()
+        return {p: {'topics': dict(d['topics']), 'interaction_count': d['interaction_count']} for p, d in _relationships.get(user_id, {}).items()}
+
+def record_interaction(user_id: str, partner_id: str, topic: str, count: int = 1):
+    """二人の間の会話トピックを双方向に count 回分カウントアップする"""
+    with _lock:
+        _get_conn()
+        for u1, u2 in [(user_id, partner_id), (partner_id, user_id)]:
+            rel = _relationships.setdefault(u1, {}).setdefault(u2, {'topics': {}, 'interaction_count': 0})
+            rel['topics'][topic] = rel['topics'].get(topic, 0) + count
+            rel['interaction_count'] += count
+            _dirty_relationships.add((u1, u2))
+        _schedule_flush()
+
+def close():
+    """未書き出しの変更を書き出してから接続を閉じる"""
+    global _conn
+    with _lock:
+        flush()
+        if _conn is not None:
+            _conn.close()
+            _conn = None
@@ -0,0 +1,184 @@
+# cogs/_model_registry.py (用途別のモデル振り分け - 共有クライアント＆遅延・エラー時の下位モデルへのフォールバック)
+import os
+import json
+import time
+import asyncio
+from collections import deque
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from ._llm_dispatcher import llm, LLMShedError, INTERACTIVE
+
+# -------------------- 設定項目 --------------------
+# モデルの格付け。ルートの後ろにあるものほど安くて速い
+MODEL_TIERS = {
+    "pro": "gemini-1.5-pro-latest",
+    "flash": "gemini-1.5-flash-latest",
+    "lite": "gemini-1.5-flash-8b-latest",
+}
+# 用途ごとに試すモデルの順番
+MODEL_ROUTES = {
+    "meta_thinking": ["flash", "lite"],
+    "final_reply": ["flash", "lite"],
+    "search": ["flash", "lite"],
+    "intervention": ["flash", "lite"],
+    "memory": ["flash", "lite"],
+    "mood": ["flash", "lite"],
+    "topic": ["flash", "lite"],
+    "news": ["flash", "lite"],
+    "vision": ["pro", "flash"],
+    "roast": ["pro", "flash"],
+}
+# 環境変数(JSON)で上書きできる 例: MODEL_ROUTES='{"final_reply": ["pro", "flash"]}'
+# 用途ごとの応答時間の予算(秒)。ストリーミングの場合は最初の塊が届くまでの時間
+LATENCY_BUDGETS = {"meta_thinking": 6.0, "final_reply": 8.0, "search": 8.0, "vision": 20.0, "news": 30.0}
+DEFAULT_LATENCY_BUDGET = 15.0
+ERROR_BUDGET = 0.3           # 直近の呼び出しのうち、これ以上の割合で失敗したら格下げ
+HEALTH_WINDOW = 20           # 判定に使う直近の呼び出し数
+HEALTH_MIN_SAMPLES = 5
+DEGRADE_COOLDOWN = 120.0     # 格下げしたモデルをこの秒数だけ避ける
+# ------------------------------------------------
+
+def _env_json(name: str) -> dict:
+    """環境変数のJSONオブジェクトを読む。壊れていたら知らせて、上書きしなかったことにする"""
+    raw = os.getenv(name)
+    if not raw: return {}
+    try:
+        value = json.loads(raw)
+    except json.JSONDecodeError as e:
+        print(f"{name} is not valid JSON, keeping the defaults: {e}")
+        return {}
+    if not isinstance(value, dict):
+        print(f"{name} must be a JSON object, keeping the defaults")
+        return {}
+    return value
+
+def _apply_env_overrides():
+    """MODEL_TIERS / MODEL_ROUTES を環境変数で上書きする。知らない格付けを指すルートは使わない"""
+    for tier, model_name in _env_json('MODEL_TIERS').items():
+        if isinstance(model_name, str) and model_name: MODEL_TIERS[tier] = model_name
+        else: print(f"MODEL_TIERS[{tier!r}] must be a model name, ignoring it")
+    for task, route in _env_json('MODEL_ROUTES').items():
+        known = [tier for tier in route if isinstance(tier, str) and tier in MODEL_TIERS] if isinstance(route, list) else []
+        if known and len(known) == len(route):
+            MODEL_ROUTES[task] = known; continue
+        if known:
+            print(f"MODEL_ROUTES[{task!r}] names unknown tiers, using only {known}")
+            MODEL_ROUTES[task] = known
+        else:
+            print(f"MODEL_ROUTES[{task!r}] has no known tiers ({route!r}), keeping {MODEL_ROUTES.get(task)}")
+
+_apply_env_overrides()
+
+def _is_transient(error):
+    """モデル側の不調によるエラーか（429・5xx・タイムアウト）。不正なリクエストや安全フィルタによるブロックは数えない"""
+    if isinstance(error, (asyncio.TimeoutError, google_exceptions.DeadlineExceeded)): return True
+    code = getattr(error, 'code', None) if isinstance(error, google_exceptions.GoogleAPICallError) else None
+    return isinstance(code, int) and (code == 429 or 500 <= code < 600)
+
+
+class _Health:
+    __slots__ = ('window', 'degraded_until', 'calls', 'errors', 'total_latency', 'degrades')
+
+    def __init__(self):
+        self.window = deque(maxlen=HEALTH_WINDOW)  # [(成功したか, 秒数)]
+        self.degraded_until = 0.0
+        self.calls = self.errors = self.degrades = 0
+        self.total_latency = 0.0
+
+
+class ModelRegistry:
+    """
+    GenerativeModel は名前ごとに1つだけ作って使い回す。用途(task)ごとのルートを前から順に見て、
+    遅延かエラー率が予算を超えたモデルはしばらく飛ばし、次のモデルに回す。
+    """
+
+    def __init__(self, tiers=MODEL_TIERS, routes=MODEL_ROUTES):
+        self.tiers = tiers
+        self.routes = routes
+        self._models = {}
+        self._health = {}  # {(task, tier): _Health}
+        self.routed = {}   # {task: {tier: 回数}}
+        self.fallbacks = {}
+
+    def get_model(self, tier: str):
+        model = self._models.get(tier)
+        if model is None: model = self._models[tier] = genai.GenerativeModel(self.tiers[tier])
+        return model
+
+    def _health_of(self, task, tier):
+        health = self._health.get((task, tier))
+        if health is None: health = self._health[(task, tier)] = _Health()
+        return health
+
+    def candidates(self, task: str):
+        """今使うべき順に並べたモデルの格。全部が格下げ中なら一番安いものから"""
+        route = self.routes.get(task) or ["flash"]
+        now = time.monotonic()
+        healthy = [tier for tier in route if self._health_of(task, tier).degraded_until <= now]
+        return healthy or route[::-1]
+
+    def model_name(self, task: str) -> str:
+        return self.tiers[self.candidates(task)[0]]
+
+    def _record(self, task, tier, ok, latency):
+        health = self._health_of(task, tier)
+        health.calls += 1
+        health.total_latency += latency
+        if not ok: health.errors += 1
+        health.window.append((ok, latency))
+        if len(health.window) < HEALTH_MIN_SAMPLES: return
+        error_rate = sum(1 for ok, _ in health.window if not ok) / len(health.window)
+        latencies = [latency for ok, latency in health.window if ok]
+        avg_latency = sum(latencies) / len(latencies) if latencies else 0.0
+        budget = LATENCY_BUDGETS.get(task, DEFAULT_LATENCY_BUDGET)
+        if error_rate > ERROR_BUDGET or avg_latency > budget:
+            health.degraded_until = time.monotonic() + DEGRADE_COOLDOWN
+            health.degrades += 1
+            health.window.clear()
+            print(f"Model route '{task}' is skipping '{tier}' for {DEGRADE_COOLDOWN:.0f}s (errors {error_rate:.0%}, avg {avg_latency:.1f}s).")
+
+    async def generate(self, task: str, contents, priority: int = INTERACTIVE, sheddable: bool = True, **kwargs):
+        """用途に合ったモデルで生成する。失敗したら同じルートの次のモデルで1回ずつやり直す"""
+        candidates = self.candidates(task)
+        for i, tier in enumerate(candidates):
+            if i > 0: self.fallbacks[task] = self.fallbacks.get(task, 0) + 1
+            task_routes = self.routed.setdefault(task, {})
+            task_routes[tier] = task_routes.get(tier, 0) + 1
+            model = self.get_model(tier)
+            timing = {"latency": 0.0}
+
+            async def call():
+                # ディスパッチャの待ち時間はモデルのせいではないので、呼び出し自体の時間だけ測る
+                started_at = time.monotonic()
+                try:
+                    return await model.generate_content_async(contents, **kwargs)
+                finally:
+                    timing["latency"] = time.monotonic() - started_at
+
+            try:
+                response = await llm.submit(priority, call, sheddable=sheddable)
+            except LLMShedError:
+                raise  # 混雑で捨てられただけなのでモデルのせいにしない
+            except Exception as e:
+                # リクエスト自体の問題はどのモデルでも起きうるので、モデルの健康状態には数えない
+                if _is_transient(e): self._record(task, tier, False, timing["latency"])
+                if i == len(candidates) - 1: raise
+                continue
+            self._record(task, tier, True, timing["latency"])
+            return response
+
+    def get_stats(self):
+        now = time.monotonic()
+        tiers = {}
+        for (task, tier), health in self._health.items():
+            tiers[f"{task}/{tier}"] = {
+                "calls": health.calls,
+                "errors": health.errors,
+                "avg_latency_ms": round(health.total_latency / health.calls * 1000, 1) if health.calls else 0.0,
+                "degrades": health.degrades,
+                "degraded_for": round(max(0.0, health.degraded_until - now), 1),
+            }
+        return {"routed": self.routed, "fallbacks": self.fallbacks, "health": tiers}
+
+
+models = ModelRegistry()
@@ -0,0 +1,128 @@
+# cogs/_mood_aggregator.py (チャンネルのムード分析をまとめて1回のLLM呼び出しで行う)
+import re
+import json
+import asyncio
+import numpy as np
+from collections import deque
+
+# -------------------- 設定項目 --------------------
+MOOD_BATCH_SIZE = 8          # これだけ溜まったらすぐ分析する
+MOOD_BATCH_WINDOW = 30.0     # 溜まらなくても、最初の発言からこの秒数で分析する
+MOOD_MAX_BUFFER = 32         # チャンネルごとに溜めておく最大件数（超えたら古い順に捨てる）
+MOOD_MAX_INFLIGHT = 2        # 同時に走らせる分析リクエスト数
+MOOD_HISTORY_SIZE = 10       # 平均を取る直近スコア数
+MOOD_MAX_MESSAGE_CHARS = 300
+# ------------------------------------------------
+
+def build_mood_prompt(texts):
+    lines = "\n".join([f"{i}. {' '.join(text.split())[:MOOD_MAX_MESSAGE_CHARS]}" for i, text in enumerate(texts, 1)])
+    return f"""
+以下は同じチャンネルでのユーザーの発言です。それぞれの発言の感情を「Positive」「Negative」「Neutral」のいずれかで判定し、-1.0から1.0の範囲で感情スコアを付けなさい。
+# 発言一覧
+{lines}
+
+出力形式は必ず以下の厳密なJSON配列とし、すべての発言番号を含めること。
+[
+  {{"id": 発言番号, "emotion": "判定結果", "score": スコア}}
+]
+"""
+
+def parse_mood_scores(text: str, count: int):
+    """LLMの出力から発言ごとのスコアを取り出す。読めなかった発言はNone"""
+    match = re.search(r'```json\n(\[.*?\])\n```', text, re.DOTALL) or re.search(r'(\[.*\])', text, re.DOTALL)
+    if not match: return [None] * count
+    try:
+        items = json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return [None] * count
+    scores = [None] * count
+    for item in items if isinstance(items, list) else []:
+        try:
+            index = int(item["id"]) - 1
+            if 0 <= index < count: scores[index] = max(-1.0, min(1.0, float(item["score"])))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return scores
+
+
+class MoodAggregator:
+    """
+    発言をチャンネルごとに溜めて、件数か時間のどちらかが来たらまとめて採点する。
+    generate は async (prompt: str) -> str な関数。結果は state (JsonStateFile) の
+    {channel_id: {"scores": [...], "average": float}} に今まで通りの形で書き込む。
+    """
+
+    def __init__(self, generate, state, batch_size: int = MOOD_BATCH_SIZE, window: float = MOOD_BATCH_WINDOW, max_buffer: int = MOOD_MAX_BUFFER, max_inflight: int = MOOD_MAX_INFLIGHT):
+        self.generate = generate
+        self.state = state
+        self.batch_size = batch_size
+        self.window = window
+        self.max_buffer = max_buffer
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self._buffers = {}  # {channel_id: deque[str]}
+        self._timers = {}   # {channel_id: TimerHandle}
+        self._tasks = set()  # 採点中のまとめ（ループは弱参照しか持たないので、ここで握っておく）
+        self.stats = {"messages": 0, "batches": 0, "scored": 0, "dropped": 0, "deferred": 0, "errors": 0}
+
+    def add(self, channel_id: str, text: str):
+        if not text.strip(): return
+        loop = asyncio.get_running_loop()
+        buffer = self._buffers.get(channel_id)
+        if buffer is None: buffer = self._buffers[channel_id] = deque(maxlen=self.max_buffer)
+        # 分析が追いつかないときは古い発言から捨てる（ムードは直近の空気がわかれば十分）
+        if len(buffer) == buffer.maxlen: self.stats["dropped"] += 1
+        buffer.append(text)
+        self.stats["messages"] += 1
+        if len(buffer) >= self.batch_size and self.inflight < self.max_inflight:
+            self._dispatch(channel_id)
+        elif channel_id not in self._timers:
+            self._timers[channel_id] = loop.call_later(self.window, self._dispatch, channel_id)
+
+    def _dispatch(self, channel_id):
+        timer = self._timers.pop(channel_id, None)
+        if timer is not None: timer.cancel()
+        buffer = self._buffers.get(channel_id)
+        if not buffer: return
+        if self.inflight >= self.max_inflight:
+            # 混んでいるので後回し。待っている間に溢れた分は add() で捨てられる
+            self.stats["deferred"] += 1
+            self._timers[channel_id] = asyncio.get_running_loop().call_later(self.window, self._dispatch, channel_id)
+            return
+        texts = list(buffer)[-self.batch_size * 2:]
+        self.stats["dropped"] += len(buffer) - len(texts)
+        buffer.clear()
+        self.inflight += 1
+        task = asyncio.ensure_future(self._score(channel_id, texts))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _score(self, channel_id, texts):
+        self.stats["batches"] += 1
+        try:
+            response_text = await self.generate(build_mood_prompt(texts))
+            scores = [score for score in parse_mood_scores(response_text, len(texts)) if score is not None]
+            if scores: self._apply(channel_id, scores)
+            self.stats["scored"] += len(scores)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"An error occurred during mood analysis: {e}")
+        finally:
+            self.inflight -= 1
+
+    def _apply(self, channel_id, new_scores):
+        mood_data = self.state.data
+        if channel_id not in mood_data: mood_data[channel_id] = {"scores": [], "average": 0.0}
+        scores = (mood_data[channel_id].get("scores", []) + new_scores)[-MOOD_HISTORY_SIZE:]
+        mood_data[channel_id]["scores"] = scores
+        mood_data[channel_id]["average"] = round(float(np.mean(scores)), 4)
+        self.state.mark_dirty()
+
+    def get_stats(self):
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "buffered": sum(len(buffer) for buffer in self._buffers.values()),
+            "inflight": self.inflight,
+            "avg_batch_size": round(self.stats["scored"] / batches, 2) if batches else 0.0,
+        }
@@ -0,0 +1,15 @@
+# cogs/_mood_state.py (チャンネルごとのムードの共有状態 - Cogを再読み込みしても同じキャッシュを使う)
+import os
+from ._json_state import JsonStateFile
+
+# ファイルパス設定
+DATA_DIR = os.getenv('RAILWAY_VOLUME_MOUNT_PATH', '.')
+MOOD_FILE = os.path.join(DATA_DIR, 'channel_mood.json')
+
+mood_state = JsonStateFile(MOOD_FILE)
+
+def load_mood_data():
+    return mood_state.data
+
+def save_mood_data(data):
+    mood_state.replace(data)
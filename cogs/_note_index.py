@@ -0,0 +1,222 @@
+# cogs/_note_index.py (メモの類似検索エンジン - 正規化済み行列版)
+import numpy as np
+from ._ann_index import IVFIndex
+from ._lexical_index import NgramIndex
+
+class _NoteMatrix:
+    """正規化済みのfloat32ベクトルを連続した行列で持ち、行の追加・削除をO(1)で行う"""
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.size = 0
+        self.note_ids = []
+        self.texts = []
+        self.row_of = {}  # {note_id: 行番号}
+
+    def add(self, note_id, text, unit_vec):
+        if note_id in self.row_of: return
+        if self.size == len(self.vectors):
+            grown = np.zeros((len(self.vectors) * 2, self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+        self.vectors[self.size] = unit_vec
+        self.row_of[note_id] = self.size
+        self.note_ids.append(note_id)
+        self.texts.append(text)
+        self.size += 1
+
+    def remove(self, note_id):
+        row = self.row_of.pop(note_id, None)
+        if row is None: return
+        last = self.size - 1
+        if row != last:
+            # 最後の行を空いた場所に移して、行列を詰めたままにする
+            self.vectors[row] = self.vectors[last]
+            self.note_ids[row] = self.note_ids[last]
+            self.texts[row] = self.texts[last]
+            self.row_of[self.note_ids[row]] = row
+        self.note_ids.pop()
+        self.texts.pop()
+        self.size -= 1
+
+    def search(self, unit_query, top_k, rows=None):
+        """rowsを渡すとその行だけを対象にする（近似検索の候補絞り込み用）"""
+        if self.size == 0 or top_k <= 0: return []
+        if rows is None:
+            rows = np.arange(self.size)
+            scores = self.vectors[:self.size] @ unit_query
+        else:
+            if len(rows) == 0: return []
+            scores = self.vectors[rows] @ unit_query
+        k = min(top_k, len(rows))
+        candidates = np.argpartition(-scores, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        # 同点は登録順を優先（旧実装の安定ソートと同じ並び）
+        order = sorted(candidates, key=lambda i: (-scores[i], self.note_ids[rows[i]]))
+        return [{'text': self.texts[rows[i]], 'similarity': float(scores[i])} for i in order]
+
+
+class NoteIndex:
+    """ユーザーごと・サーバー全体のメモ行列をまとめて管理する"""
+
+    def __init__(self, ann: IVFIndex = None):
+        self.dim = None
+        self._scopes = {}  # {owner_id: _NoteMatrix}
+        self._all = None
+        self.ann = ann  # 全メモ検索用の近似インデックス（任意）
+        self.lexical = NgramIndex()  # 埋め込みを作る前の足切り用（ベクトルと同じメモだけを持つ）
+
+    def _normalize(self, embedding):
+        vec = np.asarray(embedding, dtype=np.float32)
+        if vec.ndim != 1: return None
+        if self.dim is None:
+            self.dim = vec.shape[0]
+            self._all = _NoteMatrix(self.dim)
+        if vec.shape[0] != self.dim: return None
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def clear(self):
+        self.dim = None
+        self._scopes = {}
+        self._all = None
+        self.lexical.clear()
+        if self.ann is not None: self.ann.reset()
+
+    def add(self, owner_id, note_id, text, embedding):
+        if embedding is None: return
+        unit_vec = self._normalize(embedding)
+        if unit_vec is None:
+            print(f"Warning: note {note_id} has an embedding of unexpected shape, skipped indexing.")
+            return
+        if owner_id not in self._scopes: self._scopes[owner_id] = _NoteMatrix(self.dim)
+        self._scopes[owner_id].add(note_id, text, unit_vec)
+        self._all.add(note_id, text, unit_vec)
+        self.lexical.add(note_id, text)
+        if self.ann is not None: self.ann.add(note_id, unit_vec)
+
+    def remove(self, owner_id, note_id):
+        if owner_id in self._scopes: self._scopes[owner_id].remove(note_id)
+        if self._all is not None: self._all.remove(note_id)
+        self.lexical.remove(note_id)
+        if self.ann is not None: self.ann.remove(note_id)
+
+    def maintain_ann(self):
+        """近似インデックスを読み込み・必要なら学習し直して、ディスクに保存する"""
+        if self.ann is None or self._all is None: return
+        if not self.ann.trained: self.ann.load(self._all)
+        if self.ann.needs_training(self._all.size): self.ann.train(self._all)
+        self.ann.save()
+
+    def maintain_ann_unlocked(self, lock):
+        """
+        maintain_ann の別スレッド版。ファイルの読み書きと学習の間は lock を外し、
+        結果を差し込むときだけ lock を取る。途中で clear() されたら結果は捨てる。
+        """
+        ann = self.ann
+        with lock:
+            if ann is None or self._all is None: return
+            generation, needs_restore = ann.generation, not ann.trained
+        if needs_restore:
+            saved = ann.read()
+            with lock:
+                if ann.generation != generation: return
+                ann.restore(saved, self._all)
+        with lock:
+            if ann.generation != generation or not ann.needs_training(self._all.size): snapshot = None
+            else: snapshot = (self._all.vectors[:self._all.size].copy(), list(self._all.note_ids))
+        if snapshot is not None:
+            vectors, note_ids = snapshot
+            centroids, assignment = ann.fit(vectors, note_ids)
+            with lock:
+                if ann.generation != generation: return
+                ann.install(centroids, assignment, len(note_ids), self._all)
+            print(f"IVF note index trained: {len(note_ids)} notes, {len(centroids)} lists.")
+        with lock:
+            if ann.generation != generation: return
+            saved = ann.snapshot()
+        if saved is not None and ann.write(saved):
+            with lock:
+                if ann.generation == generation: ann.dirty = False
+
+    def search(self, query_embedding, owner_id=None, top_k=3, n_probe=None):
+        """owner_idを省略すると全メモから探す。[{'text', 'similarity'}] を類似度の高い順で返す"""
+        if query_embedding is None or self.dim is None: return []
+        matrix = self._all if owner_id is None else self._scopes.get(owner_id)
+        if matrix is None: return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if query.shape != (self.dim,): return []
+        norm = np.linalg.norm(query)
+        if norm == 0: return []
+        unit_query = query / norm
+        if owner_id is None and self.ann is not None and self.ann.should_use(matrix.size):
+            return matrix.search(unit_query, top_k, rows=self.ann.candidate_rows(matrix, unit_query, n_probe))
+        return matrix.search(unit_query, top_k)
+
+    def __len__(self):
+        return self._all.size if self._all is not None else 0
+
+
+if __name__ == "__main__":
+    # ベンチマーク: python -m cogs._note_index [--dim 768] [--sizes 10000 100000 1000000]
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="NoteIndex benchmark")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--naive-limit", type=int, default=100_000, help="これより大きいサイズでは旧実装の計測を省略する")
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[4, 8, 32], help="IVF近似検索で試すn_probe")
+    args = parser.parse_args()
+
+    def naive_find_similar_notes(query_embedding, memory_notes, top_k=3):
+        query_vec = np.array(query_embedding)
+        notes_with_similarity = []
+        for note in memory_notes:
+            note_vec = np.array(note['embedding'])
+            similarity = np.dot(query_vec, note_vec) / (np.linalg.norm(query_vec) * np.linalg.norm(note_vec))
+            notes_with_similarity.append({'text': note['text'], 'similarity': similarity})
+        return sorted(notes_with_similarity, key=lambda x: x['similarity'], reverse=True)[:top_k]
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        # 実際の埋め込みと同じく、いくつかの話題の周りに固まったデータにする
+        topics = rng.standard_normal((max(10, size // 1000), args.dim), dtype=np.float32)
+        data = topics[rng.integers(len(topics), size=size)] + 0.5 * rng.standard_normal((size, args.dim), dtype=np.float32)
+        index = NoteIndex()
+        start = time.perf_counter()
+        for i in range(size):
+            index.add(str(i % 100), i, f"note {i}", data[i])
+        build_time = time.perf_counter() - start
+        queries = topics[rng.integers(len(topics), size=args.queries)] + 0.5 * rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+
+        start = time.perf_counter()
+        for q in queries: index.search(q, top_k=1)
+        index_ms = (time.perf_counter() - start) / args.queries * 1000
+        line = f"{size:>9,} notes  build {build_time:7.2f}s  index top-1 {index_ms:8.3f}ms"
+
+        ann = IVFIndex(min_size=0)
+        start = time.perf_counter()
+        ann.train(index._all)
+        line += f"  ivf train {time.perf_counter() - start:6.2f}s"
+        index.ann = ann
+        exact = [index._all.search(q / np.linalg.norm(q), 10) for q in queries]
+        for n_probe in args.n_probe:
+            start = time.perf_counter()
+            approx = [index.search(q, top_k=10, n_probe=n_probe) for q in queries]
+            ann_ms = (time.perf_counter() - start) / args.queries * 1000
+            recall = np.mean([len({n['text'] for n in a} & {n['text'] for n in e}) / len(e) for a, e in zip(approx, exact)])
+            line += f"  ivf(n_probe={n_probe}) {ann_ms:7.3f}ms recall@10 {recall:.2f}"
+        index.ann = None
+
+        if size <= args.naive_limit:
+            notes = [{'text': f"note {i}", 'embedding': data[i].tolist()} for i in range(size)]
+            naive_queries = max(1, args.queries // 10)
+            start = time.perf_counter()
+            expected = [naive_find_similar_notes(q.tolist(), notes, top_k=3) for q in queries[:naive_queries]]
+            naive_ms = (time.perf_counter() - start) / naive_queries * 1000
+            for q, exp in zip(queries[:naive_queries], expected):
+                assert [n['text'] for n in exp] == [n['text'] for n in index.search(q, top_k=3)], "results differ from the naive scan"
+            line += f"  naive top-3 {naive_ms:10.3f}ms  (results match)"
+        print(line)
+        del data, index
@@ -1,53 +1,106 @@
 import json
 import os
+from ._keyword_reflex import ReflexEngine
 
 # ★★★ ここが間違ってたわよ！★★★
 # アタシの人格（ペルソナ）が保管されてる場所を正しく修正したわ
-PERSONA_DIR = './cogs/personas' 
+PERSONA_DIR = './cogs/personas'
 DEFAULT_PERSONA = 'mesugaki'
+PERSONA_RELOAD_INTERVAL = 5  # ファイルの更新をチェックする間隔(秒)
+
+# {persona_id: {"mtime": float, "data": dict, "reflexes": ReflexEngine}}
+# 全ペルソナを一度だけ読み込んでメモリに置き、以降の参照ではディスクを読まない
+# キーワード反射も読み込み時に1つのオートマトンにコンパイルしておく
+_registry = {}
+_loaded = False
 
 def get_persona_path(persona_name):
     """ペルソナファイルのパスを取得する"""
     return os.path.join(PERSONA_DIR, f"{persona_name}.json")
 
+def _validate(data):
+    """プロンプト組み立てで直接参照するキーが揃っているか"""
+    return isinstance(data, dict) and isinstance(data.get("settings"), dict)
+
+def refresh():
+    """
+    ペルソナフォルダを確認し、追加・変更されたファイルだけ読み直す。消えたファイルは登録から外す。
+    壊れたファイルに書き換えられた場合は、直前の正常な内容を使い続ける。変更があればTrueを返す。
+    """
+    global _loaded
+    _loaded = True
+    try:
+        filenames = [f for f in os.listdir(PERSONA_DIR) if f.endswith('.json')]
+    except FileNotFoundError:
+        filenames = []
+    changed = False
+    seen = set()
+    for filename in filenames:
+        persona_id = filename[:-5]
+        seen.add(persona_id)
+        try:
+            mtime = os.path.getmtime(get_persona_path(persona_id))
+        except OSError:
+            continue
+        entry = _registry.get(persona_id)
+        if entry is not None and entry["mtime"] == mtime: continue
+        try:
+            with open(get_persona_path(persona_id), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: Persona file '{filename}' could not be loaded: {e}")
+            continue
+        if not _validate(data):
+            print(f"Warning: Persona file '{filename}' has no 'settings' section. Skipped.")
+            continue
+        _registry[persona_id] = {"mtime": mtime, "data": data, "reflexes": ReflexEngine(data.get("reflexes"))}
+        changed = True
+        if entry is not None: print(f"Persona '{persona_id}' reloaded.")
+    for persona_id in set(_registry) - seen:
+        del _registry[persona_id]
+        changed = True
+    return changed
+
+def _ensure_loaded():
+    if not _loaded: refresh()
+
+def has_persona(persona_name):
+    _ensure_loaded()
+    return persona_name in _registry
+
 def load_persona(persona_name=None):
-    """指定されたペルソナファイルを読み込む。なければデフォルトを読み込む。"""
+    """指定されたペルソナを返す。なければデフォルトを返す。"""
+    _ensure_loaded()
     if persona_name is None:
         persona_name = DEFAULT_PERSONA
-    
-    filepath = get_persona_path(persona_name)
-    
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # 指定されたファイルがなければ、デフォルトを試す
-        print(f"Warning: Persona file '{persona_name}.json' not found or corrupted. Loading default persona.")
-        filepath = get_persona_path(DEFAULT_PERSONA)
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            # デフォルトすらない場合はエラーを返す
-            print(f"FATAL: Default persona file '{DEFAULT_PERSONA}.json' not found or corrupted.")
-            return None
+
+    entry = _registry.get(persona_name)
+    if entry is not None:
+        return entry["data"]
+    # 指定されたペルソナがなければ、デフォルトを試す
+    print(f"Warning: Persona file '{persona_name}.json' not found or corrupted. Loading default persona.")
+    entry = _registry.get(DEFAULT_PERSONA)
+    if entry is not None:
+        return entry["data"]
+    # デフォルトすらない場合はエラーを返す
+    print(f"FATAL: Default persona file '{DEFAULT_PERSONA}.json' not found or corrupted.")
+    return None
+
+def get_reflexes(persona_name=None):
+    """指定されたペルソナのキーワード反射エンジンを返す。なければデフォルトのもの、それもなければNone"""
+    _ensure_loaded()
+    entry = _registry.get(persona_name or DEFAULT_PERSONA) or _registry.get(DEFAULT_PERSONA)
+    return entry["reflexes"] if entry is not None else None
+
+def get_reflex_stats():
+    """ペルソナごとのキーワード反射の統計を返す"""
+    _ensure_loaded()
+    return {persona_id: entry["reflexes"].get_stats() for persona_id, entry in sorted(_registry.items())}
 
 def list_personas():
     """利用可能なペルソナのリストを返す"""
-    if not os.path.exists(PERSONA_DIR):
-        return []
-    
-    personas = []
-    for filename in os.listdir(PERSONA_DIR):
-        if filename.endswith('.json'):
-            try:
-                with open(os.path.join(PERSONA_DIR, filename), 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    personas.append({
-                        "id": filename[:-5],
-                        "name": data.get("name", "名前なし"),
-                        "description": data.get("description", "説明なし")
-                    })
-            except (json.JSONDecodeError, KeyError):
-                continue
-    return personas
+    _ensure_loaded()
+    return [
+        {"id": persona_id, "name": entry["data"].get("name", "名前なし"), "description": entry["data"].get("description", "説明なし")}
+        for persona_id, entry in sorted(_registry.items())
+    ]
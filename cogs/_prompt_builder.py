@@ -0,0 +1,127 @@
+# cogs/_prompt_builder.py (トークン予算つきプロンプト組み立て)
+import os
+import re
+
+# -------------------- 設定項目 --------------------
+DEFAULT_PROMPT_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 6000))
+# モデルごとの入力トークン予算（コンテキスト長ではなく、1回の応答にかけてよいコストの上限）
+MODEL_PROMPT_BUDGETS = {
+    'gemini-1.5-flash-latest': DEFAULT_PROMPT_BUDGET,
+    'gemini-1.5-pro-latest': 8000,
+}
+MIN_SECTION_TOKENS = 16  # ここまで削られるなら、中途半端に残さず丸ごと落とす
+# ------------------------------------------------
+
+_ASCII_RUN = re.compile(r'[\x00-\x7f]+')
+
+def count_tokens(text: str) -> int:
+    """
+    APIを呼ばずにトークン数を見積もる。日本語などの非ASCII文字は1文字≒1トークン、
+    ASCIIは4文字≒1トークンとして数える（Geminiのトークナイザより少し多めに出る）。
+    """
+    if not text: return 0
+    ascii_chars = sum(len(run) for run in _ASCII_RUN.findall(text))
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+def budget_for(model_name: str) -> int:
+    return MODEL_PROMPT_BUDGETS.get(model_name.removeprefix('models/'), DEFAULT_PROMPT_BUDGET)
+
+def _truncate(text: str, max_tokens: int, keep: str) -> str:
+    """keep='head' なら先頭側、'tail' なら末尾側を残して max_tokens 以内に収める（なるべく行単位で切る）"""
+    lines = text.split('\n')
+    if keep == 'tail': lines.reverse()
+    kept, used = [], 0
+    for line in lines:
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens: break
+        kept.append(line)
+        used += cost
+    if not kept:
+        # 1行目から収まらないときは文字単位で切る
+        line = lines[0]
+        low, high = 0, len(line)
+        while low < high:
+            mid = (low + high + 1) // 2
+            piece = line[:mid] if keep == 'head' else line[-mid:]
+            if count_tokens(piece) <= max_tokens: low = mid
+            else: high = mid - 1
+        return (line[:low] if keep == 'head' else line[-low:]) if low else ""
+    if keep == 'tail': kept.reverse()
+    return '\n'.join(kept)
+
+
+class _Section:
+    __slots__ = ('name', 'header', 'body', 'priority', 'keep', 'fallback', 'original_tokens', 'state')
+
+    def __init__(self, name, header, body, priority, keep, fallback):
+        self.name, self.header, self.body = name, header, body
+        self.priority, self.keep, self.fallback = priority, keep, fallback
+        self.original_tokens = count_tokens(header) + count_tokens(body)
+        self.state = 'full'  # full / trimmed / dropped
+
+    @property
+    def tokens(self):
+        return count_tokens(self.header) + count_tokens(self.body)
+
+
+class PromptBuilder:
+    """
+    プロンプトを「見出し(固定) + 本文(削ってよい)」のセクションの並びとして組み立てる。
+    priority が None のセクションは削らない。予算を超えたら priority の低いものから削り、
+    それでも足りなければ丸ごと fallback に置き換える。セクションは add した順に連結される。
+    """
+
+    def __init__(self, kind: str, budget: int = DEFAULT_PROMPT_BUDGET):
+        self.kind = kind
+        self.budget = budget
+        self.sections = []
+
+    def add(self, name: str, body: str, header: str = "", priority: int = None, keep: str = 'head', fallback: str = "（特になし）"):
+        self.sections.append(_Section(name, header, body or "", priority, keep, fallback))
+        return self
+
+    def _fit(self):
+        total = sum(section.tokens for section in self.sections)
+        # 同じ優先度なら大きいセクションから削る
+        trimmable = sorted([s for s in self.sections if s.priority is not None and s.body], key=lambda s: (s.priority, -s.tokens))
+        for section in trimmable:
+            if total <= self.budget: break
+            before = section.tokens
+            target = count_tokens(section.body) - (total - self.budget)
+            if target < MIN_SECTION_TOKENS:
+                if count_tokens(section.fallback) >= count_tokens(section.body): continue
+                section.body, section.state = section.fallback, 'dropped'
+            else:
+                section.body, section.state = _truncate(section.body, target, section.keep), 'trimmed'
+            total -= before - section.tokens
+        return total
+
+    def build(self) -> str:
+        total = self._fit()
+        _record(self, total)
+        return "".join(section.header + section.body for section in self.sections)
+
+    def breakdown(self):
+        """{セクション名: {"tokens", "original", "state"}}"""
+        return {s.name: {"tokens": s.tokens, "original": s.original_tokens, "state": s.state} for s in self.sections}
+
+
+# {kind: 集計}
+_stats = {}
+
+def _record(builder, total):
+    entry = _stats.setdefault(builder.kind, {"builds": 0, "total_tokens": 0, "original_tokens": 0, "trimmed_builds": 0, "over_budget": 0, "last": {}})
+    original = sum(s.original_tokens for s in builder.sections)
+    entry["builds"] += 1
+    entry["total_tokens"] += total
+    entry["original_tokens"] += original
+    if original > total: entry["trimmed_builds"] += 1
+    if total > builder.budget: entry["over_budget"] += 1
+    entry["last"] = builder.breakdown()
+
+def get_prompt_stats():
+    """プロンプトの種類ごとの平均トークン数と、直近1回のセクション別内訳を返す"""
+    return {
+        kind: {**entry, "avg_tokens": round(entry["total_tokens"] / entry["builds"], 1), "avg_original_tokens": round(entry["original_tokens"] / entry["builds"], 1)}
+        for kind, entry in _stats.items()
+    }
@@ -0,0 +1,91 @@
+# cogs/_relationship_tracker.py (ユーザー同士の関係性トラッキング - チャンネルごとの間引き＆トピック抽出の使い回し)
+import time
+import asyncio
+import hashlib
+from collections import Counter
+from . import _memory_store as memory_store
+from ._cache import LRUCache, SingleFlight
+
+# -------------------- 設定項目 --------------------
+RELATION_DEBOUNCE = 5.0      # 最後の発言からこの秒数だけ静かになったらトピックを抽出する
+RELATION_MAX_WAIT = 30.0     # 発言が続いていても、最初の発言からこの秒数で必ず抽出する
+RELATION_TOPIC_CACHE_SIZE = 512
+# ------------------------------------------------
+
+def build_topic_prompt(context: str) -> str:
+    return f"以下の会話の中心的なトピックを単語で抽出しなさい(例:ゲーム,アニメ)。不明ならNoneと出力。\n\n{context}"
+
+class RelationshipTracker:
+    """
+    発言ごとに「誰と誰がやり取りしたか」だけをメモリに貯めておき、チャンネルが落ち着いたら
+    直近の会話から1回だけトピックを抽出して、貯まったペア全員にまとめて反映する。
+    同じ会話内容（ハッシュが同じ）ならLLMには聞き直さない。
+    generate は async (prompt: str) -> str な関数。
+    """
+
+    def __init__(self, generate, debounce: float = RELATION_DEBOUNCE, max_wait: float = RELATION_MAX_WAIT):
+        self.generate = generate
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.topics = LRUCache(max_entries=RELATION_TOPIC_CACHE_SIZE)  # {context_hash: topic or None}
+        self.inflight = SingleFlight()
+        self._pending = {}  # {channel_id: {"pairs": Counter, "context": str, "since": float}}
+        self._timers = {}
+        self._tasks = set()  # 反映中の処理（ループは弱参照しか持たないので、ここで握っておく）
+        self.stats = {"messages": 0, "extractions": 0, "cache_hits": 0, "pairs_recorded": 0, "errors": 0}
+
+    def observe(self, channel_id, author_id: str, recent):
+        """recent は直近の発言 ({'author_id', 'author_name', 'content'}) の並び"""
+        partners = {str(msg['author_id']) for msg in recent if str(msg['author_id']) != author_id}
+        if not partners: return
+        self.stats["messages"] += 1
+        pending = self._pending.get(channel_id)
+        if pending is None:
+            pending = self._pending[channel_id] = {"pairs": Counter(), "context": "", "since": time.monotonic()}
+        for partner_id in partners:
+            pending["pairs"][(author_id, partner_id)] += 1
+        pending["context"] = "\n".join([f"{msg['author_name']}: {msg['content']}" for msg in recent])
+
+        loop = asyncio.get_running_loop()
+        timer = self._timers.pop(channel_id, None)
+        if timer is not None: timer.cancel()
+        delay = min(self.debounce, max(0.0, pending["since"] + self.max_wait - time.monotonic()))
+        self._timers[channel_id] = loop.call_later(delay, self._fire, channel_id)
+
+    def _fire(self, channel_id):
+        self._timers.pop(channel_id, None)
+        pending = self._pending.pop(channel_id, None)
+        if not pending: return
+        task = asyncio.ensure_future(self._process(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _extract_topic(self, context: str):
+        key = hashlib.sha1(context.encode('utf-8')).hexdigest()
+        if key in self.topics:
+            self.stats["cache_hits"] += 1
+            return self.topics.get(key)
+
+        async def _extract():
+            self.stats["extractions"] += 1
+            topic = (await self.generate(build_topic_prompt(context))).strip()
+            topic = topic if topic and topic != 'None' else None
+            self.topics.set(key, topic)
+            return topic
+
+        return await self.inflight.run(key, _extract)
+
+    async def _process(self, pending):
+        try:
+            topic = await self._extract_topic(pending["context"])
+            if topic is None: return
+            # 書き込みは memory_store 側でまとめて遅延書き出しされる
+            for (author_id, partner_id), count in pending["pairs"].items():
+                memory_store.record_interaction(author_id, partner_id, topic, count)
+            self.stats["pairs_recorded"] += len(pending["pairs"])
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"An error occurred during user interaction processing: {e}")
+
+    def get_stats(self):
+        return {**self.stats, "pending_channels": len(self._pending)}
@@ -0,0 +1,153 @@
+# cogs/_scraper.py (Webページ本文のストリーミング抽出 - 複数ページ同時取得＆サイズ上限付き)
+import os
+import re
+import codecs
+import asyncio
+import aiohttp
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
+from ._http import http_client, HttpError
+from ._cache import LRUCache, SingleFlight
+
+# -------------------- 設定項目 --------------------
+SCRAPE_MAX_BYTES = 1024 * 1024   # 1ページあたりダウンロードする最大バイト数
+SCRAPE_MAX_CHARS = 2000          # 抽出する本文の最大文字数
+SCRAPE_CHUNK_SIZE = 16 * 1024
+SCRAPE_CACHE_TTL = float(os.getenv('SCRAPE_CACHE_TTL', 3600))
+SCRAPE_PARSE_WORKERS = 2
+BODY_CHARS_FACTOR = 4            # <main>/<article> 以外の本文は max_chars のこの倍数まで集めたら打ち切る
+# ------------------------------------------------
+
+_SKIP_TAGS = {'script', 'style', 'nav', 'footer', 'header', 'aside', 'form', 'noscript', 'template', 'svg'}
+_MAIN_TAGS = {'main', 'article'}
+_VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+# <meta charset="..."> と <meta http-equiv="Content-Type" content="text/html; charset=..."> のどちらにも当たる
+_META_CHARSET_RE = re.compile(rb'<meta[^>]*?charset\s*=\s*["\']?\s*([a-z0-9_.:-]+)', re.IGNORECASE)
+
+def make_decoder(header_charset, head: bytes):
+    """
+    レスポンスヘッダーの charset、なければ最初のチャンクの <meta> で宣言された文字コードのデコーダーを作る。
+    どちらもない・知らない名前のときは utf-8 にする。
+    """
+    candidates = [header_charset]
+    match = _META_CHARSET_RE.search(head)
+    if match: candidates.append(match.group(1).decode('ascii'))
+    for name in candidates:
+        if not name: continue
+        try:
+            return codecs.getincrementaldecoder(name)(errors='replace')
+        except LookupError:
+            print(f"Unknown page charset: {name}")
+    return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+
+class MainTextExtractor(HTMLParser):
+    """
+    少しずつ流し込まれるHTMLから本文テキストを拾う。
+    <main>/<article> の中身を優先し、十分な文字数が集まったら done になる。
+    それらがないページでも、それ以外の本文が max_chars の数倍集まったら done になる。
+    """
+
+    def __init__(self, max_chars: int = SCRAPE_MAX_CHARS):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self._skip_depth = 0
+        self._main_depth = 0
+        self._main_parts, self._main_len = [], 0
+        self._body_parts, self._body_len = [], 0
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_TAGS: return
+        if tag in _SKIP_TAGS: self._skip_depth += 1
+        elif tag in _MAIN_TAGS: self._main_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS and self._skip_depth > 0: self._skip_depth -= 1
+        elif tag in _MAIN_TAGS and self._main_depth > 0: self._main_depth -= 1
+
+    def handle_data(self, data):
+        if self.done or self._skip_depth > 0: return
+        text = ' '.join(data.split())
+        if not text: return
+        if self._main_depth > 0:
+            self._main_parts.append(text)
+            self._main_len += len(text) + 1
+            if self._main_len >= self.max_chars: self.done = True
+        else:
+            self._body_parts.append(text)
+            self._body_len += len(text) + 1
+            # <main>/<article> がないページでも、本文の候補が十分集まったらそこで打ち切る
+            if self._body_len >= self.max_chars * BODY_CHARS_FACTOR: self.done = True
+
+    def text(self):
+        parts = self._main_parts or self._body_parts
+        return ' '.join(parts)[:self.max_chars]
+
+
+class Scraper:
+    """本文抽出の結果をURLごとにキャッシュしつつ、複数ページを同時に取ってくる"""
+
+    def __init__(self):
+        self.cache = LRUCache(max_entries=256, ttl=SCRAPE_CACHE_TTL)
+        self.inflight = SingleFlight()
+        self._parse_pool = ThreadPoolExecutor(max_workers=SCRAPE_PARSE_WORKERS, thread_name_prefix='html-parse')
+        self.stats = {"pages": 0, "cache_hits": 0, "bytes_downloaded": 0, "early_stops": 0, "size_capped": 0}
+
+    async def _stream_extract(self, response, max_chars):
+        loop = asyncio.get_running_loop()
+        extractor = MainTextExtractor(max_chars)
+        decoder = None
+        received = 0
+        async for chunk in response.content.iter_chunked(SCRAPE_CHUNK_SIZE):
+            # ヘッダーに charset がないページも多いので、最初のチャンクの <meta> を見てから決める
+            if decoder is None: decoder = make_decoder(response.charset, chunk)
+            received += len(chunk)
+            # HTMLの解析はCPU仕事なので、イベントループではなく別スレッドでやる
+            await loop.run_in_executor(self._parse_pool, extractor.feed, decoder.decode(chunk))
+            if extractor.done:
+                # 本文が集まったら残りはダウンロードしない（接続はそのまま閉じられる）
+                self.stats["early_stops"] += 1
+                break
+            if received >= SCRAPE_MAX_BYTES:
+                self.stats["size_capped"] += 1
+                break
+        else:
+            if decoder is not None: await loop.run_in_executor(self._parse_pool, extractor.feed, decoder.decode(b'', final=True))
+        self.stats["bytes_downloaded"] += received
+        return extractor.text()
+
+    async def scrape(self, url: str, max_chars: int = SCRAPE_MAX_CHARS) -> str:
+        """指定されたURLの本文を抽出して返す。失敗したときは説明文を返す"""
+        key = (url, max_chars)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return cached
+
+        async def _scrape():
+            self.stats["pages"] += 1
+            try:
+                text = await http_client.request('GET', url, lambda response: self._stream_extract(response, max_chars), timeout=10)
+            except (aiohttp.ClientError, asyncio.TimeoutError, HttpError) as e:
+                print(f"Scraping error for {url}: {e}")
+                return f"（エラーでこの記事は読めなかったわ: {e}）"
+            except Exception as e:
+                print(f"Scraping error for {url}: {e}")
+                return f"（不明なエラーでこの記事は読めなかったわ: {e}）"
+            if not text:
+                return "（この記事、うまく読めなかったわ…主要なコンテンツが見つからないんだけど？）"
+            self.cache.set(key, text)
+            return text
+
+        return await self.inflight.run(key, _scrape)
+
+    async def scrape_many(self, urls, max_chars: int = SCRAPE_MAX_CHARS):
+        """複数のURLを同時に読み込んで、同じ順番で本文を返す"""
+        return await asyncio.gather(*[self.scrape(url, max_chars) for url in urls])
+
+    def get_stats(self):
+        return {**self.stats, "cached_pages": len(self.cache)}
+
+
+scraper = Scraper()
@@ -0,0 +1,146 @@
+# cogs/_search_cache.py (Web検索結果のTTLキャッシュ - 同時リクエストの相乗り＆障害時の古い結果返し)
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from ._cache import LRUCache, SingleFlight
+
+# -------------------- 設定項目 --------------------
+DATA_DIR = os.getenv('RAILWAY_VOLUME_MOUNT_PATH', '.')
+SEARCH_CACHE_FILE = os.path.join(DATA_DIR, 'search_cache.sqlite3')
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', 3600))  # 検索結果を新鮮とみなす秒数
+SEARCH_CACHE_MAX_ENTRIES = 1000
+SEARCH_CACHE_PERSIST = os.getenv('SEARCH_CACHE_PERSIST', '1') != '0'  # ディスクにも残すか
+SEARCH_CACHE_STALE_MAX_AGE = 7 * 24 * 3600  # 障害時に返してよい古い結果の上限
+# ------------------------------------------------
+
+def normalize_query(query: str) -> str:
+    """全角半角・大文字小文字・余分な空白の違いを吸収する"""
+    return ' '.join(unicodedata.normalize('NFKC', query).lower().split())
+
+class SearchCache:
+    """
+    (正規化したクエリ, 件数) をキーに検索結果を覚えておく。fetchがエラー文字列を返したら古い結果で代用する。
+    SQLiteの読み書きは専用スレッドで行う。
+    """
+
+    def __init__(self, path: str = SEARCH_CACHE_FILE, ttl: float = SEARCH_CACHE_TTL, persist: bool = SEARCH_CACHE_PERSIST):
+        self.path = path
+        self.ttl = ttl
+        self.persist = persist
+        self.memory = LRUCache(max_entries=SEARCH_CACHE_MAX_ENTRIES, ttl=ttl)
+        self.inflight = SingleFlight()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "stale_served": 0, "errors": 0}
+        self._conn = None
+        self._lock = threading.Lock()
+        self._disk_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search-cache')
+
+    def _get_conn(self):
+        if self._conn is None:
+            try:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS search_results (key TEXT PRIMARY KEY, results TEXT NOT NULL, stored_at REAL NOT NULL)")
+                self._conn = conn
+            except sqlite3.Error as e:
+                print(f"Search cache disabled its disk tier: {e}")
+                self._conn = False
+        return self._conn
+
+    def _disk_get(self, key):
+        """(結果, 経過秒数) を返す。なければNone"""
+        if not self.persist: return None
+        with self._lock:
+            conn = self._get_conn()
+            if not conn: return None
+            try:
+                row = conn.execute("SELECT results, stored_at FROM search_results WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f"Search cache read error: {e}")
+                return None
+        if row is None: return None
+        age = time.time() - row[1]
+        if age > SEARCH_CACHE_STALE_MAX_AGE: return None
+        try:
+            return json.loads(row[0]), age
+        except ValueError as e:
+            print(f"Search cache has a broken entry: {e}")
+            return None
+
+    def _disk_put(self, key, results):
+        if not self.persist: return
+        with self._lock:
+            conn = self._get_conn()
+            if not conn: return
+            try:
+                with conn:
+                    conn.execute("INSERT OR REPLACE INTO search_results (key, results, stored_at) VALUES (?, ?, ?)", (key, json.dumps(results, ensure_ascii=False), time.time()))
+            except sqlite3.Error as e:
+                print(f"Search cache write error: {e}")
+
+    async def _disk_get_async(self, key):
+        if not self.persist: return None
+        return await asyncio.get_running_loop().run_in_executor(self._disk_pool, self._disk_get, key)
+
+    def _disk_put_later(self, key, results):
+        """ディスクへの書き込みは専用スレッドに任せて、結果は待たない"""
+        if not self.persist: return
+        asyncio.get_running_loop().run_in_executor(self._disk_pool, self._disk_put, key, results)
+
+    async def _lookup_stale(self, key):
+        # メモリ側もディスク側と同じく、古すぎる結果は返さない
+        age = self.memory.age(key)
+        if age is not None and age <= SEARCH_CACHE_STALE_MAX_AGE:
+            stale = self.memory.get(key, allow_stale=True)
+            if stale is not None: return stale
+        on_disk = await self._disk_get_async(key)
+        return on_disk[0] if on_disk else None
+
+    async def get_or_fetch(self, query: str, num_results: int, fetch):
+        """fetch(query, num_results) は結果のlistか、失敗時はエラーメッセージのstrを返すこと"""
+        key = f"{num_results}:{normalize_query(query)}"
+        cached = self.memory.get(key)
+        if cached is not None:
+            self.stats["memory_hits"] += 1
+            return cached
+        on_disk = await self._disk_get_async(key)
+        if on_disk and on_disk[1] <= self.ttl:
+            self.stats["disk_hits"] += 1
+            self.memory.set(key, on_disk[0], age=on_disk[1])
+            return on_disk[0]
+        if self.inflight.is_running(key):
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+
+        async def _fetch():
+            result = await fetch(query, num_results)
+            if isinstance(result, list):
+                self.memory.set(key, result)
+                self._disk_put_later(key, result)
+                return result
+            self.stats["errors"] += 1
+            stale = await self._lookup_stale(key)
+            if stale is not None:
+                # 検索APIが落ちていても、古い結果があればそれで答える
+                self.stats["stale_served"] += 1
+                return stale
+            return result
+
+        return await self.inflight.run(key, _fetch)
+
+    def get_stats(self):
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"] + self.stats["coalesced"]
+        saved = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["coalesced"]
+        return {**self.stats, "api_calls_saved": saved, "hit_rate": round(saved / lookups, 4) if lookups else 0.0}
+
+    def close(self):
+        self._disk_pool.shutdown(wait=True)
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+            self._conn = None
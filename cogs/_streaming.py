@@ -0,0 +1,78 @@
+# cogs/_streaming.py (LLMの応答をストリーミングでDiscordに流す - 編集間隔の制御＆2000文字分割)
+import time
+
+# -------------------- 設定項目 --------------------
+DISCORD_MESSAGE_LIMIT = 2000
+STREAM_EDIT_INTERVAL = 1.2   # メッセージを編集する最短間隔(秒)。Discordの編集レート制限(5回/5秒)に収まるように
+STREAM_MIN_FIRST_CHARS = 1   # 最初のメッセージを送るのに必要な文字数
+# ------------------------------------------------
+
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT):
+    """limit文字以内のページに分ける。なるべく改行で切る（先頭から決定的に切るので、前のページは後から変わらない）"""
+    pages = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit + 1)
+        if cut < limit // 2: cut = limit
+        pages.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    pages.append(text)
+    return pages
+
+
+class StreamingMessage:
+    """
+    少しずつ届くテキストを、最初の塊はすぐ送信し、以降は一定間隔ごとの編集で伸ばしていく。
+    2000文字を超えた分は続きのメッセージとして送る。send は async (content) -> discord.Message な関数。
+    """
+
+    def __init__(self, send, edit_interval: float = STREAM_EDIT_INTERVAL):
+        self.send = send
+        self.edit_interval = edit_interval
+        self.text = ""
+        self.messages = []  # [(discord.Message, 表示中の内容)]
+        self._last_update = 0.0
+        self.edits = 0
+
+    async def append(self, chunk: str):
+        self.text += chunk
+        if not self.messages:
+            if len(self.text.strip()) >= STREAM_MIN_FIRST_CHARS: await self._sync()
+        elif time.monotonic() - self._last_update >= self.edit_interval:
+            await self._sync()
+
+    async def finish(self) -> str:
+        """残りをすべて反映して、最終的なテキストを返す"""
+        await self._sync()
+        return self.text.strip()
+
+    async def _sync(self):
+        pages = split_message(self.text.strip())
+        for i, page in enumerate(pages):
+            if not page: continue
+            if i < len(self.messages):
+                sent, shown = self.messages[i]
+                if shown == page: continue
+                await sent.edit(content=page)
+                self.messages[i] = (sent, page)
+                self.edits += 1
+            else:
+                self.messages.append((await self.send(page), page))
+        self._last_update = time.monotonic()
+
+
+async def stream_to_discord(response, send, edit_interval: float = STREAM_EDIT_INTERVAL) -> str:
+    """
+    generate_content_async(..., stream=True) の結果を流し込み、最終的なテキストを返す。
+    1文字も返ってこなかったときは ValueError。
+    """
+    streamer = StreamingMessage(send, edit_interval)
+    async for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # 安全フィルタや終了通知など、テキストを持たない塊
+            continue
+        await streamer.append(text)
+    final_text = await streamer.finish()
+    if not final_text: raise ValueError("empty response")
+    return final_text
@@ -0,0 +1,81 @@
+# cogs/_user_directory.py (ユーザーIDから表示名を引く - Gatewayキャッシュ優先＆REST呼び出しはまとめて並列)
+import asyncio
+import discord
+from ._cache import LRUCache, SingleFlight
+
+# -------------------- 設定項目 --------------------
+USER_NAME_TTL = 3600.0        # REST で取ってきた表示名を覚えておく秒数
+USER_NAME_CACHE_SIZE = 5000
+USER_FETCH_CONCURRENCY = 4    # fetch_user を同時に投げる上限（レート制限対策）
+USER_LOOKUP_TIMEOUT = 3.0     # まとめて引くときの待ち時間の上限。間に合わなかった分は諦める
+# ------------------------------------------------
+
+_NOT_FOUND = object()
+
+class UserDirectory:
+    """
+    表示名の解決順: サーバーのメンバーキャッシュ → Botのユーザーキャッシュ → TTLキャッシュ → fetch_user。
+    見つからないユーザーも覚えておき、同じIDで何度もRESTを叩かない。
+    """
+
+    def __init__(self, bot, ttl: float = USER_NAME_TTL, concurrency: int = USER_FETCH_CONCURRENCY):
+        self.bot = bot
+        self.names = LRUCache(max_entries=USER_NAME_CACHE_SIZE, ttl=ttl)
+        self.inflight = SingleFlight()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.stats = {"member_cache_hits": 0, "user_cache_hits": 0, "ttl_hits": 0, "fetches": 0, "not_found": 0, "errors": 0, "timeouts": 0}
+
+    def _from_gateway(self, user_id: int, guild):
+        member = guild.get_member(user_id) if guild else None
+        if member is not None:
+            self.stats["member_cache_hits"] += 1
+            return member.display_name
+        user = self.bot.get_user(user_id)
+        if user is not None:
+            self.stats["user_cache_hits"] += 1
+            return user.display_name
+        return None
+
+    async def _fetch(self, user_id: int):
+        async with self._semaphore:
+            self.stats["fetches"] += 1
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except discord.NotFound:
+                self.stats["not_found"] += 1
+                self.names.set(user_id, _NOT_FOUND)
+                return None
+            except discord.HTTPException as e:
+                # 429などの一時的な失敗はキャッシュせず、次の機会にまた引く
+                self.stats["errors"] += 1
+                print(f"Failed to fetch user {user_id}: {e}")
+                return None
+        self.names.set(user_id, user.display_name)
+        return user.display_name
+
+    async def display_name(self, user_id, guild=None):
+        """表示名を返す。見つからない・IDが不正ならNone"""
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        name = self._from_gateway(user_id, guild)
+        if name is not None: return name
+        cached = self.names.get(user_id)
+        if cached is not None:
+            self.stats["ttl_hits"] += 1
+            return None if cached is _NOT_FOUND else cached
+        return await self.inflight.run(user_id, lambda: self._fetch(user_id))
+
+    async def display_names(self, user_ids, guild=None, timeout: float = USER_LOOKUP_TIMEOUT):
+        """{user_id: 表示名} を返す。時間内に引けなかった・見つからなかったIDは含まれない"""
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids: return {}
+        tasks = {asyncio.ensure_future(self.display_name(user_id, guild)): user_id for user_id in user_ids}
+        done, not_done = await asyncio.wait(tasks, timeout=timeout)
+        for task in not_done: task.cancel()
+        self.stats["timeouts"] += len(not_done)
+        return {tasks[task]: task.result() for task in done if not task.cancelled() and task.exception() is None and task.result() is not None}
+
+    def get_stats(self):
+        return {**self.stats, "cached_names": len(self.names)}
@@ -1,66 +1,97 @@
 # cogs/_utils.py (エラー修正版)
 import os
-import requests
-from bs4 import BeautifulSoup
-import json
+import asyncio
+import aiohttp
 import google.generativeai as genai
 from . import _persona_manager as persona_manager
+from . import _memory_store as memory_store
+from ._embedding_cache import EmbeddingCache
+from ._embedding_batcher import EmbeddingBatcher
+from ._http import http_client, HttpError
+from ._search_cache import SearchCache
+from ._scraper import scraper, SCRAPE_MAX_CHARS
 
 # --- 環境変数を読み込む ---
 SEARCH_API_KEY = os.getenv('GOOGLE_SEARCH_API_KEY')
 SEARCH_ENGINE_ID = os.getenv('GOOGLE_SEARCH_ENGINE_ID')
+SEARCH_API_URL = "https://www.googleapis.com/customsearch/v1"
 DATA_DIR = os.getenv('RAILWAY_VOLUME_MOUNT_PATH', '.')
-MEMORY_FILE = os.path.join(DATA_DIR, 'bot_memory.json')
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_BATCH_WINDOW = float(os.getenv('EMBEDDING_BATCH_WINDOW', 0.02))  # 秒
+EMBEDDING_MAX_BATCH = 100  # batchEmbedContents の上限
 
-async def get_embedding(text: str, task_type="RETRIEVAL_DOCUMENT"):
-    """テキストをベクトル化して返す"""
-    if not text or not isinstance(text, str):
-        return None
+async def _embed_batch(texts: list, task_type: str):
+    """複数テキストを1回のAPI呼び出しでベクトル化する"""
+    # ★★★ ここがエラーの原因よ！ 古い通行証のチェックを削除したわ ★★★
+    result = await genai.embed_content_async(
+        model=EMBEDDING_MODEL,
+        content=texts,
+        task_type=task_type
+    )
+    return result['embedding']
+
+embedding_cache = EmbeddingCache()
+embedding_batcher = EmbeddingBatcher(_embed_batch, window=EMBEDDING_BATCH_WINDOW, max_batch=EMBEDDING_MAX_BATCH)
+
+async def _embed_uncached(text: str, task_type: str):
     try:
-        # ★★★ ここがエラーの原因よ！ 古い通行証のチェックを削除したわ ★★★
-        result = await genai.embed_content_async(
-            model="models/text-embedding-004",
-            content=text,
-            task_type=task_type
-        )
-        return result['embedding']
+        return await embedding_batcher.embed(text, task_type)
     except Exception as e:
         print(f"Embedding error: {e}")
         return None
 
+async def get_embedding(text: str, task_type="RETRIEVAL_DOCUMENT"):
+    """テキストをベクトル化して返す（同じテキストはキャッシュから返す）"""
+    if not text or not isinstance(text, str):
+        return None
+    return await embedding_cache.get_or_compute(text, EMBEDDING_MODEL, task_type, _embed_uncached)
+
+async def get_embeddings(texts: list, task_type="RETRIEVAL_DOCUMENT"):
+    """複数テキストをまとめてベクトル化する。失敗した要素はNoneになる"""
+    # 同時に投げればキャッシュの相乗りとまとめ送りが効いて、API呼び出しは最小限になる
+    return await asyncio.gather(*[get_embedding(text, task_type) for text in texts])
+
+def get_embedding_cache_stats():
+    """埋め込みキャッシュのヒット/ミス数を返す"""
+    return embedding_cache.get_stats()
+
+def get_embedding_batch_stats():
+    """埋め込みのまとめ送りの状況を返す"""
+    return embedding_batcher.get_stats()
+
 def get_current_persona_name():
-    """bot_memory.jsonから現在のペルソナ名を取得する"""
-    try:
-        with open(MEMORY_FILE, 'r', encoding='utf-8') as f:
-            memory = json.load(f)
-            return memory.get("server", {}).get("current_persona", persona_manager.DEFAULT_PERSONA)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return persona_manager.DEFAULT_PERSONA
+    """記憶ストアから現在のペルソナ名を取得する"""
+    return memory_store.get_setting("current_persona", persona_manager.DEFAULT_PERSONA)
 
 def get_current_persona():
     """現在のペルソナ設定をロードして返す"""
     persona_name = get_current_persona_name()
     return persona_manager.load_persona(persona_name)
 
-def google_search(query: str, num_results: int = 5) -> dict | str:
+search_cache = SearchCache()
+
+async def google_search(query: str, num_results: int = 5) -> dict | str:
     """
-    Google Custom Search APIを使ってWeb検索を実行する。
+    Google Custom Search APIを使ってWeb検索を実行する（同じクエリはキャッシュから返す）。
     成功した場合は検索結果のリスト(dict)を、失敗した場合はエラーメッセージ(str)を返す。
     """
     if not SEARCH_API_KEY or not SEARCH_ENGINE_ID:
         error_msg = "（検索機能のAPIキーかエンジンIDが設定されてないんだけど？ アンタのミスじゃない？）"
         print(error_msg)
         return error_msg
-    
-    url = "https://www.googleapis.com/customsearch/v1"
+    return await search_cache.get_or_fetch(query, num_results, _google_search_uncached)
+
+def get_search_cache_stats():
+    """検索キャッシュのヒット率と節約できたAPI呼び出し数を返す"""
+    return search_cache.get_stats()
+
+async def _google_search_uncached(query: str, num_results: int) -> list | str:
     params = {'key': SEARCH_API_KEY, 'cx': SEARCH_ENGINE_ID, 'q': query, 'num': num_results}
     
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        results = response.json()
+        results = await http_client.get_json(SEARCH_API_URL, params=params, timeout=10)
         return results.get('items', [])
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError, HttpError) as e:
         error_msg = f"（検索中にネットワークエラーよ。アンタの環境、ザコすぎなんじゃない？: {e}）"
         print(f"Google Search API error: {error_msg}")
         return error_msg
@@ -69,31 +100,18 @@ def google_search(query: str, num_results: int = 5) -> dict | str:
         print(f"Google Search API error: {error_msg}")
         return error_msg
 
-def scrape_url(url: str) -> str:
+async def scrape_url(url: str) -> str:
     """
-    指定されたURLの本文を抽出して返す。
+    指定されたURLの本文を抽出して返す（必要な分だけ読み込み、結果はURLごとにキャッシュ）。
     """
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'lxml')
-        
-        main_content = soup.find('main') or soup.find('article') or soup.find('body')
-        
-        if main_content:
-            for tag in main_content(['script', 'style', 'nav', 'footer', 'header', 'aside', 'form']):
-                tag.decompose()
-            
-            text = ' '.join(main_content.get_text(separator=' ', strip=True).split())
-            
-            return text[:2000] if len(text) > 2000 else text
-            
-        return "（この記事、うまく読めなかったわ…主要なコンテンツが見つからないんだけど？）"
-    except requests.exceptions.RequestException as e:
-        print(f"Scraping error for {url}: {e}")
-        return f"（エラーでこの記事は読めなかったわ: {e}）"
-    except Exception as e:
-        print(f"Scraping error for {url}: {e}")
-        return f"（不明なエラーでこの記事は読めなかったわ: {e}）"
+    return await scraper.scrape(url)
+
+async def scrape_urls(urls, max_chars: int = SCRAPE_MAX_CHARS) -> list:
+    """
+    複数のURLの本文を同時に抽出して、同じ順番のリストで返す。
+    """
+    return await scraper.scrape_many(urls, max_chars)
+
+def get_scraper_stats():
+    """本文抽出のキャッシュヒット数と読み込んだバイト数を返す"""
+    return scraper.get_stats()
@@ -0,0 +1,64 @@
+# cogs/_vector_executor.py (ベクトルDB操作専用のスレッドプール)
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class VectorStoreExecutor:
+    """
+    ChromaDBの同期APIを専用スレッドで動かし、イベントループ（＝Discordの心拍）を止めないようにする。
+    同時実行数は max_workers で制限し、あふれた分はキューで待たせる。
+    """
+
+    def __init__(self, max_workers: int = 4, name: str = "vector-store"):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "max_queued": 0, "total_wait": 0.0, "total_run": 0.0, "max_wait": 0.0}
+
+    async def run(self, fn, *args, **kwargs):
+        """fn(*args, **kwargs) をプール上で実行して結果を待つ"""
+        loop = asyncio.get_running_loop()
+        enqueued_at = time.monotonic()
+        with self._lock:
+            self.stats["submitted"] += 1
+            self.queued += 1
+            self.stats["max_queued"] = max(self.stats["max_queued"], self.queued)
+
+        def call():
+            started_at = time.monotonic()
+            wait = started_at - enqueued_at
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.stats["total_wait"] += wait
+                self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.stats["completed" if ok else "failed"] += 1
+                    self.stats["total_run"] += time.monotonic() - started_at
+
+        return await loop.run_in_executor(self._executor, call)
+
+    def get_stats(self):
+        with self._lock:
+            finished = self.stats["completed"] + self.stats["failed"]
+            return {
+                **self.stats,
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "avg_wait_ms": round(self.stats["total_wait"] / finished * 1000, 2) if finished else 0.0,
+                "avg_run_ms": round(self.stats["total_run"] / finished * 1000, 2) if finished else 0.0,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
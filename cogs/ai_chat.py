@@ -1,53 +1,45 @@
 # cogs/ai_chat.py (最終完全版 - 神の視点モード搭載)
 import discord
 from discord.ext import commands
-import google.generativeai as genai
-import os
-import json
 import asyncio
-import numpy as np
 import time
 import re
+import functools
 from collections import deque
-import requests
 from . import _utils as utils
 from . import _persona_manager as persona_manager
+from . import _memory_store as memory_store
+from ._mood_state import mood_state, load_mood_data
+from ._mood_aggregator import MoodAggregator
+from ._relationship_tracker import RelationshipTracker
+from ._user_directory import UserDirectory
+from ._prompt_builder import PromptBuilder, budget_for
+from ._context_gatherer import ContextGatherer
+from ._intervention_gate import InterventionGate
+from ._streaming import stream_to_discord, split_message
+from ._answer_cache import answer_cache
+from ._llm_dispatcher import INTERACTIVE, INTERVENTION, BACKGROUND
+from ._model_registry import models
 
 # -------------------- 設定項目 --------------------
 ENABLE_PROACTIVE_INTERVENTION = True
 INTERVENTION_THRESHOLD = 0.78
 INTERVENTION_COOLDOWN = 300
+SEARCH_SCRAPE_TOP_N = 3              # 検索結果の上位何件の本文を読むか
+SEARCH_SCRAPE_CHARS_PER_PAGE = 1500  # 1ページあたりプロンプトに入れる本文の文字数
+ANSWER_CACHE_BYPASS_WORDS = ('最新', '再検索')  # これを含む質問はキャッシュを使わず調べ直す
+ENABLE_SPECULATIVE_RETRIEVAL = True  # メタ思考と並行して記憶検索を先読みするか
+CONTEXT_TIMEOUTS = {                 # 応答用コンテキストの取得元ごとの締め切り(秒)
+    "target_user": 2.0,
+    "channel_logs": 4.0,
+    "cross_channel_logs": 4.0,
+    "notes": 3.0,
+    "relationships": 3.0,
+}
+# 関係性の相手の名前を引く待ち時間。relationships の締め切りより短くして、引けた分だけでも間に合わせる
+RELATIONSHIP_NAME_TIMEOUT = CONTEXT_TIMEOUTS["relationships"] - 0.5
 # ------------------------------------------------
 
-# ファイルパス設定
-DATA_DIR = os.getenv('RAILWAY_VOLUME_MOUNT_PATH', '.')
-MEMORY_FILE = os.path.join(DATA_DIR, 'bot_memory.json')
-MOOD_FILE = os.path.join(DATA_DIR, 'channel_mood.json')
-
-def load_memory():
-    try:
-        with open(MEMORY_FILE, 'r', encoding='utf-8') as f:
-            memory = json.load(f)
-            if 'relationships' not in memory: memory['relationships'] = {}
-            return memory
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {"users": {}, "server": {"notes": [], "relationships": {}}}
-
-def save_memory(data):
-    with open(MEMORY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
-
-def load_mood_data():
-    try:
-        with open(MOOD_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
-
-def save_mood_data(data):
-    with open(MOOD_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
-
 conversation_history = {}
 last_intervention_time = {}
 recent_messages = {}
@@ -55,8 +47,17 @@ recent_messages = {}
 class AIChat(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.model = genai.GenerativeModel('gemini-1.5-flash-latest')
         self.db_manager = None
+        self.mood_aggregator = MoodAggregator(functools.partial(self._generate_text, "mood"), mood_state)
+        self.relationship_tracker = RelationshipTracker(functools.partial(self._generate_text, "topic"))
+        self.users = UserDirectory(bot)
+        self.context_gatherer = ContextGatherer()
+        self.intervention_gate = InterventionGate(memory_store.lexical_overlap, utils.get_embedding, functools.partial(memory_store.search_notes, top_k=1), INTERVENTION_THRESHOLD)
+        self.speculation_stats = {"started": 0, "hits": 0, "misses": {}, "saved_ms": 0.0}
+
+    def cog_unload(self):
+        mood_state.flush()
+        memory_store.flush()
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -67,23 +68,13 @@ class AIChat(commands.Cog):
             print("Warning: DatabaseManager cog not found.")
 
     async def handle_keywords(self, message):
-        content = message.content
-        responses = { 'おはよう': 'おはよ♡ アンタも朝から元気なワケ？w', 'おやすみ': 'ふん、せいぜい良い夢でも見なさいよね！ザコちゃん♡', 'すごい': 'あっはは！当然でしょ？アタシを誰だと思ってんのよ♡', '天才': 'あっはは！当然でしょ？アタシを誰だと思ってんのよ♡', 'ありがとう': 'べ、別にアンタのためにやったんじゃないんだからね！勘違いしないでよね！', '感謝': 'べ、別にアンタのためにやったんじゃないんだからね！勘違いしないでよね！', '疲れた': 'はぁ？ザコすぎw もっとしっかりしなさいよね！', 'しんどい': 'はぁ？ザコすぎw もっとしっかりしなさいよね！',  'かわいい': 'ふ、ふーん…。まぁ、アンタがアタシの魅力に気づくのは当然だけど？♡', 'ｗ': '何笑ってんのよ、キモチワルイんだけど？', '笑': '何笑ってんのよ、キモチワルイんだけど？', 'ごめん': 'わかればいいのよ、わかれば。次はないかんね？', 'すまん': 'わかればいいのよ、わかれば。次はないかんね？', '何してる': 'アンタには関係ないでしょ。アタシはアンタと違って忙しいの！', 'なにしてる': 'アンタには関係ないでしょ。アタシはアンタと違って忙しいの！', 'お腹すいた': '自分でなんとかしなさいよね！アタシはアンタのママじゃないんだけど？', 'はらへった': '自分でなんとかしなさいよね！アタシはアンタのママじゃないんだけど？',}
-        for keyword, response in responses.items():
-            if keyword in content: await message.channel.send(response); return True
-        return False
-
-    def _find_similar_notes(self, query_embedding, memory_notes, top_k=3):
-        if not memory_notes or query_embedding is None: return []
-        query_vec = np.array(query_embedding)
-        notes_with_similarity = []
-        for note in memory_notes:
-            if 'embedding' not in note or note['embedding'] is None: continue
-            note_vec = np.array(note['embedding'])
-            similarity = np.dot(query_vec, note_vec) / (np.linalg.norm(query_vec) * np.linalg.norm(note_vec))
-            notes_with_similarity.append({'text': note['text'], 'similarity': similarity})
-        sorted_notes = sorted(notes_with_similarity, key=lambda x: x['similarity'], reverse=True)
-        return sorted_notes[:top_k]
+        # 今のペルソナの反射（読み込み時にコンパイル済み）で本文を1回だけなぞる
+        reflexes = persona_manager.get_reflexes(utils.get_current_persona_name())
+        if reflexes is None: return False
+        response = reflexes.match(message.channel.id, message.content)
+        if response is None: return False
+        await message.channel.send(response)
+        return True
 
     async def process_memory_consolidation(self, message, user_message, bot_response_text):
         try:
@@ -97,80 +88,40 @@ class AIChat(commands.Cog):
 # 指示
 この会話に、ユーザー({user_name})に関する新しい個人的な情報（好み、名前、目標、過去の経験など）や、後で会話に役立ちそうな重要な事実が含まれていますか？含まれている場合、その事実を「{user_name}は〇〇」という簡潔な三人称の文章で抽出しなさい。そうでなければ「None」と出力しなさい。
 """
-            response = await self.model.generate_content_async(consolidation_prompt)
+            response = await models.generate("memory", consolidation_prompt, priority=BACKGROUND)
             fact_to_remember = response.text.strip()
             if fact_to_remember != 'None' and fact_to_remember:
                 embedding = await utils.get_embedding(fact_to_remember)
                 if embedding is None: return
-                memory = load_memory()
-                if user_id not in memory['users']: memory['users'][user_id] = {'notes': []}
-                if not any(n['text'] == fact_to_remember for n in memory['users'][user_id]['notes']):
-                    memory['users'][user_id]['notes'].append({'text': fact_to_remember, 'embedding': embedding})
-                    save_memory(memory)
+                memory_store.add_note(user_id, fact_to_remember, embedding)
         except Exception as e: print(f"An error occurred during memory consolidation: {e}")
 
-    async def process_user_interaction(self, message):
-        try:
-            channel_id = message.channel.id
-            author_id = str(message.author.id)
-            if channel_id not in recent_messages or not recent_messages[channel_id]: return
-            interaction_partners = {str(msg['author_id']) for msg in recent_messages[channel_id] if str(msg['author_id']) != author_id}
-            if not interaction_partners: return
-            context = "\n".join([f"{msg['author_name']}: {msg['content']}" for msg in recent_messages[channel_id]])
-            for partner_id in interaction_partners:
-                interaction_prompt = f"以下の会話の中心的なトピックを単語で抽出しなさい(例:ゲーム,アニメ)。不明ならNoneと出力。\n\n{context}"
-                response = await self.model.generate_content_async(interaction_prompt)
-                topic = response.text.strip()
-                if topic != 'None' and topic:
-                    memory = load_memory()
-                    for u1, u2 in [(author_id, partner_id), (partner_id, author_id)]:
-                        if u1 not in memory['relationships']: memory['relationships'][u1] = {}
-                        if u2 not in memory['relationships'][u1]: memory['relationships'][u1][u2] = {'topics': {}, 'interaction_count': 0}
-                        memory['relationships'][u1][u2]['topics'][topic] = memory['relationships'][u1][u2]['topics'].get(topic, 0) + 1
-                        memory['relationships'][u1][u2]['interaction_count'] += 1
-                    save_memory(memory)
-        except Exception as e: print(f"An error occurred during user interaction processing: {e}")
-
-    async def analyze_and_track_mood(self, message: discord.Message):
-        try:
-            analysis_prompt = f"""
-以下のユーザーの発言を分析し、発言の感情を「Positive」「Negative」「Neutral」のいずれかで判定し、-1.0から1.0の範囲で感情スコアを付けなさい。
-ユーザーの発言: 「{message.content}」
-
-出力形式は必ず以下の厳密なJSON形式とすること。
-{{
-  "emotion": "判定結果",
-  "score": スコア
-}}
-"""
-            response = await self.model.generate_content_async(analysis_prompt)
-            json_match = re.search(r'```json\n({.*?})\n```', response.text, re.DOTALL) or re.search(r'({.*?})', response.text, re.DOTALL)
-            if json_match:
-                analysis_result = json.loads(json_match.group(1))
-                score = float(analysis_result.get("score", 0.0))
-                channel_id = str(message.channel.id)
-                mood_data = load_mood_data()
-                if channel_id not in mood_data: mood_data[channel_id] = {"scores": [], "average": 0.0}
-                scores = mood_data[channel_id].get("scores", [])
-                scores.append(score)
-                mood_data[channel_id]["scores"] = scores[-10:]
-                mood_data[channel_id]["average"] = round(np.mean(mood_data[channel_id]["scores"]), 4)
-                save_mood_data(mood_data)
-        except Exception as e:
-            print(f"An error occurred during mood analysis: {e}")
+    def process_user_interaction(self, message):
+        # 誰と誰が話したかだけ記録して、トピック抽出はチャンネルが落ち着いてから1回だけ行う
+        channel_id = message.channel.id
+        if not recent_messages.get(channel_id): return
+        self.relationship_tracker.observe(channel_id, str(message.author.id), list(recent_messages[channel_id]))
+
+    def analyze_and_track_mood(self, message: discord.Message):
+        # 1発言ごとにLLMを呼ばず、チャンネルごとに溜めてまとめて採点する
+        self.mood_aggregator.add(str(message.channel.id), message.content)
+
+    async def _generate_text(self, task, prompt):
+        response = await models.generate(task, prompt, priority=BACKGROUND)
+        return response.text
 
     @commands.Cog.listener()
     async def on_message(self, message):
         if message.author.bot or message.content.startswith(self.bot.command_prefix): return
         
-        asyncio.create_task(self.analyze_and_track_mood(message))
+        self.analyze_and_track_mood(message)
         if self.db_manager:
             asyncio.create_task(self.db_manager.add_message_to_db(message))
 
         channel_id = message.channel.id
         if channel_id not in recent_messages: recent_messages[channel_id] = deque(maxlen=6)
         recent_messages[channel_id].append({'author_id': message.author.id, 'author_name': message.author.display_name, 'content': message.content})
-        asyncio.create_task(self.process_user_interaction(message))
+        self.process_user_interaction(message)
         
         if self.bot.user.mentioned_in(message):
             if message.attachments:
@@ -183,17 +134,11 @@ class AIChat(commands.Cog):
         
         if ENABLE_PROACTIVE_INTERVENTION:
             now = time.time()
-            if (now - last_intervention_time.get(channel_id, 0)) < INTERVENTION_COOLDOWN: return
-            if len(message.content) < 10: return
-            query_embedding = await utils.get_embedding(message.content)
-            if query_embedding is None: return
-            memory = load_memory()
-            all_notes = [note for user in memory['users'].values() for note in user['notes']] + memory['server']['notes']
-            if not all_notes: return
-            most_relevant_note = self._find_similar_notes(query_embedding, all_notes, top_k=1)
-            if most_relevant_note and most_relevant_note[0]['similarity'] > INTERVENTION_THRESHOLD:
-                relevant_fact = most_relevant_note[0]['text']
-                await self.handle_proactive_intervention(message, relevant_fact)
+            if (now - last_intervention_time.get(channel_id, 0)) < INTERVENTION_COOLDOWN: self.intervention_gate.reject("cooldown"); return
+            if len(message.content) < 10: self.intervention_gate.reject("too_short"); return
+            # 文字n-gram → チャンネルの予算 → 埋め込み類似度 の順に、安い判定から足切りする
+            relevant_fact = await self.intervention_gate.find_fact(channel_id, message.content)
+            if relevant_fact: await self.handle_proactive_intervention(message, relevant_fact)
 
     async def handle_multimodal_mention(self, message):
         user_message = message.content.replace(f'<@!{self.bot.user.id}>', '').strip()
@@ -215,9 +160,8 @@ class AIChat(commands.Cog):
                 char_settings = persona["settings"].get("char_settings", "").format(user_name=user_name)
                 prompt_parts = [f"{char_settings}\n{multimodal_prompt_template}\n\n# ユーザーのテキスト\n「{user_message or '（…無言でコレをアタシに見せてきたわ）'}」\n\n# あなたの応答:", media_blob]
                 
-                multimodal_model = genai.GenerativeModel('gemini-1.5-pro-latest')
-                response = await multimodal_model.generate_content_async(prompt_parts)
-                await message.channel.send(response.text)
+                response = await models.generate("vision", prompt_parts, priority=INTERACTIVE, stream=True)
+                await stream_to_discord(response, message.channel.send)
             except Exception as e:
                 await message.channel.send(f"（うぅ…アンタのファイルを見ようとしたら、アタシの目がぁぁ…！: {e}）")
 
@@ -227,19 +171,55 @@ class AIChat(commands.Cog):
             persona = utils.get_current_persona()
             if not persona: await message.channel.send("（ペルソナファイルが読み込めないんだけど…！）"); return
             meta_thinking_prompt = self.build_meta_thinking_prompt(message, user_message, persona)
+            # メタ思考の結果を待つ間に、「普通に答える」前提で記憶の検索を先に始めておく
+            speculation = self.start_speculative_context(message, user_message) if ENABLE_SPECULATIVE_RETRIEVAL else None
             try:
-                response = await self.model.generate_content_async(meta_thinking_prompt)
+                response = await models.generate("meta_thinking", meta_thinking_prompt, priority=INTERACTIVE)
                 decision_data = self.parse_decision_text(response.text.strip())
             except Exception as e:
+                self.settle_speculation(speculation, "error")
                 await message.channel.send(f"（アタシの超思考回路にエラー発生よ…: {e}）"); return
 
             if decision_data.get("ACTION") == 'SEARCH':
+                self.settle_speculation(speculation, "search")
                 await self.execute_search_and_respond(message, user_message, decision_data.get("QUERY"), persona)
             else:
                 target_user_id = decision_data.get("TARGET_USER_ID")
-                final_prompt = await self.build_final_prompt(message, user_message, decision_data, persona, target_user_id)
+                has_target = bool(target_user_id) and target_user_id.lower() != 'none'
+                context_task = self.settle_speculation(speculation, "target_user" if has_target else None)
+                final_prompt = await self.build_final_prompt(message, user_message, decision_data, persona, target_user_id, context_task=context_task)
                 await self.generate_and_send_response(message, final_prompt, user_message, True)
 
+    def start_speculative_context(self, message, user_message):
+        task = asyncio.ensure_future(self.gather_context(message, user_message, user_message))
+        speculation = {"task": task, "started_at": time.monotonic(), "finished_at": None}
+        task.add_done_callback(lambda _: speculation.update(finished_at=time.monotonic()))
+        return speculation
+
+    def settle_speculation(self, speculation, miss_reason):
+        """miss_reason がNoneなら先読み結果のタスクを返す。それ以外なら先読みを捨ててNoneを返す"""
+        if speculation is None: return None
+        stats = self.speculation_stats
+        stats["started"] += 1
+        if miss_reason is not None:
+            speculation["task"].cancel()
+            stats["misses"][miss_reason] = stats["misses"].get(miss_reason, 0) + 1
+            return None
+        # メタ思考の間に進んだ分（先に終わっていれば検索にかかった全時間）だけ応答が早くなる
+        now = time.monotonic()
+        saved = (speculation["finished_at"] or now) - speculation["started_at"]
+        stats["hits"] += 1
+        stats["saved_ms"] += saved * 1000
+        return speculation["task"]
+
+    def get_speculation_stats(self):
+        stats = self.speculation_stats
+        return {
+            **stats,
+            "hit_rate": round(stats["hits"] / stats["started"], 4) if stats["started"] else 0.0,
+            "avg_saved_ms": round(stats["saved_ms"] / stats["hits"], 1) if stats["hits"] else 0.0,
+        }
+
     def build_meta_thinking_prompt(self, message, user_message, persona):
         mentioned_users_text = "（なし）"
         if message.mentions:
@@ -285,20 +265,74 @@ class AIChat(commands.Cog):
 
     async def execute_search_and_respond(self, message, user_message, query, persona):
         if not query: await message.channel.send("（検索キーワードを思いつかなかったわ…）"); return
+        started_at = time.monotonic()
+        # 同じペルソナで最近似たことを調べていたら、検索も生成もせずにその回答を返す
+        cache_scope = f"{utils.get_current_persona_name()}:search_reply"
+        query_embedding = await utils.get_embedding(query, task_type="RETRIEVAL_QUERY")
+        if any(word in user_message for word in ANSWER_CACHE_BYPASS_WORDS):
+            answer_cache.bypass()
+        else:
+            cached = answer_cache.lookup(query_embedding, cache_scope)
+            if cached:
+                for page in split_message(cached[0]): await message.channel.send(page)
+                self.record_exchange(message, user_message, cached[0])
+                return
         await message.channel.send(f"（「{query}」でググって、中身まで読んでやんよ♡）")
-        search_items = utils.google_search(query)
+        search_items = await utils.google_search(query)
         if isinstance(search_items, str) or not search_items:
             await message.channel.send(search_items or "（検索したけど、何も見つからなかったわ。）"); return
-        scraped_text = utils.scrape_url(search_items[0].get('link', ''))
+        # 上位のページをまとめて同時に読む（1ページずつ待たない）
+        top_items = [item for item in search_items if item.get('link')][:SEARCH_SCRAPE_TOP_N]
+        scraped_pages = await utils.scrape_urls([item['link'] for item in top_items], SEARCH_SCRAPE_CHARS_PER_PAGE)
+        scraped_text = "\n\n".join([f"## {item.get('title', '')}\n{text}" for item, text in zip(top_items, scraped_pages)]) or "（特になし）"
         search_summary = "\n".join([f"- {item.get('title', '')}" for item in search_items])
         search_prompt_template = persona["settings"].get("search_prompt", "# 指示\n検索結果を元に応答しなさい。")
-        final_prompt = f"{search_prompt_template}\n# 検索結果\n{search_summary}\n# Webページ本文\n{scraped_text}\n# ユーザーの質問\n{user_message}\n# あなたの回答:"
-        await self.generate_and_send_response(message, final_prompt, user_message, False)
+        builder = PromptBuilder("search_reply", budget_for(models.model_name("search")))
+        builder.add("instructions", search_prompt_template)
+        builder.add("search_results", search_summary, header="\n# 検索結果\n", priority=2)
+        builder.add("page_text", scraped_text, header="\n# Webページ本文\n", priority=1)
+        builder.add("question", f"\n# ユーザーの質問\n{user_message}\n# あなたの回答:")
+        final_prompt = builder.build()
+        answer = await self.generate_and_send_response(message, final_prompt, user_message, False)
+        if answer: answer_cache.store(query_embedding, cache_scope, answer, time.monotonic() - started_at)
+
+    async def _search_notes_text(self, embedding_task, owner_id):
+        query_embedding = await asyncio.shield(embedding_task)
+        return "\n".join([f"- {n['text']}" for n in memory_store.search_notes(query_embedding, owner_id)]) or "（特になし）"
+
+    async def _relationship_text(self, user_id, guild):
+        user_relationships = memory_store.get_relationships(user_id)
+        if not user_relationships: return "（特になし）"
+        # 相手の名前はまとめて引き、引けなかった人だけ飛ばす
+        partner_names = await self.users.display_names(user_relationships.keys(), guild, timeout=RELATIONSHIP_NAME_TIMEOUT)
+        relations = []
+        for p_id, d in user_relationships.items():
+            if p_id not in partner_names: continue
+            top_topic = max(d['topics'], key=d['topics'].get) if d.get('topics') else '色々な話'
+            relations.append(f"- {partner_names[p_id]}とは「{top_topic}」についてよく話している")
+        return "\n".join(relations) or "（特になし）"
+
+    async def gather_context(self, message, user_message, search_query, target_user_id=None):
+        """応答に使う記憶を集める。各ソースは互いに独立しているので同時に取りに行き、締め切りに遅れたものは「特になし」で諦める"""
+        user_id = str(message.author.id)
+        notes_embedding = asyncio.ensure_future(utils.get_embedding(user_message))
+        sources = {
+            "user_notes": (self._search_notes_text(notes_embedding, user_id), CONTEXT_TIMEOUTS["notes"]),
+            "server_notes": (self._search_notes_text(notes_embedding, memory_store.SERVER_SCOPE), CONTEXT_TIMEOUTS["notes"]),
+            "relationships": (self._relationship_text(user_id, message.guild), CONTEXT_TIMEOUTS["relationships"]),
+        }
+        if self.db_manager:
+            sources["channel_logs"] = (self.db_manager.search_similar_messages(search_query, str(message.channel.id), author_id=target_user_id), CONTEXT_TIMEOUTS["channel_logs"])
+            if not target_user_id:
+                sources["cross_channel_logs"] = (self.db_manager.search_across_all_channels(search_query, message.guild), CONTEXT_TIMEOUTS["cross_channel_logs"])
+        try:
+            return await self.context_gatherer.gather(sources)
+        finally:
+            notes_embedding.cancel()
 
-    async def build_final_prompt(self, message, user_message, decision_data, persona, target_user_id: str = None):
+    async def build_final_prompt(self, message, user_message, decision_data, persona, target_user_id: str = None, context_task=None):
         user_id = str(message.author.id)
-        memory = load_memory()
-        user_name = memory.get('users', {}).get(user_id, {}).get('fixed_nickname', message.author.display_name)
+        user_name = memory_store.get_nickname(user_id) or message.author.display_name
         
         channel_id = str(message.channel.id)
         mood_data = load_mood_data().get(channel_id, {"average": 0.0})
@@ -309,81 +343,75 @@ class AIChat(commands.Cog):
 
         prompt_heading = "【チャンネル内記憶】このチャンネルでの関連性の高い過去の会話ログ"
         if target_user_id and target_user_id.lower() != 'none':
-            try:
-                target_user_object = await self.bot.fetch_user(int(target_user_id))
-                prompt_heading = f"【チャンネル内記憶】ユーザー「{target_user_object.display_name}」に関する過去の発言ログ"
-                search_query = target_user_object.display_name
-            except (discord.NotFound, ValueError):
+            target_name = await self.context_gatherer.fetch("target_user", self.users.display_name(target_user_id, message.guild), CONTEXT_TIMEOUTS["target_user"])
+            if target_name:
+                prompt_heading = f"【チャンネル内記憶】ユーザー「{target_name}」に関する過去の発言ログ"
+                search_query = target_name
+            else:
                 target_user_id, search_query = None, user_message
         else:
             target_user_id, search_query = None, user_message
 
-        relevant_logs_text, cross_channel_logs_text = "（特になし）", "（特になし）"
-        if self.db_manager:
-            relevant_logs_text = await self.db_manager.search_similar_messages(search_query, str(message.channel.id), author_id=target_user_id)
-            if not target_user_id:
-                cross_channel_logs_text = await self.db_manager.search_across_all_channels(search_query, message.guild)
-        
-        query_embedding = await utils.get_embedding(user_message)
-        user_notes_all = memory.get('users', {}).get(user_id, {}).get('notes', [])
-        server_notes_all = memory.get('server', {}).get('notes', [])
-        user_notes_text = "\n".join([f"- {n['text']}" for n in self._find_similar_notes(query_embedding, user_notes_all)]) or "（特になし）"
-        server_notes_text = "\n".join([f"- {n['text']}" for n in self._find_similar_notes(query_embedding, server_notes_all)]) or "（特になし）"
-        
-        relationship_text = "（特になし）"
-        if user_id in memory.get('relationships', {}):
-            try:
-                relations = []
-                for p_id, d in memory['relationships'][user_id].items():
-                    partner = await self.bot.fetch_user(int(p_id))
-                    top_topic = max(d['topics'], key=d['topics'].get) if d.get('topics') else '色々な話'
-                    relations.append(f"- {partner.display_name}とは「{top_topic}」についてよく話している")
-                if relations: relationship_text = "\n".join(relations)
-            except Exception: # ユーザーが見つからない場合など
-                pass
+        if context_task is not None and not target_user_id:
+            # メタ思考と並行して先読みしておいた結果を使う
+            context = await context_task
+        else:
+            context = await self.gather_context(message, user_message, search_query, target_user_id)
+        relevant_logs_text = context.get("channel_logs", "（特になし）")
+        cross_channel_logs_text = context.get("cross_channel_logs", "（特になし）")
+        user_notes_text, server_notes_text = context["user_notes"], context["server_notes"]
+        relationship_text = context["relationships"]
 
         char_settings = persona["settings"].get("char_settings", "").format(user_name=user_name)
-        return f"""{char_settings}
+        builder = PromptBuilder("final_reply", budget_for(models.model_name("final_reply")))
+        builder.add("char_settings", char_settings)
+        builder.add("strategy", f"""
 ---
 # ★★★ アタシの思考と応答戦略 ★★★
 [EMOTION:{decision_data.get("EMOTION", "不明")}] [INTENT:{decision_data.get("INTENT", "不明")}] [STRATEGY:{decision_data.get("STRATEGY", "不明")}] [POINTS:{decision_data.get("POINTS", "特になし")}]
 ---
 # 記憶情報（これらの情報を統合して、人間のように自然で文脈に合った応答を生成すること）
 ## 【最優先】現在のチャンネルの雰囲気
-このチャンネルは現在、「{mood_text}」な雰囲気（ムードスコア: {mood_score:.2f}）です。この空気を読んで応答しなさい。
-## {prompt_heading}
-{relevant_logs_text}
+このチャンネルは現在、「{mood_text}」な雰囲気（ムードスコア: {mood_score:.2f}）です。この空気を読んで応答しなさい。""")
+        # 数字が大きいほど最後まで残す。予算を超えたら人間関係→サーバー横断ログ→…の順に削る
+        builder.add("channel_logs", relevant_logs_text, header=f"\n## {prompt_heading}\n", priority=3)
+        builder.add("cross_channel_logs", cross_channel_logs_text, header="""
 ## ★★★【サーバー横断記憶】サーバー全体の関連性の高い過去の会話ログ★★★
 これは、他のチャンネルで行われた、今の会話に関連する可能性のある記憶です。もし関連があれば、自然な形で会話に組み込みなさい。（例：「そういえば、その話、昨日 #別のチャンネル で〇〇さんが言ってたわね…」）
-{cross_channel_logs_text}
-## 【参考】直前の会話
-{self.get_history_text(message.channel.id)}
-## 【参考】その他の知識
-- ユーザー({user_name})に関する手動記憶(JSON): {user_notes_text}
-- サーバー全体の共有知識(JSON): {server_notes_text}
-- サーバーの人間関係: {relationship_text}
+""", priority=2)
+        builder.add("history", self.get_history_text(message.channel.id), header="\n## 【参考】直前の会話\n", priority=4, keep='tail')
+        builder.add("user_notes", user_notes_text, header=f"\n## 【参考】その他の知識\n- ユーザー({user_name})に関する手動記憶(JSON): ", priority=5)
+        builder.add("server_notes", server_notes_text, header="\n- サーバー全体の共有知識(JSON): ", priority=3)
+        builder.add("relationships", relationship_text, header="\n- サーバーの人間関係: ", priority=1)
+        builder.add("instructions", f"""
 ---
 以上の全てを完璧に理解し、立案した「応答戦略」と「チャンネルの雰囲気」、「サーバー全体の記憶」に基づき、ユーザー `{user_name}` のメッセージ「{user_message}」に返信しなさい。
 **【重要】** もしこれが特定のユーザーに関する質問なら、提示されたログからその人がどんな人物で、何に興味があるかを**要約して**答えなさい。
 **【最重要命令】全返答は150文字以内で簡潔にまとめること。**
 # あなたの返答:
-"""
+""")
+        return builder.build()
+
+    def record_exchange(self, message, user_message, bot_response_text):
+        channel_id = message.channel.id
+        if channel_id not in conversation_history: conversation_history[channel_id] = deque(maxlen=10)
+        conversation_history[channel_id].append(f"ユーザー「{message.author.display_name}」: {user_message}")
+        conversation_history[channel_id].append(f"アタシ: {bot_response_text}")
 
     async def generate_and_send_response(self, message, final_prompt, user_message, should_consolidate_memory):
+        """応答を生成して送信し、送ったテキストを返す（失敗したらNone）"""
         try:
-            response = await self.model.generate_content_async(final_prompt)
-            bot_response_text = response.text.strip()
-            await message.channel.send(bot_response_text)
-
-            channel_id = message.channel.id
-            if channel_id not in conversation_history: conversation_history[channel_id] = deque(maxlen=10)
-            conversation_history[channel_id].append(f"ユーザー「{message.author.display_name}」: {user_message}")
-            conversation_history[channel_id].append(f"アタシ: {bot_response_text}")
+            # 生成された端から送信し、続きは編集で書き足していく
+            response = await models.generate("final_reply", final_prompt, priority=INTERACTIVE, stream=True)
+            bot_response_text = await stream_to_discord(response, message.channel.send)
+            self.record_exchange(message, user_message, bot_response_text)
             
             if should_consolidate_memory:
                 asyncio.create_task(self.process_memory_consolidation(message, user_message, bot_response_text))
+            return bot_response_text
         except Exception as e:
             await message.channel.send(f"（うぅ…アタシの最終思考にエラー発生よ！アンタのせい！: {e}）")
+            return None
 
     async def handle_proactive_intervention(self, message, relevant_fact):
         persona = utils.get_current_persona()
@@ -393,18 +421,21 @@ class AIChat(commands.Cog):
                 context = "\n".join([f"{msg['author_name']}: {msg['content']}" for msg in recent_messages.get(message.channel.id, [])])
                 char_settings = persona["settings"].get("char_settings", "").format(user_name="みんな")
                 intervention_prompt_template = persona["settings"].get("intervention_prompt", "会話に自然に割り込みなさい。")
-                final_intervention_prompt = f"""{char_settings}
+                builder = PromptBuilder("intervention", budget_for(models.model_name("intervention")))
+                builder.add("char_settings", char_settings)
+                builder.add("context", context, header="""
 # 状況
 今、チャンネルでは以下の会話が進行中です。この会話の流れと、あなたが持っている知識を結びつけて、自然で面白い介入をしなさい。
 ## 直近の会話の流れ
-{context}
-## あなたが持っている関連知識
-「{relevant_fact}」
+""", priority=2, keep='tail')
+                builder.add("relevant_fact", f"「{relevant_fact}」", header="\n## あなたが持っている関連知識\n", priority=3)
+                builder.add("instructions", f"""
 # 指示
 {intervention_prompt_template}
 # あなたの割り込み発言:
-"""
-                response = await self.model.generate_content_async(final_intervention_prompt)
+""")
+                final_intervention_prompt = builder.build()
+                response = await models.generate("intervention", final_intervention_prompt, priority=INTERVENTION)
                 intervention_text = response.text.strip()
                 if len(intervention_text) > 5:
                     await message.channel.send(intervention_text)
@@ -3,27 +3,23 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import json
-import google.generativeai as genai
 import os
-import requests
 import io
 import time
 from PIL import Image, ImageDraw, ImageFont
 from . import _utils as utils
 from . import _persona_manager as persona_manager
-from .ai_chat import load_mood_data
+from . import _memory_store as memory_store
+from ._backfill import BackfillPipeline
+from ._streaming import stream_to_discord, split_message
+from ._answer_cache import answer_cache
+from ._llm_dispatcher import llm, INTERACTIVE
+from ._model_registry import models
+from ._prompt_builder import PromptBuilder, budget_for, get_prompt_stats
+from ._mood_state import load_mood_data
 import traceback
 
 # -------------------- ヘルパー関数 --------------------
-def load_memory():
-    try:
-        with open(os.path.join(utils.DATA_DIR, 'bot_memory.json'), 'r', encoding='utf-8') as f: return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {"users": {}, "server": {"notes": []}}
-
-def save_memory(data):
-    with open(os.path.join(utils.DATA_DIR, 'bot_memory.json'), 'w', encoding='utf-8') as f: json.dump(data, f, indent=4, ensure_ascii=False)
-
 def load_todos():
     try:
         with open(os.path.join(utils.DATA_DIR, 'todos.json'), 'r', encoding='utf-8') as f: return json.load(f)
@@ -48,7 +44,6 @@ async def is_owner(interaction: discord.Interaction) -> bool:
 class UserCommands(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.model = genai.GenerativeModel('gemini-1.5-flash-latest')
 
     # ★★★ ヘルプコマンド ★★★
     @app_commands.command(name="help", description="アタシが使えるコマンドの一覧よ♡")
@@ -62,7 +57,7 @@ class UserCommands(commands.Cog):
         embed.add_field(name="🌐 サーバー共通", value="`/server_remember` `[note]`\n`/server_recall`", inline=False)
         embed.add_field(name="👤 ペルソナ管理", value="`/list_personas`\n`/current_persona`\n`/set_persona` `[id]` (オーナー限定)", inline=False)
         embed.add_field(name="🛠️ ツール", value="`/search` `[query]`\n`/todo` `[add/list/done]`\n`/roast` `[image]` `[comment]`\n`/ping`", inline=False)
-        embed.add_field(name="⚙️ デバッグ & DB (オーナー限定)", value="`/debug_memory`\n`/backfill_logs` `[limit]`\n`/test_recall` `[query]`\n`/reset_database`\n`/reload_cogs`\n`/db_status`\n`/mood` `[channel]`", inline=False)
+        embed.add_field(name="⚙️ デバッグ & DB (オーナー限定)", value="`/debug_memory`\n`/backfill_logs` `[limit]`\n`/test_recall` `[query]`\n`/reset_database`\n`/reload_cogs`\n`/db_status`\n`/mood` `[channel]`\n`/perf_stats`", inline=False)
         embed.set_footer(text="アタシへの会話は @メンション を付けて話しかけなさいよね！")
         await interaction.response.send_message(embed=embed)
 
@@ -87,15 +82,12 @@ class UserCommands(commands.Cog):
     @app_commands.describe(persona_id="どのアタシになりたいわけ？IDを指定しなさい！")
     @app_commands.check(is_owner)
     async def set_persona(self, interaction: discord.Interaction, persona_id: str):
-        available_personas = [p['id'] for p in persona_manager.list_personas()]
-        if persona_id not in available_personas:
+        if not persona_manager.has_persona(persona_id):
             await interaction.response.send_message(f"「{persona_id}」なんて人格、アタシにはないんだけど？ IDが間違ってるんじゃないの？", ephemeral=True)
             return
 
-        memory = load_memory()
-        if 'server' not in memory: memory['server'] = {}
-        memory['server']['current_persona'] = persona_id
-        save_memory(memory)
+        memory_store.set_setting('current_persona', persona_id)
+        answer_cache.invalidate()  # 前の人格の口調で作った回答は使えない
         
         new_persona = persona_manager.load_persona(persona_id)
         await interaction.response.send_message(f"ふん、しょーがないから、今日からアタシは「**{new_persona.get('name')}**」になってやんよ♡ ありがたく思いなさいよね！")
@@ -125,11 +117,10 @@ class UserCommands(commands.Cog):
 
         await interaction.response.defer()
         try:
-            roast_model = genai.GenerativeModel('gemini-1.5-pro-latest')
             img_data = await image.read()
             img = Image.open(io.BytesIO(img_data)).convert("RGBA")
             roast_prompt = f'あなたは、ユーザーが投稿した画像に、生意気で面白いコメントを入れる天才美少女「メスガキちゃん」です。\nユーザーからの指示: {comment or "（特になし）"}\nあなたが書き込む辛口コメント（1文だけ）:'
-            roast_response = await roast_model.generate_content_async(roast_prompt)
+            roast_response = await models.generate("roast", roast_prompt, priority=INTERACTIVE)
             roast_text = roast_response.text.strip().replace('。', '')
             draw = ImageDraw.Draw(img)
             font_size = int(min(img.width, img.height) * 0.1)
@@ -158,15 +149,26 @@ class UserCommands(commands.Cog):
             await interaction.followup.send(f"（うぅ…画像の処理中にエラーが出たわ…: {e}）")
 
     @app_commands.command(name="search", description="ペルソナを反映してWeb検索するわよ")
-    @app_commands.describe(query="何をググってほしいわけ？")
-    async def search(self, interaction: discord.Interaction, query: str):
+    @app_commands.describe(query="何をググってほしいわけ？", fresh="前に調べた回答を使わずに調べ直すか")
+    async def search(self, interaction: discord.Interaction, query: str, fresh: bool = False):
         await interaction.response.defer()
         persona = utils.get_current_persona()
         if not persona:
             await interaction.followup.send("（ごめん、ペルソナファイルが読み込めないの…）", ephemeral=True)
             return
+
+        started_at = time.monotonic()
+        cache_scope = f"{utils.get_current_persona_name()}:search_command"
+        query_embedding = await utils.get_embedding(query, task_type="RETRIEVAL_QUERY")
+        if fresh:
+            answer_cache.bypass()
+        else:
+            cached = answer_cache.lookup(query_embedding, cache_scope)
+            if cached:
+                for page in split_message(cached[0]): await interaction.followup.send(page)
+                return
         
-        search_results = utils.google_search(query)
+        search_results = await utils.google_search(query)
         if isinstance(search_results, str) or not search_results:
             await interaction.followup.send(search_results or "（何も見つからなかったわ。）")
             return
@@ -174,10 +176,15 @@ class UserCommands(commands.Cog):
         search_results_text = "\n\n".join([f"【ソース: {item.get('displayLink')}】{item.get('title')}\n{item.get('snippet')}" for item in search_results])
         char_settings = persona["settings"].get("char_settings", "").format(user_name=interaction.user.display_name)
         search_prompt_template = persona["settings"].get("search_prompt", "# 指示\n検索結果を元に応答しなさい。")
-        synthesis_prompt = f"{char_settings}\n{search_prompt_template}\n# 検索結果\n{search_results_text}\n# ユーザーの質問\n{query}\n# あなたの回答:"
+        builder = PromptBuilder("search_command", budget_for(models.model_name("search")))
+        builder.add("instructions", f"{char_settings}\n{search_prompt_template}")
+        builder.add("search_results", search_results_text, header="\n# 検索結果\n", priority=1)
+        builder.add("question", f"\n# ユーザーの質問\n{query}\n# あなたの回答:")
+        synthesis_prompt = builder.build()
         try:
-            response = await self.model.generate_content_async(synthesis_prompt)
-            await interaction.followup.send(response.text)
+            response = await models.generate("search", synthesis_prompt, priority=INTERACTIVE, stream=True)
+            answer = await stream_to_discord(response, lambda content: interaction.followup.send(content, wait=True))
+            answer_cache.store(query_embedding, cache_scope, answer, time.monotonic() - started_at)
         except Exception as e: 
             await interaction.followup.send(f"（頭脳がショートしたわ…: {e}）")
 
@@ -229,21 +236,15 @@ class UserCommands(commands.Cog):
         if embedding is None:
             await interaction.followup.send("（エラーで脳に刻み込めなかったわ…）", ephemeral=True)
             return
-        memory = load_memory()
         user_id = str(interaction.user.id)
-        if user_id not in memory['users']: memory['users'][user_id] = {'notes': []}
-        if not any(n['text'] == note for n in memory['users'][user_id]['notes']):
-            memory['users'][user_id]['notes'].append({'text': note, 'embedding': embedding})
-            save_memory(memory)
+        if memory_store.add_note(user_id, note, embedding):
             await interaction.followup.send(f"ふーん、「{note}」ね。覚えててやんよ♡")
         else:
             await interaction.followup.send("それ、もう知ってるし。", ephemeral=True)
 
     @app_commands.command(name="recall", description="アタシがアンタについて覚えてることリストよ♡")
     async def recall(self, interaction: discord.Interaction):
-        memory = load_memory()
-        user_id = str(interaction.user.id)
-        user_notes = memory.get('users', {}).get(user_id, {}).get('notes', [])
+        user_notes = memory_store.get_notes(str(interaction.user.id))
         if not user_notes:
             await interaction.response.send_message('アンタに関する記憶は、まだ何もないけど？w')
         else:
@@ -253,12 +254,8 @@ class UserCommands(commands.Cog):
     @app_commands.command(name="forget", description="アンタに関する記憶を忘れさせてあげる")
     @app_commands.describe(index="消したい記憶の番号をちゃんと指定しなさいよね！")
     async def forget(self, interaction: discord.Interaction, index: int):
-        memory = load_memory()
-        user_id = str(interaction.user.id)
-        real_index = index - 1
-        if user_id in memory['users'] and 0 <= real_index < len(memory['users'][user_id].get('notes', [])):
-            removed = memory['users'][user_id]['notes'].pop(real_index)
-            save_memory(memory)
+        removed = memory_store.remove_note(str(interaction.user.id), index - 1)
+        if removed:
             await interaction.response.send_message(f"「{removed['text']}」ね。アンタの記憶から消してあげたわよ。")
         else:
             await interaction.response.send_message('その番号の記憶なんて、元からないんだけど？', ephemeral=True)
@@ -266,18 +263,12 @@ class UserCommands(commands.Cog):
     @app_commands.command(name="setname", description="アタシが呼ぶアンタの名前を設定する")
     @app_commands.describe(name="これからは、なんて呼んでやろうかしら？♡")
     async def setname(self, interaction: discord.Interaction, name: str):
-        memory = load_memory()
-        user_id = str(interaction.user.id)
-        if user_id not in memory.get('users', {}): memory['users'][user_id] = {'notes': []}
-        memory['users'][user_id]['fixed_nickname'] = name
-        save_memory(memory)
+        memory_store.set_nickname(str(interaction.user.id), name)
         await interaction.response.send_message(f"ふん、アンタのこと、これからは「{name}」って呼んでやんよ♡")
 
     @app_commands.command(name="myname", description="アタシがアンタをなんて呼んでるか確認しなさいよね")
     async def myname(self, interaction: discord.Interaction):
-        memory = load_memory()
-        user_id = str(interaction.user.id)
-        nickname = memory.get('users', {}).get(user_id, {}).get('fixed_nickname')
+        nickname = memory_store.get_nickname(str(interaction.user.id))
         if nickname:
             await interaction.response.send_message(f"アンタの名前は「{nickname}」でしょ？♡")
         else:
@@ -306,9 +297,9 @@ class UserCommands(commands.Cog):
         await interaction.followup.send(response)
 
     @app_commands.command(name="backfill_logs", description="サーバーの過去ログをDBに保存するわ（オーナー限定）")
-    @app_commands.describe(limit="各チャンネルから最大何件取得する？（デフォルト: 100）")
+    @app_commands.describe(limit="各チャンネルから最大何件取得する？（デフォルト: 100）", resume="前回の続きから遡る？前回より後の発言も取り込むわ（デフォルト: はい）")
     @app_commands.check(is_owner)
-    async def backfill_logs(self, interaction: discord.Interaction, limit: int = 100):
+    async def backfill_logs(self, interaction: discord.Interaction, limit: int = 100, resume: bool = True):
         await interaction.response.defer()
         db_manager = self.bot.get_cog('DatabaseManager')
         if not db_manager or not db_manager.chroma_client:
@@ -317,19 +308,15 @@ class UserCommands(commands.Cog):
         
         await interaction.edit_original_response(content=f"しょーがないから、過去ログ学習を始めるわよ！ 各チャンネル、最大{limit}件まで遡ってアタシの記憶に刻んであげる♡")
         
-        start_time = time.time()
-        total_processed, total_added = 0, 0
         text_channels = [ch for ch in interaction.guild.text_channels if ch.permissions_for(interaction.guild.me).read_message_history]
-        for channel in text_channels:
-            try:
-                async for message in channel.history(limit=limit):
-                    total_processed += 1
-                    if await db_manager.add_message_to_db(message):
-                        total_added += 1
-            except Exception as e:
-                print(f"Error backfilling channel {channel.name}: {e}")
+
+        async def report_progress(pipeline):
+            await interaction.edit_original_response(content=f"過去ログ学習中よ…♡\n**チャンネル:** {pipeline.channels_done}/{len(text_channels)}, **処理:** {pipeline.processed}件, **新規追加:** {pipeline.added}件, **速度:** {pipeline.throughput:.1f}件/秒")
+
+        start_time = time.time()
+        pipeline = await BackfillPipeline(db_manager, text_channels, limit, resume=resume, progress_callback=report_progress).run()
         duration = round(time.time() - start_time, 2)
-        await interaction.followup.send(f"過去ログ学習、完了！\n**処理:** {total_processed}件, **新規追加:** {total_added}件, **時間:** {duration}秒")
+        await interaction.followup.send(f"過去ログ学習、完了！\n**処理:** {pipeline.processed}件, **新規追加:** {pipeline.added}件, **時間:** {duration}秒, **速度:** {pipeline.throughput:.1f}件/秒")
 
     @app_commands.command(name="mood", description="チャンネルのムード状況を表示するわ（オーナー限定）")
     @app_commands.describe(channel="どのチャンネルのムードが知りたいわけ？（任意）")
@@ -348,5 +335,53 @@ class UserCommands(commands.Cog):
         embed.add_field(name="記録スコア数", value=f"`{len(channel_mood.get('scores', []))}`件 / 直近10件", inline=True)
         await interaction.response.send_message(embed=embed)
 
+    @app_commands.command(name="perf_stats", description="アタシの内部キャッシュの効き具合を見せてあげる（オーナー限定）")
+    @app_commands.check(is_owner)
+    async def perf_stats(self, interaction: discord.Interaction):
+        embed = discord.Embed(title="📊 パフォーマンス統計 📊", color=discord.Color.blurple())
+        emb = utils.get_embedding_cache_stats()
+        embed.add_field(name="埋め込みキャッシュ", value=f"ヒット率: `{emb['hit_rate']:.1%}`\nメモリ: `{emb['memory_hits']}` / ディスク: `{emb['disk_hits']}` / 相乗り: `{emb['coalesced']}` / ミス: `{emb['misses']}`\n保持: `{emb['memory_entries']}`件 (`{emb['memory_bytes'] // 1024}`KB)", inline=False)
+        batch = utils.get_embedding_batch_stats()
+        embed.add_field(name="埋め込みまとめ送り", value=f"リクエスト: `{batch['requests']}` / API呼び出し: `{batch['batches']}` (平均 `{batch['avg_batch_size']}`件)\n個別再送: `{batch['fallback_items']}` / 失敗: `{batch['errors']}`", inline=False)
+        search = utils.get_search_cache_stats()
+        embed.add_field(name="検索キャッシュ", value=f"ヒット率: `{search['hit_rate']:.1%}` / 節約したAPI呼び出し: `{search['api_calls_saved']}`回\nメモリ: `{search['memory_hits']}` / ディスク: `{search['disk_hits']}` / 相乗り: `{search['coalesced']}` / ミス: `{search['misses']}` / 障害時の古い結果: `{search['stale_served']}`", inline=False)
+        answers = answer_cache.get_stats()
+        embed.add_field(name="回答キャッシュ", value=f"ヒット率: `{answers['hit_rate']:.1%}` (`{answers['hits']}`/`{answers['lookups']}`) / 平均短縮: `{answers['avg_saved_ms']}`ms\n保持: `{answers['entries']}`件 / 使わず調べ直し: `{answers['bypassed']}` / 追い出し: `{answers['evictions']}` / 全消去: `{answers['invalidations']}`", inline=False)
+        dispatch = llm.get_stats()
+        lines = [f"{name}: 待ち `{c['queued']}` (最大 `{c['max_queued']}`) / 平均待ち `{c['avg_wait_ms']}`ms / 平均実行 `{c['avg_run_ms']}`ms / 完了 `{c['completed']}` / 失敗 `{c['failed']}` / 再試行 `{c['retries']}` / 切り捨て `{c['shed']}`" for name, c in dispatch['classes'].items()]
+        embed.add_field(name="LLMディスパッチャ", value=f"実行中: `{dispatch['running']}`/`{dispatch['max_concurrency']}` / 429: `{dispatch['rate_limited']}`回 / 一時停止残り: `{dispatch['paused_for']}`秒\n" + "\n".join(lines), inline=False)
+        routing = models.get_stats()
+        routes = " / ".join([f"{task}: " + ", ".join([f"{tier}×`{count}`" for tier, count in tiers.items()]) for task, tiers in routing['routed'].items()]) or "（まだ呼び出しなし）"
+        degraded = [f"{key} (残り`{h['degraded_for']}`秒)" for key, h in routing['health'].items() if h['degraded_for'] > 0]
+        embed.add_field(name="モデルの振り分け", value=(f"{routes}\nフォールバック: `{sum(routing['fallbacks'].values())}`回 / 格下げ中: " + (", ".join(degraded) or "なし"))[:1024], inline=False)
+        ai_chat = self.bot.get_cog('AIChat')
+        if ai_chat:
+            mood = ai_chat.mood_aggregator.get_stats()
+            embed.add_field(name="ムード分析まとめ採点", value=f"発言: `{mood['messages']}` / LLM呼び出し: `{mood['batches']}` (平均 `{mood['avg_batch_size']}`件)\n待機中: `{mood['buffered']}` / 後回し: `{mood['deferred']}` / 捨てた発言: `{mood['dropped']}` / 失敗: `{mood['errors']}`", inline=False)
+            rel = ai_chat.relationship_tracker.get_stats()
+            embed.add_field(name="関係性トピック抽出", value=f"発言: `{rel['messages']}` / LLM呼び出し: `{rel['extractions']}` / 使い回し: `{rel['cache_hits']}`\n記録したペア: `{rel['pairs_recorded']}` / 待機中チャンネル: `{rel['pending_channels']}` / 失敗: `{rel['errors']}`", inline=False)
+            spec = ai_chat.get_speculation_stats()
+            misses = " / ".join([f"{reason}: `{count}`" for reason, count in spec['misses'].items()]) or "`0`"
+            embed.add_field(name="記憶検索の先読み", value=f"的中率: `{spec['hit_rate']:.1%}` (`{spec['hits']}`/`{spec['started']}`) / 平均短縮: `{spec['avg_saved_ms']}`ms\n外れ: {misses}", inline=False)
+            gate = ai_chat.intervention_gate.get_stats()
+            embed.add_field(name="割り込み判定の足切り", value=f"クールダウン: `{gate['cooldown']}` / 短文: `{gate['too_short']}` / 文字n-gram: `{gate['lexical']}` / 予算切れ: `{gate['budget']}` / 埋め込み失敗: `{gate['no_embedding']}` / 類似度不足: `{gate['similarity']}` / 通過: `{gate['passed']}`\n埋め込み呼び出し: `{gate['embedding_calls']}`/`{gate['considered']}` (省けた割合 `{gate['embedding_skip_rate']:.1%}`)", inline=False)
+            context = ai_chat.context_gatherer.get_stats()
+            if context:
+                embed.add_field(name="応答コンテキストの取得", value="\n".join([f"{name}: 平均 `{c['avg_ms']}`ms / 最大 `{c['max_ms']}`ms / 締め切り超過: `{c['timeouts']}` / 失敗: `{c['errors']}`" for name, c in context.items()]), inline=False)
+            users = ai_chat.users.get_stats()
+            embed.add_field(name="ユーザー名の解決", value=f"メンバーキャッシュ: `{users['member_cache_hits']}` / ユーザーキャッシュ: `{users['user_cache_hits']}` / TTLキャッシュ: `{users['ttl_hits']}`\nREST呼び出し: `{users['fetches']}` / 見つからず: `{users['not_found']}` / 失敗: `{users['errors']}` / 時間切れ: `{users['timeouts']}`", inline=False)
+        scrape = utils.get_scraper_stats()
+        embed.add_field(name="Webページ本文抽出", value=f"取得: `{scrape['pages']}`ページ / キャッシュヒット: `{scrape['cache_hits']}` / 途中打ち切り: `{scrape['early_stops']}` / サイズ上限: `{scrape['size_capped']}`\nダウンロード量: `{scrape['bytes_downloaded'] // 1024}`KB / 保持: `{scrape['cached_pages']}`件", inline=False)
+        reflexes = persona_manager.get_reflex_stats()
+        embed.add_field(name="キーワード反射", value="\n".join([f"{pid}: 反射 `{r['reflexes']}`個 (キーワード `{r['keywords']}`) / 照合: `{r['messages']}` / ヒット: `{r['matched']}` / 返事: `{r['fired']}` / クールダウン中: `{r['cooled_down']}`" for pid, r in reflexes.items()])[:1024] or "なし", inline=False)
+        for kind, prompt in get_prompt_stats().items():
+            breakdown = " / ".join([f"{name}: `{section['tokens']}`" + ("✂" if section['state'] != 'full' else "") for name, section in prompt['last'].items()])
+            embed.add_field(name=f"プロンプト ({kind})", value=f"平均: `{prompt['avg_tokens']}`トークン (削る前 `{prompt['avg_original_tokens']}`) / 削った回数: `{prompt['trimmed_builds']}`/`{prompt['builds']}` / 予算超過: `{prompt['over_budget']}`\n直近: {breakdown}"[:1024], inline=False)
+        db_manager = self.bot.get_cog('DatabaseManager')
+        if db_manager:
+            vec = db_manager.executor.get_stats()
+            embed.add_field(name="ベクトルDBスレッドプール", value=f"実行中: `{vec['running']}`/`{vec['max_workers']}` / 待ち: `{vec['queued']}` (最大 `{vec['max_queued']}`)\n平均待ち: `{vec['avg_wait_ms']}`ms / 平均実行: `{vec['avg_run_ms']}`ms / 完了: `{vec['completed']}` / 失敗: `{vec['failed']}`", inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(UserCommands(bot))
@@ -7,68 +7,192 @@ import os
 from . import _utils as utils
 import traceback
 import itertools
+import asyncio
+import numpy as np
+from ._vector_executor import VectorStoreExecutor
+from ._cache import SingleFlight
 
 # -------------------- 設定項目 --------------------
 DB_PATH = os.getenv('RAILWAY_VOLUME_MOUNT_PATH', '.') + "/chroma_db"
 COLLECTION_NAME_PREFIX = "channel_history_"
 DISTANCE_THRESHOLD = 0.8
+ID_LOAD_PAGE_SIZE = 10000  # 起動時に保存済みIDを読み込むときの1回あたりの件数
+VECTOR_STORE_MAX_WORKERS = int(os.getenv('VECTOR_STORE_MAX_WORKERS', 4))  # ChromaDB操作の同時実行数
 # ----------------------------------------------------
 
+class MessageIdFilter:
+    """保存済みメッセージIDの集合。ソート済みのint64配列＋最近追加した分のsetで省メモリに持つ"""
+
+    MERGE_THRESHOLD = 4096
+
+    def __init__(self, ids=()):
+        self._sorted = np.unique(np.fromiter(self._as_ints(ids), dtype=np.int64))
+        self._recent = set()
+
+    @staticmethod
+    def _as_ints(ids):
+        for message_id in ids:
+            try: yield int(message_id)
+            except (TypeError, ValueError): continue
+
+    def __contains__(self, message_id):
+        try: message_id = int(message_id)
+        except (TypeError, ValueError): return True  # 判断できないものは「あるかも」扱い
+        if message_id in self._recent: return True
+        i = np.searchsorted(self._sorted, message_id)
+        return i < len(self._sorted) and self._sorted[i] == message_id
+
+    def add(self, ids):
+        self._recent.update(self._as_ints(ids))
+        if len(self._recent) >= self.MERGE_THRESHOLD:
+            self._sorted = np.union1d(self._sorted, np.fromiter(self._recent, dtype=np.int64))
+            self._recent.clear()
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
+
+
 class DatabaseManager(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.chroma_client = None
-        self.initialize_database()
+        self._collections = {}  # {collection_name: Collection}
+        self._id_filters = {}   # {collection_name: MessageIdFilter}
+        self.executor = VectorStoreExecutor(max_workers=VECTOR_STORE_MAX_WORKERS)
+        self._collection_loads = SingleFlight()
+
+    async def cog_load(self):
+        await self.initialize_database()
 
-    def initialize_database(self):
+    def cog_unload(self):
+        self.executor.shutdown()
+
+    async def initialize_database(self):
         print("Initializing ChromaDB Client...")
+        self._collections.clear()
+        self._id_filters.clear()
         try:
-            self.chroma_client = chromadb.PersistentClient(path=DB_PATH, settings=Settings(anonymized_telemetry=False))
+            self.chroma_client = await self.executor.run(chromadb.PersistentClient, path=DB_PATH, settings=Settings(anonymized_telemetry=False))
             print("ChromaDB Client initialized.")
         except Exception as e:
             print(f"FATAL: Failed to initialize ChromaDB Client: {e}")
+            return
+        try:
+            # 既存コレクションのハンドルと保存済みIDを先に読み込んでおく
+            for collection in await self._list_collections():
+                if collection.name.startswith(COLLECTION_NAME_PREFIX):
+                    await self._register_collection(collection)
+            print(f"Loaded {len(self._collections)} collection(s), {sum(len(f) for f in self._id_filters.values())} stored message ID(s).")
+        except Exception as e:
+            print(f"Warning: Failed to preload collections: {e}")
 
-    def get_channel_collection(self, channel_id: str):
+    def _load_id_filter(self, collection):
+        """（ワーカースレッドで実行）保存済みのIDを全部読んでIDフィルタを作る。共有の辞書には触らない"""
+        ids, offset = [], 0
+        while True:
+            page = collection.get(include=[], limit=ID_LOAD_PAGE_SIZE, offset=offset)['ids']
+            ids.extend(page)
+            if len(page) < ID_LOAD_PAGE_SIZE: break
+            offset += len(page)
+        return MessageIdFilter(ids)
+
+    async def _register_collection(self, collection):
+        id_filter = await self.executor.run(self._load_id_filter, collection)
+        # 辞書への登録はイベントループ側でだけ行う
+        self._collections[collection.name] = collection
+        self._id_filters[collection.name] = id_filter
+        return collection
+
+    async def get_channel_collection(self, channel_id: str):
         if not self.chroma_client: return None
         collection_name = f"{COLLECTION_NAME_PREFIX}{channel_id}"
-        return self.chroma_client.get_or_create_collection(name=collection_name)
+        collection = self._collections.get(collection_name)
+        if collection is None:
+            # 同じチャンネルの初回アクセスが重なっても、作成とID読み込みは1回だけにする
+            async def _open():
+                return await self._register_collection(await self.executor.run(self.chroma_client.get_or_create_collection, name=collection_name))
+            collection = await self._collection_loads.run(collection_name, _open)
+        return collection
+
+    # -------------------- ChromaDB操作の非同期ラッパー（すべて専用スレッドで実行） --------------------
+    async def _query(self, collection, **kwargs):
+        return await self.executor.run(collection.query, **kwargs)
+
+    async def _add(self, collection, **kwargs):
+        return await self.executor.run(collection.add, **kwargs)
+
+    async def _get(self, collection, **kwargs):
+        return await self.executor.run(collection.get, **kwargs)
+
+    async def _count(self, collection):
+        return await self.executor.run(collection.count)
 
-    def reset_all_collections(self):
+    async def _list_collections(self):
+        return await self.executor.run(self.chroma_client.list_collections)
+
+    async def reset_all_collections(self):
         if not self.chroma_client: raise Exception("ChromaDB client is not initialized.")
-        collections = self.chroma_client.list_collections()
         deleted_count = 0
-        for collection in collections:
+        for collection in await self._list_collections():
             if collection.name.startswith(COLLECTION_NAME_PREFIX):
-                self.chroma_client.delete_collection(name=collection.name)
+                await self.executor.run(self.chroma_client.delete_collection, name=collection.name)
                 deleted_count += 1
-        self.initialize_database()
+        await self.initialize_database()
         return deleted_count
 
     async def add_message_to_db(self, message: discord.Message):
-        if message.author.bot or not message.content or len(message.content) < 5:
-            return False
-        collection = self.get_channel_collection(str(message.channel.id))
-        if not collection: return False
-        try:
-            if collection.get(ids=[str(message.id)])['ids']: return False
-            embedding = await utils.get_embedding(message.content)
-            if not embedding: return False
-            metadata = {"author_id": str(message.author.id), "author_name": message.author.name, "timestamp": message.created_at.isoformat()}
-            collection.add(embeddings=[embedding], documents=[message.content], metadatas=[metadata], ids=[str(message.id)])
-            return True
-        except Exception as e:
-            print(f"Error adding message {message.id} to DB: {e}")
-            return False
+        added, _ = await self.add_messages_to_db([message])
+        return added > 0
+
+    async def add_messages_to_db(self, messages):
+        """
+        メッセージをチャンネルごとにまとめて保存する。(新規に追加できた件数, 保存に失敗したメッセージIDの集合) を返す。
+        Botの発言や短すぎる発言は保存しない決まりなので、失敗には含めない。
+        """
+        by_channel = {}
+        for message in messages:
+            if message.author.bot or not message.content or len(message.content) < 5: continue
+            by_channel.setdefault(str(message.channel.id), {})[str(message.id)] = message
+        added = 0
+        failed = set()
+        for channel_id, candidates in by_channel.items():
+            collection = await self.get_channel_collection(channel_id)
+            if not collection:
+                failed.update(message.id for message in candidates.values()); continue
+            try:
+                # IDフィルタで「確実に未保存」と分かるものはDBへの問い合わせを省く
+                id_filter = self._id_filters.get(collection.name)
+                maybe_stored = [message_id for message_id in candidates if id_filter is None or message_id in id_filter]
+                existing = set((await self._get(collection, ids=maybe_stored))['ids']) if maybe_stored else set()
+                new_messages = [m for message_id, m in candidates.items() if message_id not in existing]
+                if not new_messages: continue
+                embeddings = await utils.get_embeddings([m.content for m in new_messages])
+                rows = [(m, e) for m, e in zip(new_messages, embeddings) if e]
+                failed.update(m.id for m, e in zip(new_messages, embeddings) if not e)
+                if not rows: continue
+                await self._add(
+                    collection,
+                    embeddings=[e for _, e in rows],
+                    documents=[m.content for m, _ in rows],
+                    metadatas=[{"author_id": str(m.author.id), "author_name": m.author.name, "timestamp": m.created_at.isoformat()} for m, _ in rows],
+                    ids=[str(m.id) for m, _ in rows])
+                if id_filter is not None: id_filter.add(m.id for m, _ in rows)
+                added += len(rows)
+            except Exception as e:
+                print(f"Error adding {len(candidates)} messages to DB for channel {channel_id}: {e}")
+                failed.update(message.id for message in candidates.values())
+        return added, failed
 
     async def search_similar_messages(self, query_text: str, channel_id: str, author_id: str = None, top_k: int = 5):
-        collection = self.get_channel_collection(channel_id)
+        collection = await self.get_channel_collection(channel_id)
         if not collection or not query_text: return "（関連する過去ログは見つからなかったわ）"
         try:
-            if collection.count() == 0: return "（このチャンネルには、まだ何も記憶がないわ…）"
+            count = await self._count(collection)
+            if count == 0: return "（このチャンネルには、まだ何も記憶がないわ…）"
             query_embedding = await utils.get_embedding(query_text, task_type="RETRIEVAL_QUERY")
             if not query_embedding: return "（クエリのベクトル化に失敗して、検索できなかったわ）"
             where_filter = {"author_id": author_id} if author_id else {}
-            results = collection.query(query_embeddings=[query_embedding], n_results=min(top_k * 2, collection.count()), where=where_filter or None, include=["metadatas", "documents", "distances"])
+            results = await self._query(collection, query_embeddings=[query_embedding], n_results=min(top_k * 2, count), where=where_filter or None, include=["metadatas", "documents", "distances"])
             if not results or not results.get('documents') or not results['documents'][0]: return "（このチャンネルには、関連する過去ログはないみたい…）"
             found_logs = []
             for i, doc in enumerate(results['documents'][0]):
@@ -87,19 +211,28 @@ class DatabaseManager(commands.Cog):
         try:
             query_embedding = await utils.get_embedding(query_text, task_type="RETRIEVAL_QUERY")
             if not query_embedding: return "（クエリのベクトル化に失敗しました）"
-            all_results = []
-            for collection in self.chroma_client.list_collections():
+            targets = []
+            for collection in list(self._collections.values()):
                 try:
                     channel_id = int(collection.name.replace(COLLECTION_NAME_PREFIX, ""))
                     if guild.get_channel(channel_id) is None: continue
                 except (ValueError, TypeError): continue
-                if collection.count() == 0: continue
-                results = collection.query(query_embeddings=[query_embedding], n_results=min(top_k, collection.count()), include=["metadatas", "documents", "distances"])
+                targets.append((channel_id, collection))
+
+            async def query_channel(channel_id, collection):
+                count = await self._count(collection)
+                if count == 0: return []
+                results = await self._query(collection, query_embeddings=[query_embedding], n_results=min(top_k, count), include=["metadatas", "documents", "distances"])
+                found = []
                 if results and results.get('documents') and results['documents'][0]:
                     for i, doc in enumerate(results['documents'][0]):
                         distance = results['distances'][0][i]
                         if distance <= (DISTANCE_THRESHOLD * 0.95):
-                             all_results.append({"document": doc, "metadata": results['metadatas'][0][i], "distance": distance, "channel_id": channel_id})
+                             found.append({"document": doc, "metadata": results['metadatas'][0][i], "distance": distance, "channel_id": channel_id})
+                return found
+
+            # チャンネルごとの検索はスレッドプールの同時実行数の範囲で並列に走らせる
+            all_results = [r for found in await asyncio.gather(*[query_channel(c_id, col) for c_id, col in targets]) for r in found]
             if not all_results: return "（サーバー全体で関連性の高い過去ログは見つかりませんでした）"
             sorted_results = sorted(all_results, key=lambda x: x['distance'])
             found_logs = []
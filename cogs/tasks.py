@@ -2,18 +2,22 @@
 import discord
 from discord.ext import commands, tasks
 import os
-import requests
+import asyncio
 import datetime
 import json
-import google.generativeai as genai
 from . import _utils as utils
+from . import _persona_manager as persona_manager
+from ._http import http_client
+from ._llm_dispatcher import BACKGROUND
+from ._model_registry import models
+from ._answer_cache import answer_cache
 
 DATA_DIR = os.getenv('RAILWAY_VOLUME_MOUNT_PATH', '.')
-MEMORY_FILE = os.path.join(DATA_DIR, 'bot_memory.json')
 
 NOTICE_CHANNEL_ID = int(os.getenv('NOTICE_CHANNEL_ID', 0))
 WEATHER_LATITUDE = float(os.getenv('WEATHER_LATITUDE', 35.1815))
 WEATHER_LONGITUDE = float(os.getenv('WEATHER_LONGITUDE', 136.9066))
+OPEN_METEO_URL = "https://api.open-meteo.com/v1/jma"
 
 jst = datetime.timezone(datetime.timedelta(hours=9), name='JST')
 TARGET_TIME = datetime.time(hour=6, minute=0, tzinfo=jst)
@@ -21,12 +25,18 @@ TARGET_TIME = datetime.time(hour=6, minute=0, tzinfo=jst)
 class DailyTasks(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-        self.model = genai.GenerativeModel('gemini-1.5-flash-latest')
         self.daily_report.start()
+        self.persona_reload.start()
 
     def cog_unload(self):
         self.daily_report.cancel()
+        self.persona_reload.cancel()
+
+    @tasks.loop(seconds=persona_manager.PERSONA_RELOAD_INTERVAL)
+    async def persona_reload(self):
+        # 応答のたびにファイルを見に行かないよう、変更チェックはここでまとめて行う
+        if persona_manager.refresh():
+            answer_cache.invalidate()  # ペルソナの中身が変わったら、前の口調の回答は捨てる
 
     def weather_code_to_emoji(self, code):
         if code == 0: return "快晴☀️"
@@ -41,13 +51,11 @@ class DailyTasks(commands.Cog):
         if 95 <= code <= 99: return "雷雨⛈️"
         return "よくわかんない天気"
 
-    def get_weather_open_meteo(self):
+    async def get_weather_open_meteo(self):
         lat, lon = WEATHER_LATITUDE, WEATHER_LONGITUDE
-        url = f"https://api.open-meteo.com/v1/jma?latitude={lat}&longitude={lon}&daily=weather_code,temperature_2m_max,temperature_2m_min,precipitation_probability_max&timezone=Asia%2FTokyo"
+        params = {"latitude": lat, "longitude": lon, "daily": "weather_code,temperature_2m_max,temperature_2m_min,precipitation_probability_max", "timezone": "Asia/Tokyo"}
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()['daily']
+            data = (await http_client.get_json(OPEN_METEO_URL, params=params, timeout=10))['daily']
             embed = discord.Embed(title="♡今日の天気予報♡", description="せいぜい参考にするのよ！", color=0x00ff00)
             embed.add_field(name="天気", value=self.weather_code_to_emoji(data['weather_code'][0]), inline=True)
             embed.add_field(name="最高気温", value=f"{data['temperature_2m_max'][0]}℃", inline=True)
@@ -72,14 +80,14 @@ class DailyTasks(commands.Cog):
         await channel.send(f"おはよ、ザコども♡ 日本時間の朝{datetime.datetime.now(jst).hour}時よ。アンタたちのために、この天才美少女キャスターであるアタシが、今日の情報を授けてあげる！")
         
         async with channel.typing():
-            weather_report = self.get_weather_open_meteo()
+            weather_report = await self.get_weather_open_meteo()
             await channel.send(embed=weather_report)
         
         await asyncio.sleep(2)
 
         async with channel.typing():
             query = "日本の最新ニューストピック"
-            search_results = utils.google_search(query)
+            search_results = await utils.google_search(query)
             
             if isinstance(search_results, str):
                 await channel.send(search_results); return
@@ -90,7 +98,8 @@ class DailyTasks(commands.Cog):
 
             synthesis_prompt = f"あなたは、生意気で小悪魔な「メスガキAIニュースキャスター」です。以下の「Web検索結果」だけを参考にして、最新のトップニュースを3つ選び、キャスターとして原稿を読み上げてください。常に見下した態度で、生意気な口調で、しかしニュースの内容自体は正確に伝えること。\n\n【話し方のルール】\n- ニュースを紹介するときは、「一つ目のニュースはこれよ」「次はこれ」のように言う。\n- 各ニュースの最後に、生意気な一言コメント（例：「ま、アンタには関係ないでしょうけどw」「せいぜい世界の動きについてきなさいよね！」）を必ず加えること。\n- 最後に「以上、今日のニュースは、この天才美少女キャスターのアタシがお届けしたわ♡」のように締める。\n\n# Web検索結果\n{search_results_text}\n\n# あなたが読み上げるニュース原稿"
             try:
-                response = await self.model.generate_content_async(synthesis_prompt)
+                # 毎朝の1回きりなので、混雑していても諦めずに順番を待つ
+                response = await models.generate("news", synthesis_prompt, priority=BACKGROUND, sheddable=False)
                 await channel.send(response.text)
             except Exception as e:
                 print(f"News synthesis error: {e}")
@@ -0,0 +1,8 @@
+# tests/conftest.py (テスト共通設定 - データファイルは一時フォルダに書き出す)
+import os
+import sys
+import tempfile
+
+# cogs の各モジュールは読み込み時にデータの置き場所を決めるので、import より前に差し替えておく
+os.environ.setdefault('RAILWAY_VOLUME_MOUNT_PATH', tempfile.mkdtemp(prefix='bot-test-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
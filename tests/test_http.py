@@ -0,0 +1,134 @@
+# tests/test_http.py (共有HTTPクライアントの再試行・タイムアウトと、天気・検索の呼び出し経路の確認)
+import uuid
+import asyncio
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from cogs import _http, _utils, tasks
+from cogs._http import HttpClient, http_client
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(_http, "HTTP_BACKOFF_BASE", 0.01)
+
+
+async def _serve(handler):
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def _flaky(status, payload):
+    """最初の1回だけ status を返し、2回目からは payload を返すハンドラ"""
+    calls = []
+
+    async def handler(request):
+        calls.append(dict(request.query))
+        if len(calls) == 1: return web.Response(status=status, text="busy")
+        return web.json_response(payload)
+    return handler, calls
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_retries_then_succeeds(status):
+    async def scenario():
+        handler, calls = _flaky(status, {"ok": True})
+        server = await _serve(handler)
+        client = HttpClient()
+        try:
+            result = await client.get_json(str(server.make_url("/api")))
+        finally:
+            await client.close()
+            await server.close()
+        return result, calls, client.stats
+
+    result, calls, stats = asyncio.run(scenario())
+    assert result == {"ok": True}
+    assert len(calls) == 2
+    assert stats == {"requests": 2, "retries": 1, "errors": 0}
+
+
+def test_gives_up_after_retries():
+    async def scenario():
+        async def handler(request):
+            return web.Response(status=503, text="down")
+        server = await _serve(handler)
+        client = HttpClient(retries=1)
+        try:
+            with pytest.raises(_http.HttpError) as excinfo:
+                await client.get_json(str(server.make_url("/api")))
+        finally:
+            await client.close()
+            await server.close()
+        return excinfo.value, client.stats
+
+    error, stats = asyncio.run(scenario())
+    assert error.status == 503
+    assert stats == {"requests": 2, "retries": 1, "errors": 1}
+
+
+def test_timeout_is_retried_then_raised():
+    async def scenario():
+        async def handler(request):
+            await asyncio.sleep(1.0)
+            return web.json_response({})
+        server = await _serve(handler)
+        client = HttpClient(retries=1)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await client.get_json(str(server.make_url("/slow")), timeout=0.2)
+        finally:
+            await client.close()
+            await server.close()
+        return client.stats
+
+    stats = asyncio.run(scenario())
+    assert stats == {"requests": 2, "retries": 1, "errors": 1}
+
+
+def test_weather_path(monkeypatch):
+    daily = {"weather_code": [1], "temperature_2m_max": [25.1], "temperature_2m_min": [15.2], "precipitation_probability_max": [30]}
+
+    async def scenario():
+        handler, calls = _flaky(503, {"daily": daily})
+        server = await _serve(handler)
+        monkeypatch.setattr(tasks, "OPEN_METEO_URL", str(server.make_url("/v1/jma")))
+        try:
+            embed = await tasks.DailyTasks.__new__(tasks.DailyTasks).get_weather_open_meteo()
+        finally:
+            await http_client.close()
+            await server.close()
+        return embed, calls
+
+    embed, calls = asyncio.run(scenario())
+    assert embed.title == "♡今日の天気予報♡"
+    assert [field.value for field in embed.fields][1:] == ["25.1℃", "15.2℃", "30%"]
+    assert len(calls) == 2
+    assert calls[-1]["latitude"] == str(tasks.WEATHER_LATITUDE)
+    assert calls[-1]["timezone"] == "Asia/Tokyo"
+
+
+def test_search_path(monkeypatch):
+    items = [{"title": "t", "link": "https://example.com", "snippet": "s"}]
+    query = f"test-{uuid.uuid4().hex}"  # 検索キャッシュに当たらないよう毎回違うクエリにする
+    monkeypatch.setattr(_utils, "SEARCH_API_KEY", "key")
+    monkeypatch.setattr(_utils, "SEARCH_ENGINE_ID", "cx")
+
+    async def scenario():
+        handler, calls = _flaky(429, {"items": items})
+        server = await _serve(handler)
+        monkeypatch.setattr(_utils, "SEARCH_API_URL", str(server.make_url("/customsearch/v1")))
+        try:
+            result = await _utils.google_search(query, num_results=3)
+        finally:
+            await http_client.close()
+            await server.close()
+        return result, calls
+
+    result, calls = asyncio.run(scenario())
+    assert result == items
+    assert len(calls) == 2
+    assert calls[-1] == {"key": "key", "cx": "cx", "q": query, "num": "3"}
@@ -0,0 +1,29 @@
+# tests/test_model_registry.py (環境変数によるモデル設定の上書きの確認)
+from cogs import _model_registry
+
+
+def _apply(monkeypatch, **env):
+    tiers = {"pro": "p", "flash": "f", "lite": "l"}
+    routes = {"final_reply": ["flash", "lite"], "vision": ["pro", "flash"]}
+    monkeypatch.setattr(_model_registry, "MODEL_TIERS", tiers)
+    monkeypatch.setattr(_model_registry, "MODEL_ROUTES", routes)
+    for name in ("MODEL_TIERS", "MODEL_ROUTES"): monkeypatch.delenv(name, raising=False)
+    for name, value in env.items(): monkeypatch.setenv(name, value)
+    _model_registry._apply_env_overrides()
+    return tiers, routes
+
+
+def test_broken_json_keeps_defaults(monkeypatch):
+    tiers, routes = _apply(monkeypatch, MODEL_TIERS="{oops", MODEL_ROUTES="[]")
+    assert tiers == {"pro": "p", "flash": "f", "lite": "l"}
+    assert routes == {"final_reply": ["flash", "lite"], "vision": ["pro", "flash"]}
+
+
+def test_routes_must_name_known_tiers(monkeypatch):
+    tiers, routes = _apply(
+        monkeypatch,
+        MODEL_TIERS='{"turbo": "t"}',
+        MODEL_ROUTES='{"final_reply": ["turbo", "nope"], "vision": ["nope"], "news": ["lite"]}',
+    )
+    assert tiers["turbo"] == "t"
+    assert routes == {"final_reply": ["turbo"], "vision": ["pro", "flash"], "news": ["lite"]}
@@ -0,0 +1,50 @@
+# tests/test_scraper.py (本文抽出の文字コード判定の確認)
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from cogs._http import http_client
+from cogs._scraper import Scraper, make_decoder
+
+BODY = "<main><p>今日はいい天気ですね</p></main>"
+
+
+def _page(charset_decl):
+    return f'<html><head>{charset_decl}<title>t</title></head><body>{BODY}</body></html>'
+
+
+def test_make_decoder_prefers_header_then_meta():
+    head = _page('<meta charset="shift_jis">').encode('shift_jis')
+    assert make_decoder("euc-jp", head).decode("天気".encode("euc-jp")) == "天気"
+    assert make_decoder(None, head).decode("天気".encode("shift_jis")) == "天気"
+    http_equiv = b'<meta http-equiv="Content-Type" content="text/html; charset=EUC-JP">'
+    assert make_decoder(None, http_equiv).decode("天気".encode("euc-jp")) == "天気"
+
+
+def test_make_decoder_falls_back_to_utf8_on_unknown_charset():
+    decoder = make_decoder("x-unknown", b'<meta charset="also-unknown">')
+    assert decoder.decode("天気".encode("utf-8")) == "天気"
+
+
+def test_scrape_uses_meta_charset():
+    pages = {
+        "/sjis": _page('<meta charset="Shift_JIS">').encode('shift_jis'),
+        "/bogus": _page('<meta charset="no-such-codec">').encode('utf-8'),
+    }
+
+    async def handler(request):
+        # ヘッダーには charset を付けない
+        return web.Response(body=pages[request.path], headers={"Content-Type": "text/html"})
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/{name}", handler)
+        server = TestServer(app)
+        await server.start_server()
+        scraper = Scraper()
+        try:
+            return await scraper.scrape_many([str(server.make_url(path)) for path in pages])
+        finally:
+            await http_client.close()
+            await server.close()
+
+    assert asyncio.run(scenario()) == ["今日はいい天気ですね", "今日はいい天気ですね"]
@@ -0,0 +1,48 @@
+# tests/test_search_cache.py (検索キャッシュの古い結果返しとディスク障害時の挙動の確認)
+import asyncio
+from cogs import _search_cache
+from cogs._search_cache import SearchCache
+
+RESULTS = [{"title": "t", "link": "https://example.com"}]
+
+
+async def _failing_fetch(query, num_results):
+    return "（検索エラー）"
+
+
+def _cache(tmp_path, persist=True):
+    return SearchCache(path=str(tmp_path / "search.sqlite3"), ttl=60, persist=persist)
+
+
+def test_serves_stale_memory_within_max_age(tmp_path):
+    cache = _cache(tmp_path, persist=False)
+    cache.memory.set("5:q", RESULTS, age=120)
+    assert asyncio.run(cache.get_or_fetch("q", 5, _failing_fetch)) == RESULTS
+    assert cache.stats["stale_served"] == 1
+
+
+def test_does_not_serve_memory_older_than_max_age(tmp_path):
+    cache = _cache(tmp_path, persist=False)
+    cache.memory.set("5:q", RESULTS, age=_search_cache.SEARCH_CACHE_STALE_MAX_AGE + 1)
+    assert asyncio.run(cache.get_or_fetch("q", 5, _failing_fetch)) == "（検索エラー）"
+    assert cache.stats["stale_served"] == 0
+
+
+def test_disk_round_trip_and_read_error(tmp_path):
+    cache = _cache(tmp_path)
+
+    async def fetch(query, num_results):
+        return RESULTS
+
+    async def scenario():
+        await cache.get_or_fetch("q", 5, fetch)
+        # 書き込みと読み込みは同じ1本のスレッドに順番に並ぶので、書いた後の値が読める
+        return await cache._disk_get_async("5:q")
+
+    stored = asyncio.run(scenario())
+    assert stored[0] == RESULTS
+    with cache._lock:
+        cache._conn.execute("DROP TABLE search_results")
+    # テーブルが壊れていても例外にせず、キャッシュなし扱いにする
+    assert asyncio.run(cache._disk_get_async("5:q")) is None
+    cache.close()
@@ -0,0 +1,94 @@
+# tests/test_vector_executor.py (ChromaDB呼び出しがイベントループを止めないことの確認)
+import time
+import asyncio
+import threading
+from cogs.database_manager import DatabaseManager
+from cogs._vector_executor import VectorStoreExecutor
+
+QUERY_SECONDS = 0.3
+
+
+class SlowCollection:
+    """query() が同期的に時間のかかる、ChromaDBのコレクションの代わり"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def query(self, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(QUERY_SECONDS)
+            return {"documents": [["ok"]], "kwargs": kwargs}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def make_manager(max_workers):
+    manager = DatabaseManager(bot=None)
+    manager.executor.shutdown()
+    manager.executor = VectorStoreExecutor(max_workers=max_workers)
+    return manager
+
+
+def test_event_loop_stays_responsive_during_slow_query():
+    manager = make_manager(max_workers=1)
+    collection = SlowCollection()
+
+    async def scenario():
+        ticks = []
+        running = True
+
+        async def ticker():
+            while running:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        ticker_task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        started_at = time.monotonic()
+        result = await manager._query(collection, query_embeddings=[[0.0]], n_results=1)
+        finished_at = time.monotonic()
+        running = False
+        await ticker_task
+        return result, ticks, started_at, finished_at
+
+    try:
+        result, ticks, started_at, finished_at = asyncio.run(scenario())
+    finally:
+        manager.executor.shutdown()
+    assert result["documents"] == [["ok"]]
+    assert finished_at - started_at >= QUERY_SECONDS
+    during = [t for t in ticks if started_at <= t <= finished_at]
+    # ループが止まっていれば、問い合わせ中のティックは0〜1回しか進まない
+    assert len(during) >= 10
+    assert max(b - a for a, b in zip(during, during[1:])) < QUERY_SECONDS / 2
+
+
+def test_executor_respects_concurrency_limit_and_reports_queue():
+    manager = make_manager(max_workers=2)
+    collection = SlowCollection()
+
+    async def scenario():
+        tasks = [asyncio.create_task(manager._query(collection, n_results=1)) for _ in range(5)]
+        await asyncio.sleep(QUERY_SECONDS / 3)
+        mid = manager.executor.get_stats()
+        await asyncio.gather(*tasks)
+        return mid, manager.executor.get_stats()
+
+    try:
+        mid, final = asyncio.run(scenario())
+    finally:
+        manager.executor.shutdown()
+    assert collection.max_active == 2
+    assert mid["running"] == 2
+    assert mid["queued"] == 3
+    assert final["max_queued"] >= 3
+    assert final["queued"] == 0 and final["running"] == 0
+    assert final["completed"] == 5 and final["failed"] == 0
+    # 後から入った3件は、前の問い合わせが終わるまで待たされている
+    assert final["max_wait"] >= QUERY_SECONDS * 0.9